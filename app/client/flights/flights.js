@@ -1,4 +1,36 @@
 (function() {
+  function itineraryRows(itinerary) {
+      // Itinerary header
+      let html = `
+          <tr class="itinerary-header">
+              <td colspan="12" style="background-color: #f0f0f0; font-weight: bold;">
+                  ${itinerary.year} Q${itinerary.quarter} &mdash; Itinerary ID: ${itinerary.ItinID}
+              </td>
+          </tr>
+      `;
+
+      // Flights of this itinerary
+      itinerary.flights.forEach(flight => {
+          html += `
+              <tr>
+                  <td>${flight.year}</td>
+                  <td>${flight.quarter}</td>
+                  <td>${flight.ItinID}</td>
+                  <td>${flight.SeqNum}</td>
+                  <td>${flight.Coupons}</td>
+                  <td>${flight.Origin}</td>
+                  <td>${flight.Dest}</td>
+                  <td>${flight.CouponType}</td>
+                  <td>${flight.TkCarrier}</td>
+                  <td>${flight.OpCarrier}</td>
+                  <td>${flight.RPCarrier}</td>
+                  <td>${flight.Passengers}</td>
+              </tr>
+          `;
+      });
+      return html;
+  }
+
   async function loadFlights() {
       const contentDisplay = document.getElementById('flights-data');
       const progressOverlay = document.getElementById('progress-overlay');
@@ -10,50 +42,46 @@
           progressOverlay.style.display = 'flex';
           progressBar.style.width = '0%';
 
-          // Fetch data
-          console.log('Fetching flights...');
-          const response = await fetch('/api/flights/stream');
-          const data = await response.json();
-          
-          progressBar.style.width = '90%';
-          progressText.textContent = 'Rendering data...';
-
-          // Convert grouped data into HTML
-          let html = '';
-          for (const [itinId, flights] of Object.entries(data)) {
-              // Add itinerary header
-              html += `
-                  <tr class="itinerary-header">
-                      <td colspan="12" style="background-color: #f0f0f0; font-weight: bold;">
-                          Itinerary ID: ${itinId}
-                      </td>
-                  </tr>
-              `;
-              
-              // Add flights for this itinerary
-              flights.forEach(flight => {
-                  html += `
-                      <tr>
-                          <td>${flight.year}</td>
-                          <td>${flight.quarter}</td>
-                          <td>${flight.ItinID}</td>
-                          <td>${flight.SeqNum}</td>
-                          <td>${flight.Coupons}</td>
-                          <td>${flight.Origin}</td>
-                          <td>${flight.Dest}</td>
-                          <td>${flight.CouponType}</td>
-                          <td>${flight.TkCarrier}</td>
-                          <td>${flight.OpCarrier}</td>
-                          <td>${flight.RPCarrier}</td>
-                          <td>${flight.Passengers}</td>
-                      </tr>
-                  `;
-              });
+          // The server sends one itinerary per line (NDJSON); render each
+          // block of lines as it arrives instead of waiting for the whole body
+          const limit = new URLSearchParams(window.location.search).get('limit') || 100;
+          const response = await fetch(`/api/flights/stream?limit=${encodeURIComponent(limit)}`);
+          if (!response.ok) {
+              const error = await response.json();
+              throw new Error(error.error || response.statusText);
           }
 
-          contentDisplay.innerHTML = html;
+          const reader = response.body.getReader();
+          const decoder = new TextDecoder();
+          let pending = '';
+          let count = 0;
+          contentDisplay.innerHTML = '';
+
+          while (true) {
+              const { done, value } = await reader.read();
+              pending += decoder.decode(value || new Uint8Array(), { stream: !done });
+              const lines = pending.split('\n');
+              // The last piece is an incomplete line until more data arrives
+              pending = done ? '' : lines.pop();
+
+              let html = '';
+              for (const line of lines) {
+                  if (!line) continue;
+                  const itinerary = JSON.parse(line);
+                  if (itinerary.error) throw new Error(itinerary.error);
+                  html += itineraryRows(itinerary);
+                  count++;
+              }
+              if (html) {
+                  contentDisplay.insertAdjacentHTML('beforeend', html);
+                  progressBar.style.width = `${Math.min(100, 100 * count / limit)}%`;
+                  progressText.textContent = `Loaded ${count} itineraries...`;
+              }
+              if (done) break;
+          }
 
           progressBar.style.width = '100%';
+          progressText.textContent = `Loaded ${count} itineraries`;
           setTimeout(() => {
               progressOverlay.style.display = 'none';
           }, 500);
@@ -66,4 +94,4 @@
 
   // Start loading when page loads
   loadFlights();
-})();
\ No newline at end of file
+})();
@@ -1,8 +1,7 @@
 (function() {
     // Configuration
     const config = {
-        chunkSize: 100000,
-        maxSafeSize: 5 * 1024 * 1024,
+        pageRows: 1000,
         folders: ['coupon', 'market']
     };
 
@@ -10,7 +9,8 @@
     let state = {
         currentFile: null,
         fileContent: '',
-        currentOffset: 0,
+        currentRow: 0,
+        totalRows: 0,
         folderData: new Map()
     };
 
@@ -90,72 +90,39 @@
 
     // Load and display file
     async function loadFile(folder, filename) {
+        state.currentFile = {folder, filename};
+        state.currentRow = 0;
+        state.totalRows = 0;
+        await loadRows();
+    }
+
+    // Fetch one page of rows; the server seeks straight to the first row,
+    // so the file is never downloaded as a whole
+    async function loadRows() {
         const contentDisplay = document.getElementById('content-display');
         const progressOverlay = document.getElementById('progress-overlay');
         const progressBar = document.getElementById('progress-bar');
         const progressText = document.getElementById('progress-text');
+        const {folder, filename} = state.currentFile;
 
         try {
-            // Reset state
-            state.currentOffset = 0;
-            state.fileContent = '';
             progressBar.style.width = '0%';
-            
-            // Show progress overlay
+            progressText.textContent = `Loading rows ${state.currentRow + 1} to ${state.currentRow + config.pageRows}...`;
             progressOverlay.style.display = 'flex';
 
-            // Check file size
-            const headResponse = await fetch(`/api/data/${folder}/${filename}`, {
-                method: 'HEAD'
-            });
-            
-            const fileSize = parseInt(headResponse.headers.get('content-length'));
-            
-            if (fileSize > config.maxSafeSize) {
-                const shouldLoad = confirm(
-                    `This file is large (${formatSize(fileSize)}) and may take a while to load. ` +
-                    `Would you like to proceed?`
-                );
-                if (!shouldLoad) {
-                    progressOverlay.style.display = 'none';
-                    return;
-                }
+            const params = new URLSearchParams({start: state.currentRow, count: config.pageRows});
+            const response = await fetch(`/api/data/rows/${folder}/${filename}?${params}`);
+            if (!response.ok) {
+                const error = await response.json();
+                throw new Error(error.error || `HTTP ${response.status}`);
             }
 
-            // Fetch file content with progress tracking
-            const response = await fetch(`/api/data/${folder}/${filename}`);
-            if (!response.ok) throw new Error(`HTTP ${response.status}`);
-
-            const reader = response.body.getReader();
-            let receivedLength = 0;
-            const chunks = [];
-
-            while (true) {
-                const {done, value} = await reader.read();
-                
-                if (done) break;
-                
-                chunks.push(value);
-                receivedLength += value.length;
-                
-                // Update progress
-                const progress = (receivedLength / fileSize) * 100;
-                progressBar.style.width = `${progress}%`;
-                progressText.textContent = 
-                    `Downloaded ${formatSize(receivedLength)} of ${formatSize(fileSize)} ` +
-                    `(${Math.round(progress)}%)`;
-            }
-
-            // Combine chunks and convert to text
-            const allChunks = new Uint8Array(receivedLength);
-            let position = 0;
-            for (const chunk of chunks) {
-                allChunks.set(chunk, position);
-                position += chunk.length;
-            }
-            
-            state.fileContent = new TextDecoder().decode(allChunks);
-            state.currentFile = {folder, filename};
+            const page = await response.json();
+            state.totalRows = page.total_rows;
+            state.fileContent = [page.columns, ...page.rows]
+                .map(row => row.join(page.delimiter))
+                .join('\n');
+            progressBar.style.width = '100%';
 
             // Display content with pagination
             displayContent();
@@ -174,7 +141,7 @@
     // Display content with pagination
     function displayContent() {
         const contentDisplay = document.getElementById('content-display');
-        const totalPages = Math.ceil(state.fileContent.length / config.chunkSize);
+        const totalPages = Math.ceil(state.totalRows / config.pageRows);
         
         // Create container
         contentDisplay.innerHTML = '';
@@ -188,17 +155,13 @@
         // Add content
         const content = document.createElement('div');
         content.className = 'file-content';
-        const chunk = state.fileContent.slice(
-            state.currentOffset,
-            state.currentOffset + config.chunkSize
-        );
-        content.textContent = chunk;
+        content.textContent = state.fileContent;
         contentDisplay.appendChild(content);
     }
 
     // Create pagination controls
     function createPagination(totalPages) {
-        const currentPage = Math.floor(state.currentOffset / config.chunkSize) + 1;
+        const currentPage = Math.floor(state.currentRow / config.pageRows) + 1;
         
         const container = document.createElement('div');
         container.className = 'pagination';
@@ -207,9 +170,9 @@
         prevButton.textContent = 'Previous';
         prevButton.disabled = currentPage === 1;
         prevButton.addEventListener('click', () => {
-            if (state.currentOffset >= config.chunkSize) {
-                state.currentOffset -= config.chunkSize;
-                displayContent();
+            if (state.currentRow >= config.pageRows) {
+                state.currentRow -= config.pageRows;
+                loadRows();
             }
         });
         
@@ -217,15 +180,16 @@
         nextButton.textContent = 'Next';
         nextButton.disabled = currentPage === totalPages;
         nextButton.addEventListener('click', () => {
-            if (state.currentOffset + config.chunkSize < state.fileContent.length) {
-                state.currentOffset += config.chunkSize;
-                displayContent();
+            if (state.currentRow + config.pageRows < state.totalRows) {
+                state.currentRow += config.pageRows;
+                loadRows();
             }
         });
         
         const info = document.createElement('div');
         info.className = 'pagination-info';
-        info.textContent = `Page ${currentPage} of ${totalPages}`;
+        info.textContent = `Page ${currentPage} of ${totalPages} ` +
+            `(${state.totalRows.toLocaleString()} rows)`;
         
         container.appendChild(prevButton);
         container.appendChild(info);
@@ -234,20 +198,6 @@
         return container;
     }
 
-    // Format file size
-    function formatSize(bytes) {
-        const units = ['B', 'KB', 'MB', 'GB'];
-        let size = bytes;
-        let unitIndex = 0;
-        
-        while (size >= 1024 && unitIndex < units.length - 1) {
-            size /= 1024;
-            unitIndex++;
-        }
-        
-        return `${size.toFixed(1)} ${units[unitIndex]}`;
-    }
-
     // Start the application
     init();
 })();
\ No newline at end of file
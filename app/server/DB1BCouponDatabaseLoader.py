@@ -1,24 +1,134 @@
-import requests
 import pandas as pd
+import numpy as np
 import zipfile
-import io
+import os
 import sqlite3
-from datetime import datetime, time
 import signal
 import sys
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import hashlib
+from itertools import repeat
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import multiprocessing
 import logging
-from pathlib import Path
+import queue
 from config_reader import ConfigReader
+from archive_cache import ArchiveCache
+from archive_io import download_archive_file, make_session, find_csv_member, MemberReader
+from flights_writer import BulkFlightsWriter, FlightsWriter, ParquetFlightsWriter
+from flights_parquet import (DEFAULT_COMPRESSION, DEFAULT_PARQUET_DIR, DEFAULT_ROW_GROUP_SIZE, chunk_table,
+                             require_pyarrow)
+from flights_schema import (COMPACT, LAYOUTS, STANDARD, bump_data_generation, create_flights_table,
+                            create_manifest_table, create_secondary_indexes, detect_layout, manifest_status)
+from flights_summary import create_summary_tables
+from schema_manager import prepare_database
+from db1b_schema import C_ENGINE, COUPON_DTYPES, configured_engine, read_csv_chunks
 import time
 
+# Lookup tables for the vectorized ItinID encoder
+HEX_DIGITS = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+POWERS_OF_10 = 10 ** np.arange(19, dtype=np.int64)
+POWERS_OF_16 = 16 ** np.arange(16, dtype=np.int64)
+
+# Where ingest writes coupons: the flights table, or a year/quarter partitioned Parquet dataset
+SQLITE_SINK = 'sqlite'
+PARQUET_SINK = 'parquet'
+SINKS = (SQLITE_SINK, PARQUET_SINK)
+
+# Dataset names of the coupon loads in ingest_manifest, one per sink
+COUPON_DATASET = 'db1b_coupon'
+COUPON_PARQUET_DATASET = 'db1b_coupon_parquet'
+
+COUPON_COLUMNS = ['ItinID', 'SeqNum', 'Coupons', 'Origin', 'Dest',
+                  'CouponType', 'TkCarrier', 'OpCarrier', 'RPCarrier', 'Passengers']
+
+# Shared with each parse worker process by init_parse_worker
+_batches = None
+_stop_event = None
+
+def init_parse_worker(batches, stop_event):
+    """Process pool initializer: keep the writer queue and leave Ctrl+C to the parent"""
+    global _batches, _stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _batches = batches
+    _stop_event = stop_event
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+def parse_archive(archive_path: str, year: int, quarter: int, chunk_size: int,
+                  reject_file: str, layout: str = STANDARD,
+                  source: Optional[Dict[str, Any]] = None,
+                  sink: str = SQLITE_SINK, engine: str = C_ENGINE) -> Optional[Dict[str, int]]:
+    """Parse a quarter's archive in a worker process and queue record batches for the writer.
+
+    source describes the archive (url, size, sha256) for the ingest manifest.
+    Batches are lists of tuples for the SQLite sink and pyarrow tables for
+    the Parquet sink.
+    Returns the record counts, or None if the ingest was stopped first.
+    """
+    logger = logging.getLogger(__name__)
+    key = (year, quarter)
+    _batches.put(('start', key, source or {}))
+    processed_records = 0
+    rejected_records = 0
+    if os.path.exists(reject_file):
+        os.remove(reject_file)
+    
+    try:
+        with zipfile.ZipFile(archive_path) as z:
+            csv_info = find_csv_member(z)
+            logger.info(f"Parsing {year} Q{quarter} from {csv_info.filename} ({csv_info.file_size:,} bytes)")
+            last_update = time.time()
+            
+            with MemberReader(z, csv_info) as reader:
+                for chunk in read_csv_chunks(reader, COUPON_COLUMNS, COUPON_DTYPES, chunk_size, engine):
+                    if _stop_event.is_set():
+                        _batches.put(('abort', key, 'ingest stopped'))
+                        return None
+                    
+                    # Encode ItinID and prepare records
+                    if sink == PARQUET_SINK:
+                        records, rejected = DB1BCouponDatabaseLoader.build_table(chunk)
+                    else:
+                        records, rejected = DB1BCouponDatabaseLoader.build_records(chunk, year, quarter, layout)
+                    if len(rejected):
+                        DB1BCouponDatabaseLoader.write_rejects(rejected, reject_file)
+                        rejected_records += len(rejected)
+                    
+                    _batches.put(('batch', key, records))
+                    processed_records += len(records)
+                    
+                    # Update progress every 20 seconds, measured in bytes of the CSV consumed
+                    current_time = time.time()
+                    if current_time - last_update >= 20:
+                        logger.info(f"{year} Q{quarter}: parsed {processed_records:,} records ({reader.progress:.1f}%)")
+                        last_update = current_time
+    except Exception as e:
+        _batches.put(('abort', key, str(e)))
+        raise
+    
+    stats = {'records': processed_records, 'rejected': rejected_records}
+    _batches.put(('commit', key, stats))
+    return stats
+
 class DB1BCouponDatabaseLoader:
-    def __init__(self, config: ConfigReader, db_path='flights.db'):
+    def __init__(self, config: ConfigReader, db_path='flights.db', reject_dir='data/rejects'):
         self.config = config
-        self.session = requests.Session()
+        self.session = make_session(self.config.download_config)
+        self.cache = ArchiveCache.from_config(self.config.download_config)
         self.should_exit = False
         self.db_path = db_path
+        self.reject_dir = reject_dir
+        self.sink = self.config.ingest_config.get('sink', SQLITE_SINK)
+        if self.sink not in SINKS:
+            raise ValueError(f"Unknown ingest.sink '{self.sink}', expected one of {SINKS}")
+        if self.sink == PARQUET_SINK:
+            require_pyarrow()
+        self.dataset = COUPON_PARQUET_DATASET if self.sink == PARQUET_SINK else COUPON_DATASET
+        self.csv_engine = configured_engine(self.config.csv_config)
         self.setup_logging()
         self.initialize_db()
         
@@ -41,33 +151,31 @@ class DB1BCouponDatabaseLoader:
         """Initialize database with required schema"""
         try:
             with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+                # An existing database keeps its layout; ingest.schema only applies to new ones
+                requested = self.config.ingest_config.get('schema', STANDARD)
+                if requested not in LAYOUTS:
+                    raise ValueError(f"Unknown ingest.schema '{requested}', expected one of {LAYOUTS}")
+                existing = detect_layout(conn)
+                if existing is not None and existing != requested:
+                    self.logger.warning(f"{self.db_path} uses the {existing} schema, ignoring ingest.schema: {requested}")
+                self.layout = existing or requested
                 
                 # Create the main flights table with optimized types
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS flights (
-                        year INTEGER NOT NULL,
-                        quarter INTEGER NOT NULL CHECK (quarter BETWEEN 1 AND 4),
-                        ItinID CHAR(6) NOT NULL,  -- Hex encoded, without year prefix
-                        SeqNum INTEGER NOT NULL,
-                        Coupons INTEGER NOT NULL,
-                        Origin CHAR(3) NOT NULL,   -- Airport codes are always 3 chars
-                        Dest CHAR(3) NOT NULL,     -- Airport codes are always 3 chars
-                        CouponType CHAR(1) NOT NULL,
-                        TkCarrier CHAR(2) NOT NULL,
-                        OpCarrier CHAR(2) NOT NULL,
-                        RPCarrier CHAR(2) NOT NULL,
-                        Passengers REAL NOT NULL,
-                        PRIMARY KEY (year, quarter, ItinID, SeqNum)
-                    )
-                ''')
+                create_flights_table(conn, self.layout)
                 
                 # Create indices for common query patterns
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_temporal ON flights(year, quarter)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_route ON flights(Origin, Dest)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_carriers ON flights(TkCarrier, OpCarrier)')
+                create_secondary_indexes(conn)
+                
+                # Track which quarters are loaded
+                create_manifest_table(conn)
                 
-                self.logger.info("Database initialized successfully")
+                # Route and carrier totals, maintained as each quarter commits
+                upgraded = create_summary_tables(conn, self.layout)
+                if upgraded:
+                    bump_data_generation(conn)
+                    self.logger.info(f"Summarized {len(upgraded)} quarter(s) of flights missing from the summaries")
+                
+                self.logger.info(f"Database initialized successfully ({self.layout} schema)")
                 
         except sqlite3.Error as e:
             self.logger.error(f"Error initializing database: {e}")
@@ -77,28 +185,26 @@ class DB1BCouponDatabaseLoader:
         self.logger.info("\nReceived interrupt signal. Cleaning up...")
         self.should_exit = True
 
-    def download_with_progress(self, url: str) -> bytes:
-        download_config = self.config.download_config
-        response = self.session.get(
-            url, 
-            stream=True,
-            verify=download_config['verify_ssl'],
-            timeout=30
-        )
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        block_size = 8192
-        buffer = io.BytesIO()
-        
-        with tqdm(total=total_size, unit='iB', unit_scale=True, desc="Downloading") as pbar:
-            for chunk in response.iter_content(block_size):
-                if self.should_exit:
-                    raise KeyboardInterrupt()
-                buffer.write(chunk)
-                pbar.update(len(chunk))
-                
-        return buffer.getvalue()
+    def download_to_file(self, url: str) -> Dict[str, Any]:
+        """Download an archive to a file that parse workers can open.
+
+        Returns the file's path along with the url, size and sha256 recorded
+        in the ingest manifest. With the archive cache enabled the path points
+        into the cache; hand it to release_archive() once parsing is done.
+        """
+        if self.cache is not None:
+            return self.cache.fetch(self.session, url, self.config.download_config, lambda: self.should_exit)
+        hasher = hashlib.sha256()
+        path = download_archive_file(self.session, url, self.config.download_config,
+                                     lambda: self.should_exit, hasher)
+        return {'path': path, 'url': url, 'size': os.path.getsize(path), 'sha256': hasher.hexdigest()}
+
+    def release_archive(self, path: str) -> None:
+        """Unpin a cached archive, or remove a temporary one"""
+        if self.cache is not None:
+            self.cache.release(path)
+        else:
+            os.remove(path)
 
     @staticmethod
     def encode_itin_id(itin_id: str) -> str:
@@ -111,132 +217,271 @@ class DB1BCouponDatabaseLoader:
         except (ValueError, IndexError) as e:
             raise ValueError(f"Invalid ItinID format: {itin_id}") from e
 
-    def process_data(self, year: int, quarter: int) -> None:
-        url = f"{self.config.base_url}_{year}_{quarter}.zip"
-        try:
-            self.logger.info(f"\nProcessing {year} Q{quarter} data...")
-            zip_data = self.download_with_progress(url)
-            self.logger.info("\nExtracting data...")
-            
-            with zipfile.ZipFile(io.BytesIO(zip_data)) as z:
-                csv_name = [name for name in z.namelist() if name.endswith('.csv')][0]
-                self.logger.info(f"Found CSV: {csv_name}")
-                
-                try:
-                    columns = ['ItinID', 'SeqNum', 'Coupons', 'Origin', 'Dest', 
-                             'CouponType', 'TkCarrier', 'OpCarrier', 'RPCarrier', 'Passengers']
-                    
-                    # First pass to count total records
-                    total_records = 0
-                    for chunk in pd.read_csv(z.open(csv_name), usecols=columns, chunksize=500000):
-                        total_records += len(chunk)
-                    self.logger.info(f"Total records to process: {total_records:,}")
-                    
-                    processed_records = 0
-                    chunk_size = 500000  # Process 500k rows at a time
-                    last_update = time.time()
-                    
-                    with sqlite3.connect(self.db_path) as conn:
-                        # Start transaction
-                        conn.execute('BEGIN TRANSACTION')
-                        
-                        # Process each chunk
-                        for chunk in pd.read_csv(z.open(csv_name), usecols=columns, chunksize=chunk_size):
-                            if self.should_exit:
-                                raise KeyboardInterrupt()
-                            
-                            # Convert ItinID to hex and prepare records
-                            records = []
-                            for _, row in chunk.iterrows():
-                                try:
-                                    encoded_itin = self.encode_itin_id(row['ItinID'])
-                                    records.append((
-                                        year, 
-                                        quarter,
-                                        encoded_itin,
-                                        row['SeqNum'],
-                                        row['Coupons'],
-                                        row['Origin'],
-                                        row['Dest'],
-                                        row['CouponType'],
-                                        row['TkCarrier'],
-                                        row['OpCarrier'],
-                                        row['RPCarrier'],
-                                        row['Passengers']
-                                    ))
-                                except ValueError as e:
-                                    self.logger.warning(f"Skipping record: {e}")
-                                    continue
-                            
-                            # Insert batch
-                            conn.executemany('''
-                                INSERT OR REPLACE INTO flights 
-                                (year, quarter, ItinID, SeqNum, Coupons,
-                                Origin, Dest, CouponType, TkCarrier, OpCarrier,
-                                RPCarrier, Passengers)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', records)
-                            
-                            processed_records += len(records)
-                            
-                            # Update progress every 20 seconds
-                            current_time = time.time()
-                            if current_time - last_update >= 20:
-                                progress = (processed_records / total_records) * 100
-                                self.logger.info(f"Processed {processed_records:,} of {total_records:,} records ({progress:.1f}%)")
-                                last_update = current_time
-                        
-                        # Commit transaction
-                        conn.commit()
-                        
-                    self.logger.info(f"\nProcessing complete! Total records processed: {processed_records:,}")
-                    
-                except KeyboardInterrupt:
-                    self.logger.info("\nInterrupt received during processing. Rolling back...")
-                    if 'conn' in locals():
-                        conn.rollback()
-                    return
-                    
-        except Exception as e:
-            self.logger.error(f"Error processing {year} Q{quarter}: {str(e)}")
-            raise
+    @staticmethod
+    def split_itin_ids(itin_ids: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """Strip the year prefix from a whole ItinID column.
+
+        Returns the numeric unique parts of the valid rows and a boolean mask
+        over the input marking which rows were valid. Missing, negative or
+        too-short IDs and text that is not 1 to 18 digits are invalid.
+        """
+        if pd.api.types.is_integer_dtype(itin_ids):
+            # Missing IDs in a nullable column become 0, which is rejected below
+            values = itin_ids.to_numpy(dtype=np.int64, na_value=0)
+            valid = np.ones(len(values), dtype=bool)
+        else:
+            # Parsed as integers, not floats, which only hold IDs below 2**53 exactly
+            text = itin_ids.astype(str)
+            valid = text.str.fullmatch(r'\d{1,18}').to_numpy(dtype=bool)
+            values = np.zeros(len(text), dtype=np.int64)
+            values[valid] = text[valid].astype(np.int64).to_numpy()
+        
+        # Drop the year prefix: keep the value modulo 10**(digits - 4)
+        digits = np.searchsorted(POWERS_OF_10, values, side='right')
+        valid &= (values > 0) & (digits > 4)
+        return values[valid] % POWERS_OF_10[digits[valid] - 4], valid
+
+    @staticmethod
+    def encode_itin_ids(itin_ids: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized encode_itin_id for a whole column.
+
+        Returns the hex encoded IDs of the valid rows and the validity mask
+        from split_itin_ids.
+        """
+        unique, valid = DB1BCouponDatabaseLoader.split_itin_ids(itin_ids)
+        
+        # Hex digits as a (rows, width) byte matrix, padded to at least 6 digits
+        widths = np.maximum(np.searchsorted(POWERS_OF_16, unique, side='right'), 6)
+        max_width = int(widths.max()) if len(widths) else 6
+        shifts = 4 * np.arange(max_width - 1, -1, -1, dtype=np.int64)
+        chars = HEX_DIGITS[(unique[:, None] >> shifts) & 0xF]
+        
+        encoded = np.empty(len(unique), dtype=object)
+        for width in np.unique(widths):
+            rows = widths == width
+            block = np.ascontiguousarray(chars[rows, max_width - width:])
+            encoded[rows] = block.view(f'S{width}').ravel().astype(f'U{width}')
+        return encoded, valid
+
+    @staticmethod
+    def build_records(chunk: pd.DataFrame, year: int, quarter: int,
+                      layout: str = STANDARD) -> Tuple[List[tuple], pd.DataFrame]:
+        """Build insert tuples for a chunk, returning (records, rejected rows).
+
+        For the compact layout ItinID stays numeric and Passengers is rounded
+        to an integer; airport and carrier codes are mapped to surrogate keys
+        by the writer.
+        """
+        if layout == COMPACT:
+            itin_ids, valid = DB1BCouponDatabaseLoader.split_itin_ids(chunk['ItinID'])
+        else:
+            itin_ids, valid = DB1BCouponDatabaseLoader.encode_itin_ids(chunk['ItinID'])
+        rejected = chunk[~valid]
+        if len(rejected):
+            chunk = chunk[valid]
+        
+        passengers = chunk['Passengers']
+        if layout == COMPACT:
+            passengers = passengers.round().astype(np.int64)
+        
+        records = list(zip(
+            repeat(year),
+            repeat(quarter),
+            itin_ids.tolist(),
+            chunk['SeqNum'].tolist(),
+            chunk['Coupons'].tolist(),
+            chunk['Origin'].tolist(),
+            chunk['Dest'].tolist(),
+            chunk['CouponType'].tolist(),
+            chunk['TkCarrier'].tolist(),
+            chunk['OpCarrier'].tolist(),
+            chunk['RPCarrier'].tolist(),
+            passengers.tolist()
+        ))
+        return records, rejected
+
+    @staticmethod
+    def build_table(chunk: pd.DataFrame):
+        """Build a pyarrow table for the Parquet sink, returning (table, rejected rows)"""
+        itin_ids, valid = DB1BCouponDatabaseLoader.split_itin_ids(chunk['ItinID'])
+        rejected = chunk[~valid]
+        if len(rejected):
+            chunk = chunk[valid]
+        return chunk_table(chunk, itin_ids), rejected
+
+    def reject_path(self, year: int, quarter: int) -> str:
+        return os.path.join(self.reject_dir, f"DB1BCoupon_{year}_{quarter}.rejects.csv")
+
+    @staticmethod
+    def write_rejects(rejected: pd.DataFrame, reject_file: str) -> None:
+        """Append rejected rows to a quarter's reject file"""
+        os.makedirs(os.path.dirname(reject_file), exist_ok=True)
+        rejected.to_csv(reject_file, mode='a', header=not os.path.exists(reject_file), index=False)
 
-    def process_all(self):
-        pairs = self.config.get_download_pairs()
-        max_workers = self.config.download_config['max_concurrent']
-        self.logger.info(f"Starting download of {len(pairs)} quarter(s) with {max_workers} concurrent downloads")
+    def process_data(self, year: int, quarter: int, force: bool = False) -> None:
+        self.ingest([(year, quarter)], force)
+
+    def process_all(self, force: bool = False):
+        self.ingest(self.config.get_download_pairs(), force)
+
+    def pending_pairs(self, pairs: List[Tuple[int, int]], force: bool = False) -> List[Tuple[int, int]]:
+        """Drop pairs the manifest records as complete, unless force is set"""
+        with sqlite3.connect(self.db_path) as conn:
+            status = manifest_status(conn, self.dataset)
+        
+        if force:
+            return pairs
+        skipped = [pair for pair in pairs if status.get(pair) == 'complete']
+        if skipped:
+            self.logger.info(f"Skipping {len(skipped)} quarter(s) already loaded: "
+                             f"{', '.join(f'{year} Q{quarter}' for year, quarter in skipped)}")
+        resumed = [pair for pair in pairs if status.get(pair) in ('loading', 'failed')]
+        if resumed:
+            self.logger.info(f"Resuming {len(resumed)} incomplete quarter(s): "
+                             f"{', '.join(f'{year} Q{quarter}' for year, quarter in resumed)}")
+        return [pair for pair in pairs if status.get(pair) != 'complete']
+
+    @staticmethod
+    def send(batches, writer, message) -> None:
+        """Queue a message for the writer, giving up once the writer thread has exited"""
+        while writer.is_alive():
+            try:
+                batches.put(message, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    @staticmethod
+    def drain(batches) -> None:
+        while True:
+            try:
+                batches.get_nowait()
+            except queue.Empty:
+                return
+
+    def ingest(self, pairs: List[Tuple[int, int]], force: bool = False) -> None:
+        """Load year-quarter pairs through a download -> parse -> write pipeline.
+
+        Archives are downloaded by a thread pool, parsed and encoded by a
+        process pool, and written by a single FlightsWriter thread that owns
+        the SQLite connection and reads record batches from a bounded queue.
+        Quarters already complete in ingest_manifest are skipped unless force
+        is set.
+        """
+        pairs = self.pending_pairs(pairs, force)
+        if not pairs:
+            self.logger.info("All requested quarters are already loaded. Nothing to do.")
+            return
+        
+        ingest_config = self.config.ingest_config
+        download_workers = self.config.download_config['max_concurrent']
+        parse_workers = ingest_config.get('parse_workers') or os.cpu_count()
+        chunk_size = ingest_config.get('chunk_size', 500000)
+        self.logger.info(f"Starting ingest of {len(pairs)} quarter(s) with {download_workers} concurrent downloads "
+                         f"and {parse_workers} parse workers")
+        
+        context = multiprocessing.get_context('spawn')
+        batches = context.Queue(maxsize=ingest_config.get('queue_size', 4))
+        stop_event = context.Event()
+        if self.sink == PARQUET_SINK:
+            parquet_dir = ingest_config.get('parquet_dir') or DEFAULT_PARQUET_DIR
+            self.logger.info(f"Writing Parquet partitions under {parquet_dir}")
+            writer = ParquetFlightsWriter(self.db_path, batches, stop_event, self.logger, parquet_dir, self.dataset,
+                                          ingest_config.get('parquet_row_group_size', DEFAULT_ROW_GROUP_SIZE),
+                                          ingest_config.get('parquet_compression', DEFAULT_COMPRESSION))
+        elif ingest_config.get('bulk_load'):
+            self.logger.info("Bulk-load mode: staging tables, deferred indexes")
+            writer = BulkFlightsWriter(self.db_path, batches, stop_event, self.logger, self.layout,
+                                       self.dataset, cache_size_mb=ingest_config.get('cache_size_mb', 512))
+        else:
+            writer = FlightsWriter(self.db_path, batches, stop_event, self.logger, self.layout, self.dataset)
+        writer.start()
         
         try:
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = []
+            with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+                    ProcessPoolExecutor(max_workers=parse_workers, mp_context=context,
+                                        initializer=init_parse_worker,
+                                        initargs=(batches, stop_event)) as parsers:
+                tasks = {}
                 for year, quarter in pairs:
-                    if self.should_exit:
-                        break
-                    futures.append(executor.submit(self.process_data, year, quarter))
+                    url = f"{self.config.base_url}_{year}_{quarter}.zip"
+                    self.logger.info(f"Downloading {year} Q{quarter} data...")
+                    tasks[downloads.submit(self.download_to_file, url)] = ('download', year, quarter, None)
                 
-                for future in as_completed(futures):
-                    try:
-                        if self.should_exit:
-                            executor.shutdown(wait=False, cancel_futures=True)
-                            break
-                        future.result()
-                    except KeyboardInterrupt:
-                        self.logger.info("\nInterrupt received, shutting down...")
-                        executor.shutdown(wait=False, cancel_futures=True)
-                        return
-                    except Exception as e:
-                        self.logger.error(f"Error in download: {str(e)}")
-                        
-        except KeyboardInterrupt:
-            self.logger.info("\nInterrupt received, shutting down gracefully...")
-            if 'executor' in locals():
-                executor.shutdown(wait=False, cancel_futures=True)
-            return
+                pending = set(tasks)
+                while pending:
+                    done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                    if self.should_exit and not stop_event.is_set():
+                        self.logger.info("\nInterrupt received, stopping workers...")
+                        stop_event.set()
+                    if not writer.is_alive():
+                        if not stop_event.is_set():
+                            self.logger.error("Writer exited early, stopping workers...")
+                            stop_event.set()
+                        # Parse workers blocked on a full queue would never see the stop event
+                        self.drain(batches)
+                    
+                    for future in done:
+                        stage, year, quarter, archive_path = tasks.pop(future)
+                        if stage == 'download':
+                            try:
+                                source = future.result()
+                            except KeyboardInterrupt:
+                                continue
+                            except Exception as e:
+                                self.logger.error(f"Error downloading {year} Q{quarter}: {str(e)}")
+                                self.send(batches, writer, ('abort', (year, quarter), f"Download failed: {str(e)}"))
+                                continue
+                            archive_path = source.pop('path')
+                            if stop_event.is_set():
+                                self.release_archive(archive_path)
+                                continue
+                            parse = parsers.submit(parse_archive, archive_path, year, quarter, chunk_size,
+                                                   self.reject_path(year, quarter), self.layout, source, self.sink,
+                                                   self.csv_engine)
+                            tasks[parse] = ('parse', year, quarter, archive_path)
+                            pending.add(parse)
+                        else:
+                            try:
+                                stats = future.result()
+                                if stats and stats['rejected']:
+                                    self.logger.warning(f"Rejected {stats['rejected']:,} records with invalid ItinID, "
+                                                        f"see {self.reject_path(year, quarter)}")
+                            except Exception as e:
+                                self.logger.error(f"Error processing {year} Q{quarter}: {str(e)}")
+                                # A worker that died outright could not report the abort itself
+                                self.send(batches, writer, ('abort', (year, quarter), str(e)))
+                            finally:
+                                self.release_archive(archive_path)
+        finally:
+            writer_lost = not writer.is_alive()
+            self.send(batches, writer, None)
+            writer.join()
+        
+        if writer.error is not None:
+            raise writer.error
+        if writer_lost:
+            raise RuntimeError("The writer thread exited before the ingest finished")
+        if self.should_exit:
+            self.logger.info("\nProcessing stopped by user.")
+        else:
+            self.logger.info(f"\nProcessing complete! Committed {len(writer.committed)} of {len(pairs)} quarter(s)")
+        
+        # Leave the indexes and planner statistics ready for the API
+        if self.sink == SQLITE_SINK and writer.committed:
+            result = prepare_database(self.db_path, timeout=60)
+            if result['analyzed']:
+                self.logger.info("Refreshed planner statistics")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load DB1B Coupon data into flights.db")
+    parser.add_argument('--force', action='store_true',
+                        help="Reload quarters even if the ingest manifest marks them complete")
+    args = parser.parse_args()
+    
     config = ConfigReader()
     loader = DB1BCouponDatabaseLoader(config)
     try:
-        loader.process_all()
+        loader.process_all(force=args.force)
     except KeyboardInterrupt:
         sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,279 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, BinaryIO, Callable, Dict, Optional
+from urllib.parse import urlparse
+import requests
+from archive_io import download_to_path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cache')
+DEFAULT_CACHE_MAX_SIZE_MB = 8192
+
+# Partial downloads and their progress files untouched for this long are removed during eviction
+STALE_PART_SECONDS = 24 * 60 * 60
+
+# How often a process waiting for another one's download checks should_exit
+LOCK_POLL_SECONDS = 0.5
+
+def try_lock(f: BinaryIO, shared: bool = False) -> bool:
+    """Lock an open file without blocking; False if another handle holds a conflicting lock.
+
+    msvcrt has no shared locks, so on Windows every lock is exclusive.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def unlock(f: BinaryIO) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class ArchiveCache:
+    """On-disk cache of BTS archives shared by the coupon, market and database downloaders.
+
+    Each archive is stored under its URL's file name next to a .json sidecar
+    with the URL, ETag, Last-Modified, size, SHA-256 and last use time. A
+    cached archive is revalidated with If-None-Match/If-Modified-Since and
+    only downloaded again when the server sends a new copy; archives from
+    servers that send neither validator are downloaded every time. Downloads
+    go to a .part file in the cache directory and are moved into place with
+    os.replace, so other processes never see a partial archive; an
+    interrupted download resumes from its .part file on the next fetch.
+    Revalidating, downloading and replacing an entry happen under a lock on
+    its .lock file, so when several scripts fetch the same archive one
+    downloads it and the others wait and then find it not modified.
+    Beyond max_size_mb the least recently used archives are evicted. A
+    fetched archive stays pinned until it is released, with a shared lock
+    on its .pin file that keeps every process from evicting it; eviction
+    skips entries whose .lock or .pin file another handle holds.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_size_mb: float = DEFAULT_CACHE_MAX_SIZE_MB):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.pinned = Counter()
+        self.pin_files: Dict[str, BinaryIO] = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, download_config: Dict[str, Any]) -> Optional['ArchiveCache']:
+        """Build the cache described by the download section, or None if it is disabled"""
+        if not download_config.get('cache_enabled', True):
+            return None
+        return cls(download_config.get('cache_dir'),
+                   download_config.get('cache_max_size_mb', DEFAULT_CACHE_MAX_SIZE_MB))
+
+    def entry_path(self, url: str) -> str:
+        # BTS archive names are unique per dataset and quarter; a same-named
+        # archive from another host simply fails revalidation and is replaced
+        name = os.path.basename(urlparse(url).path) or hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, name)
+
+    @staticmethod
+    def read_meta(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(f"{path}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, path: str, meta: Dict[str, Any]) -> None:
+        fd, tmp = tempfile.mkstemp(suffix='.part', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(meta, f, indent=2)
+            os.replace(tmp, f"{path}.json")
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def fetch(self, session: requests.Session, url: str, download_config: Dict[str, Any],
+              should_exit: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        """Return the cached archive for url, downloading it only if it changed upstream.
+
+        The result holds the archive's path, url, size and sha256. The path
+        stays pinned against eviction until release() is called with it.
+        """
+        path = self.entry_path(url)
+        # Eviction skips the entry while its lock is held, and the pin is
+        # taken before letting go of it
+        with self.entry_lock(path, should_exit):
+            meta = self.revalidate(session, url, download_config, path, should_exit)
+            meta['last_used'] = time.time()
+            self.write_meta(path, meta)
+            self.pin(path)
+
+        self.evict()
+        return {'path': path, 'url': url, 'size': meta['size'], 'sha256': meta['sha256']}
+
+    @contextlib.contextmanager
+    def entry_lock(self, path: str, should_exit: Optional[Callable[[], bool]] = None):
+        """Hold the cross-process lock of a cache entry, waiting for any process that holds it"""
+        with open(f"{path}.lock", 'a+b') as f:
+            if not try_lock(f):
+                self.logger.info(f"Waiting for another process to fetch {os.path.basename(path)}")
+                while not try_lock(f):
+                    if should_exit is not None and should_exit():
+                        raise KeyboardInterrupt()
+                    time.sleep(LOCK_POLL_SECONDS)
+            try:
+                yield
+            finally:
+                unlock(f)
+
+    def revalidate(self, session: requests.Session, url: str, download_config: Dict[str, Any],
+                   path: str, should_exit: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        meta = self.read_meta(path)
+        if meta is not None and not os.path.exists(path):
+            meta = None
+
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        hasher = hashlib.sha256()
+        part = f"{path}.part"
+        try:
+            response_headers = download_to_path(session, url, download_config, part, should_exit, hasher,
+                                                headers, resume=True)
+        except requests.RequestException as e:
+            # The .part file is kept so the next attempt can resume it
+            if meta is None:
+                raise
+            self.logger.warning(f"Could not revalidate {url}, using cached copy: {str(e)}")
+            return meta
+
+        if response_headers is None:
+            self.logger.info(f"Using cached {os.path.basename(path)} (not modified upstream)")
+            return meta
+
+        os.replace(part, path)
+        return {
+            'url': url,
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'size': os.path.getsize(path),
+            'sha256': hasher.hexdigest(),
+            'downloaded_at': time.time(),
+        }
+
+    def pin(self, path: str) -> None:
+        with self.lock:
+            if not self.pinned[path]:
+                f = open(f"{path}.pin", 'a+b')
+                # On Windows another process's pin may already hold the lock,
+                # which protects the entry just as well
+                try_lock(f, shared=True)
+                self.pin_files[path] = f
+            self.pinned[path] += 1
+
+    def release(self, path: str) -> None:
+        """Unpin an archive returned by fetch()"""
+        with self.lock:
+            self.pinned[path] -= 1
+            if self.pinned[path] <= 0:
+                del self.pinned[path]
+                self.pin_files.pop(path).close()
+
+    def open_archive(self, session: requests.Session, url: str, download_config: Dict[str, Any],
+                     should_exit: Optional[Callable[[], bool]] = None) -> BinaryIO:
+        """Fetch url through the cache and return the archive opened for reading.
+
+        An open file keeps working even if the archive is evicted or replaced
+        afterwards, so the path does not need to stay pinned.
+        """
+        path = self.fetch(session, url, download_config, should_exit)['path']
+        try:
+            return open(path, 'rb')
+        finally:
+            self.release(path)
+
+    def evict(self) -> None:
+        """Remove least recently used archives until the cache fits in max_size"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            full = os.path.join(self.cache_dir, name)
+            if name.endswith(('.part', '.part.json')):
+                try:
+                    if now - os.path.getmtime(full) > STALE_PART_SECONDS:
+                        os.remove(full)
+                except OSError:
+                    pass
+            elif not name.endswith('.json') and os.path.exists(f"{full}.json"):
+                meta = self.read_meta(full) or {}
+                try:
+                    entries.append((meta.get('last_used', 0), os.path.getsize(full), full))
+                except OSError:
+                    continue
+
+        total = sum(size for _, size, _ in entries)
+        with self.lock:
+            for _, size, full in sorted(entries):
+                if total <= self.max_size:
+                    break
+                if full in self.pinned or not self.remove_unused(full):
+                    continue
+                total -= size
+                self.logger.info(f"Evicted {os.path.basename(full)} from the archive cache")
+
+    @staticmethod
+    def remove_unused(path: str) -> bool:
+        """Remove an archive and its metadata unless a process is fetching it or has it pinned"""
+        with open(f"{path}.lock", 'a+b') as lock, open(f"{path}.pin", 'a+b') as pin:
+            if not try_lock(lock):
+                return False
+            try:
+                if not try_lock(pin):
+                    return False
+                try:
+                    for target in (f"{path}.json", path):
+                        try:
+                            os.remove(target)
+                        except OSError:
+                            pass
+                    return True
+                finally:
+                    unlock(pin)
+            finally:
+                unlock(lock)
+
+if __name__ == "__main__":
+    from config_reader import ConfigReader
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    cache = ArchiveCache.from_config(ConfigReader().download_config)
+    if cache is None:
+        print("Archive cache is disabled")
+    else:
+        for name in sorted(os.listdir(cache.cache_dir)):
+            full = os.path.join(cache.cache_dir, name)
+            meta = None if name.endswith('.json') else cache.read_meta(full)
+            if meta:
+                print(f"{name}: {meta['size']:,} bytes, sha256 {meta['sha256'][:12]}, "
+                      f"ETag {meta.get('etag')}, Last-Modified {meta.get('last_modified')}")
@@ -0,0 +1,359 @@
+import io
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, BinaryIO, Callable, Dict, List, Optional
+import backoff
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from tqdm import tqdm
+
+DEFAULT_SPOOL_MAX_MEMORY_MB = 64
+DEFAULT_BLOCK_SIZE_KB = 1024
+DEFAULT_MIN_SEGMENT_MB = 16
+DEFAULT_TIMEOUT = 30
+
+# Seconds between saves of a range download's progress
+STATE_SAVE_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+def make_session(download_config: Dict[str, Any]) -> requests.Session:
+    """Session with a connection pool sized for max_concurrent downloads of max_segments each"""
+    session = requests.Session()
+    pool_size = max(download_config.get('max_concurrent', 1), 1) * max(download_config.get('max_segments', 1), 1)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def is_retryable(error: Exception) -> bool:
+    """Connection errors, timeouts, truncated bodies and 429/5xx answers are worth retrying"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+def with_retries(download_config: Dict[str, Any], func: Callable) -> Callable:
+    """Wrap func to retry transient HTTP errors with exponential backoff.
+
+    Makes up to download.retry_attempts tries, waiting about
+    download.retry_delay seconds after the first failure and doubling from there.
+    """
+    def log_retry(details):
+        logger.warning(f"Retrying in {details['wait']:.1f}s after attempt {details['tries']} failed: "
+                       f"{str(details['exception'])}")
+
+    return backoff.on_exception(
+        backoff.expo,
+        requests.RequestException,
+        max_tries=max(download_config.get('retry_attempts', 1), 1),
+        factor=download_config.get('retry_delay', 1),
+        giveup=lambda e: not is_retryable(e),
+        on_backoff=log_retry,
+        logger=None
+    )(func)
+
+def block_size(download_config: Dict[str, Any]) -> int:
+    return int(download_config.get('block_size_kb', DEFAULT_BLOCK_SIZE_KB) * 1024)
+
+def stream_to_file(session: requests.Session, url: str, download_config: Dict[str, Any],
+                   target: BinaryIO, should_exit: Optional[Callable[[], bool]] = None,
+                   hasher=None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    """Stream url into an open binary file with a progress bar, feeding hasher if given.
+
+    Returns the closed response so callers can inspect its status and headers;
+    nothing is written for a 304 Not Modified answer to a conditional request.
+    """
+    response = session.get(
+        url,
+        stream=True,
+        verify=download_config['verify_ssl'],
+        timeout=download_config.get('timeout', DEFAULT_TIMEOUT),
+        headers=headers
+    )
+    try:
+        response.raise_for_status()
+        if response.status_code == 304:
+            return response
+        
+        total_size = int(response.headers.get('content-length', 0))
+        
+        with tqdm(total=total_size, unit='iB', unit_scale=True, desc="Downloading") as pbar:
+            for chunk in response.iter_content(block_size(download_config)):
+                if should_exit is not None and should_exit():
+                    raise KeyboardInterrupt()
+                target.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                pbar.update(len(chunk))
+    finally:
+        response.close()
+    return response
+
+def download_archive(session: requests.Session, url: str, download_config: Dict[str, Any],
+                     should_exit: Optional[Callable[[], bool]] = None) -> BinaryIO:
+    """Stream url into a spooled temporary file.
+
+    The archive stays in memory up to download.spool_max_memory_mb and rolls
+    over to a temporary file in download.spool_dir (system default if unset)
+    beyond that, so peak memory no longer grows with archive size. The
+    returned file is positioned at the start and can be handed straight to
+    zipfile.ZipFile; closing it discards the data.
+    """
+    max_memory = int(download_config.get('spool_max_memory_mb', DEFAULT_SPOOL_MAX_MEMORY_MB) * 1024 * 1024)
+    archive = tempfile.SpooledTemporaryFile(max_size=max_memory, dir=download_config.get('spool_dir'))
+    
+    def attempt():
+        archive.seek(0)
+        archive.truncate()
+        stream_to_file(session, url, download_config, archive, should_exit)
+    
+    try:
+        with_retries(download_config, attempt)()
+    except BaseException:
+        archive.close()
+        raise
+    
+    archive.seek(0)
+    return archive
+
+def download_archive_file(session: requests.Session, url: str, download_config: Dict[str, Any],
+                          should_exit: Optional[Callable[[], bool]] = None, hasher=None) -> str:
+    """Stream url into a named temporary file in download.spool_dir and return its path.
+
+    Used when the archive has to be opened by another process. The caller
+    owns the file and is responsible for removing it.
+    """
+    fd, path = tempfile.mkstemp(suffix='.zip', dir=download_config.get('spool_dir'))
+    os.close(fd)
+    try:
+        download_to_path(session, url, download_config, path, should_exit, hasher)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def download_to_path(session: requests.Session, url: str, download_config: Dict[str, Any], path: str,
+                     should_exit: Optional[Callable[[], bool]] = None, hasher=None,
+                     headers: Optional[Dict[str, str]] = None,
+                     resume: bool = False) -> Optional[CaseInsensitiveDict]:
+    """Download url to path, in concurrent Range segments when the server supports them.
+
+    A HEAD request (conditional if headers are given) finds the size and
+    whether ranges are accepted. Servers without range support get a single
+    streamed GET, retried from the start; otherwise RangeDownload fetches up
+    to download.max_segments segments of at least download.min_segment_mb
+    each. With resume, an interrupted range download of the same archive
+    continues from its saved progress. hasher is fed the finished file.
+
+    Returns the HEAD response headers, or None if the server answered 304.
+    """
+    def head():
+        response = session.head(url, verify=download_config['verify_ssl'], allow_redirects=True,
+                                timeout=download_config.get('timeout', DEFAULT_TIMEOUT), headers=headers)
+        response.raise_for_status()
+        return response
+    
+    probe = with_retries(download_config, head)()
+    if probe.status_code == 304:
+        return None
+    
+    size = int(probe.headers.get('Content-Length', 0))
+    if probe.headers.get('Accept-Ranges', '').lower() == 'bytes' and size > 0:
+        RangeDownload(session, url, download_config, path, size, probe.headers, should_exit).run(resume)
+    else:
+        def attempt():
+            with open(path, 'wb') as target:
+                stream_to_file(session, url, download_config, target, should_exit)
+        with_retries(download_config, attempt)()
+    
+    if hasher is not None:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(block_size(download_config)), b''):
+                hasher.update(chunk)
+    return probe.headers
+
+class ArchiveChanged(Exception):
+    """The archive changed upstream while its segments were being downloaded"""
+
+class RangeDownload:
+    """Download of one archive as concurrent HTTP Range segments over a shared session.
+
+    The target file is preallocated and each segment writes its own byte
+    range through a separate handle. Progress is saved to a JSON state file
+    next to the target, so a resumed download continues each segment where
+    it stopped as long as the server still reports the same size, ETag and
+    Last-Modified. Segments are retried independently with backoff; a failed
+    segment does not restart the others. Range requests carry If-Range, so
+    an archive replaced upstream mid-download raises ArchiveChanged instead
+    of mixing two versions.
+    """
+
+    def __init__(self, session: requests.Session, url: str, download_config: Dict[str, Any], path: str,
+                 size: int, validators: CaseInsensitiveDict,
+                 should_exit: Optional[Callable[[], bool]] = None):
+        self.session = session
+        self.url = url
+        self.download_config = download_config
+        self.path = path
+        self.state_path = f"{path}.json"
+        self.size = size
+        self.etag = validators.get('ETag')
+        self.last_modified = validators.get('Last-Modified')
+        self.should_exit = should_exit
+        self.lock = threading.Lock()
+        # Serializes writes of the state file, which every segment thread may trigger
+        self.save_lock = threading.Lock()
+        self.segments: List[List[int]] = []
+        self.last_save = 0.0
+
+    def plan_segments(self) -> List[List[int]]:
+        """Split the archive into [start, end, done] segments, end inclusive"""
+        max_segments = max(self.download_config.get('max_segments', 1), 1)
+        min_segment = int(self.download_config.get('min_segment_mb', DEFAULT_MIN_SEGMENT_MB) * 1024 * 1024)
+        count = max(1, min(max_segments, math.ceil(self.size / max(min_segment, 1))))
+        length = math.ceil(self.size / count)
+        return [[start, min(start + length, self.size) - 1, 0] for start in range(0, self.size, length)]
+
+    def load_state(self) -> Optional[List[List[int]]]:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (state.get('size') != self.size or state.get('etag') != self.etag
+                or state.get('last_modified') != self.last_modified
+                or not os.path.exists(self.path) or os.path.getsize(self.path) != self.size):
+            return None
+        return state['segments']
+
+    def save_state(self, due_only: bool = False) -> None:
+        """Write progress to the state file; with due_only, only if STATE_SAVE_INTERVAL has passed since the last save"""
+        with self.save_lock:
+            if due_only and time.time() - self.last_save < STATE_SAVE_INTERVAL:
+                return  # Another segment saved while this one waited
+            with self.lock:
+                state = {'url': self.url, 'size': self.size, 'etag': self.etag,
+                         'last_modified': self.last_modified, 'segments': [list(s) for s in self.segments]}
+            tmp = f"{self.state_path}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+            self.last_save = time.time()
+
+    def run(self, resume: bool = False) -> None:
+        segments = self.load_state() if resume else None
+        if segments is None:
+            with open(self.path, 'wb') as f:
+                f.truncate(self.size)
+            segments = self.plan_segments()
+        else:
+            logger.info(f"Resuming {os.path.basename(self.url)} from "
+                        f"{sum(s[2] for s in segments) / self.size * 100:.1f}%")
+        self.segments = segments
+        
+        remaining = [segment for segment in self.segments if segment[0] + segment[2] <= segment[1]]
+        fetch = with_retries(self.download_config, self.fetch_segment)
+        try:
+            with tqdm(total=self.size, initial=sum(s[2] for s in self.segments), unit='iB', unit_scale=True,
+                      desc=f"Downloading ({len(remaining)} segments)") as pbar, \
+                    ThreadPoolExecutor(max_workers=max(len(remaining), 1)) as pool:
+                futures = [pool.submit(fetch, segment, pbar) for segment in remaining]
+                for future in as_completed(futures):
+                    future.result()
+        except ArchiveChanged:
+            self.discard_state()
+            raise
+        except BaseException:
+            self.save_state()
+            raise
+        self.discard_state()
+
+    def discard_state(self) -> None:
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def fetch_segment(self, segment: List[int], pbar: tqdm) -> None:
+        start, end, done = segment
+        headers = {'Range': f"bytes={start + done}-{end}"}
+        # If-Range only accepts a strong ETag, so fall back to Last-Modified for weak ones
+        validator = self.etag if self.etag and not self.etag.startswith('W/') else self.last_modified
+        if validator:
+            headers['If-Range'] = validator
+        
+        response = self.session.get(self.url, stream=True, headers=headers,
+                                    verify=self.download_config['verify_ssl'],
+                                    timeout=self.download_config.get('timeout', DEFAULT_TIMEOUT))
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise ArchiveChanged(f"{self.url} changed upstream during download")
+            
+            with open(self.path, 'r+b') as target:
+                target.seek(start + segment[2])
+                for chunk in response.iter_content(block_size(self.download_config)):
+                    if self.should_exit is not None and self.should_exit():
+                        raise KeyboardInterrupt()
+                    chunk = chunk[:end + 1 - start - segment[2]]
+                    target.write(chunk)
+                    target.flush()  # Saved progress must never run ahead of the file
+                    with self.lock:
+                        segment[2] += len(chunk)
+                    pbar.update(len(chunk))
+                    if time.time() - self.last_save >= STATE_SAVE_INTERVAL:
+                        self.save_state(due_only=True)
+        finally:
+            response.close()
+        
+        if start + segment[2] <= end:
+            raise requests.exceptions.ChunkedEncodingError(
+                f"Segment {start}-{end} ended after {segment[2]:,} of {end - start + 1:,} bytes")
+
+def find_csv_member(z: zipfile.ZipFile) -> zipfile.ZipInfo:
+    """Return the first CSV member of a BTS archive"""
+    return [info for info in z.infolist() if info.filename.endswith('.csv')][0]
+
+class MemberReader(io.RawIOBase):
+    """Readable zip member that tracks how many uncompressed bytes were consumed.
+
+    The member's file_size is known from the central directory, so a reader can
+    report progress as it goes instead of counting rows in a separate pass.
+    If copy_to is given, every byte read is also written there, so the member
+    can be saved to disk in the same pass that parses it.
+    """
+
+    def __init__(self, z: zipfile.ZipFile, info: zipfile.ZipInfo, copy_to: Optional[BinaryIO] = None):
+        super().__init__()
+        self.info = info
+        self.member = z.open(info)
+        self.copy_to = copy_to
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = self.member.readinto(buffer)
+        if self.copy_to is not None and count:
+            self.copy_to.write(memoryview(buffer)[:count])
+        self.bytes_read += count
+        return count
+
+    def close(self) -> None:
+        self.member.close()
+        super().close()
+
+    @property
+    def progress(self) -> float:
+        """Percentage of the member consumed so far"""
+        if not self.info.file_size:
+            return 100.0
+        return min(self.bytes_read / self.info.file_size * 100, 100.0)
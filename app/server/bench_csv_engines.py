@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+import pandas as pd
+from bench_coupon_records import make_chunk
+from db1b_schema import C_ENGINE, COUPON_DTYPES, PYARROW_ENGINE, pa, read_csv_chunks
+
+COLUMNS = ['ItinID', 'SeqNum', 'Coupons', 'Origin', 'Dest', 'CouponType',
+           'TkCarrier', 'OpCarrier', 'RPCarrier', 'Passengers']
+CHUNK_SIZE = 500000
+
+def write_file(path: str, rows: int) -> None:
+    make_chunk(rows).to_csv(path, index=False)
+
+def read_file(path: str, mode: str) -> Dict[str, float]:
+    """Read the whole CSV in chunks in a fresh process and report time and memory"""
+    start = time.perf_counter()
+    rows = 0
+    chunk_bytes = 0
+    if mode == 'inferred':
+        # How the readers worked before the shared schema
+        chunks = pd.read_csv(path, usecols=COLUMNS, chunksize=CHUNK_SIZE)
+    else:
+        chunks = read_csv_chunks(open(path, 'rb'), COLUMNS, COUPON_DTYPES, CHUNK_SIZE, mode)
+    for chunk in chunks:
+        rows += len(chunk)
+        chunk_bytes = max(chunk_bytes, chunk.memory_usage(deep=True).sum())
+    return {
+        'rows_per_second': rows / (time.perf_counter() - start),
+        'chunk_mb': chunk_bytes / 2**20,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+if __name__ == "__main__":
+    # About a third of a DB1BCoupon quarter
+    rows = 3000000
+    modes = ['inferred', C_ENGINE] + ([PYARROW_ENGINE] if pa is not None else [])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'coupon.csv')
+        # Every step runs in a fresh process: peak RSS survives exec on Linux,
+        # so it must not be inflated by the parent building the test file
+        spawn = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            pool.submit(write_file, path, rows).result()
+        print(f"{rows:,} rows, {os.path.getsize(path) / 2**20:,.0f} MB of CSV, {CHUNK_SIZE:,} rows per chunk\n")
+        print(f"{'engine':<10}{'rows/s':>14}{'chunk MB':>12}{'peak RSS MB':>14}")
+        for mode in modes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                result = pool.submit(read_file, path, mode).result()
+            print(f"{mode:<10}{result['rows_per_second']:>14,.0f}{result['chunk_mb']:>12,.1f}"
+                  f"{result['peak_rss_mb']:>14,.0f}")
+        if pa is None:
+            print("\npyarrow is not installed, skipping the pyarrow engine")
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from db1b_market import DB1BDownloader
+
+def make_market_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a synthetic DB1BMarket frame with realistic cardinalities.
+
+    About 450 airports and 40 carriers with skewed (Zipf-like) popularity,
+    a few unknown '99' operators and missing ticketing carriers.
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    airports = np.unique([''.join(code) for code in rng.choice(letters, (500, 3))])[:450]
+    carriers = np.unique([''.join(code) for code in rng.choice(letters, (60, 2))])[:40]
+    carriers[0] = '99'
+
+    def skewed(values, size):
+        weights = 1.0 / np.arange(1, len(values) + 1)
+        return rng.choice(values, size, p=weights / weights.sum())
+
+    tk_carriers = skewed(carriers, rows).astype(object)
+    tk_carriers[rng.random(rows) < 0.001] = np.nan
+    return pd.DataFrame({
+        'ItinID': 2024100000000 + rng.integers(0, 99999999, rows),
+        'MktID': 2024100000000 + rng.integers(0, 99999999, rows),
+        'Origin': skewed(airports, rows),
+        'Dest': skewed(airports, rows),
+        'OpCarrier': skewed(carriers, rows),
+        'TkCarrier': tk_carriers,
+        'Passengers': rng.integers(1, 4, rows).astype(float),
+    })
+
+def legacy_transform_data(df: pd.DataFrame) -> pd.DataFrame:
+    """The previous row-wise apply implementation, kept for comparison"""
+    df = df.copy()
+
+    def make_city_pair(row):
+        cities = sorted([str(row['Origin']), str(row['Dest'])])
+        return ''.join(cities)
+
+    df['CITYPAIR'] = df.apply(make_city_pair, axis=1)
+    df['OpCarrier'] = df['OpCarrier'].replace('99', '--')
+    df['TkCarrier'] = df['TkCarrier'].fillna('--')
+
+    result = df.groupby(
+        ['CITYPAIR', 'OpCarrier', 'TkCarrier'],
+        as_index=False
+    ).agg({
+        'Passengers': 'sum'
+    })
+    result['OPCR'] = result['OpCarrier'].str.strip().str.upper().str.ljust(2)
+    result['TKCR'] = result['TkCarrier'].str.strip().str.upper().str.ljust(2)
+    result['PASSENGERS'] = result['Passengers'].round().astype(int)
+    result = result.sort_values(['CITYPAIR', 'PASSENGERS'], ascending=[True, False])
+    return result[['CITYPAIR', 'OPCR', 'TKCR', 'PASSENGERS']]
+
+def legacy_write_city_pairs(result_df: pd.DataFrame, output_file: str) -> None:
+    """The previous per-row iterrows writer, kept for comparison"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("CITYPAIR|OPCR|TKCR|PASSENGERS\n")  # Header row
+        for _, row in result_df.iterrows():
+            f.write(f"{row['CITYPAIR']}|{row['OPCR']}|{row['TKCR']}|{int(row['PASSENGERS'])}\n")
+
+def write_rows_per_second(func, result_df: pd.DataFrame, output_file: str) -> float:
+    start = time.perf_counter()
+    func(result_df, output_file)
+    return len(result_df) / (time.perf_counter() - start)
+
+def rows_per_second(func, df: pd.DataFrame) -> float:
+    start = time.perf_counter()
+    func(df)
+    return len(df) / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    # A full DB1BMarket quarter is roughly 6 million rows
+    df = make_market_frame(6000000)
+    # apply is slow enough that a small sample gives a stable rate
+    legacy_df = df.head(300000)
+
+    legacy = legacy_transform_data(legacy_df).reset_index(drop=True)
+    vectorized = DB1BDownloader.transform_data(legacy_df).reset_index(drop=True)
+    pd.testing.assert_frame_equal(legacy, vectorized, check_dtype=False)
+
+    before = rows_per_second(legacy_transform_data, legacy_df)
+    after = rows_per_second(DB1BDownloader.transform_data, df)
+    print(f"apply:      {before:>12,.0f} rows/s")
+    print(f"vectorized: {after:>12,.0f} rows/s")
+    print(f"speedup:    {after / before:>12.1f}x")
+
+    # CITY_PAIR file writing, on the summary of the full frame
+    result = DB1BDownloader.transform_data(df)
+    legacy_result = result.head(200000)
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_file, bulk_file = os.path.join(tmp, 'legacy.txt'), os.path.join(tmp, 'bulk.txt')
+        legacy_write_city_pairs(legacy_result, legacy_file)
+        DB1BDownloader.write_city_pairs(legacy_result, bulk_file)
+        with open(legacy_file, 'rb') as a, open(bulk_file, 'rb') as b:
+            assert a.read() == b.read(), "Bulk CITY_PAIR file differs from legacy file"
+
+        before = write_rows_per_second(legacy_write_city_pairs, legacy_result, legacy_file)
+        after = write_rows_per_second(DB1BDownloader.write_city_pairs, result, bulk_file)
+    print(f"\nCITY_PAIR write ({len(result):,} groups)")
+    print(f"iterrows:   {before:>12,.0f} rows/s")
+    print(f"bulk:       {after:>12,.0f} rows/s")
+    print(f"speedup:    {after / before:>12.1f}x")
@@ -32,6 +32,14 @@ class ConfigReader:
     def download_config(self) -> Dict[str, Any]:
         return self.config['download']
 
+    @property
+    def ingest_config(self) -> Dict[str, Any]:
+        return self.config.get('ingest') or {}
+
+    @property
+    def csv_config(self) -> Dict[str, Any]:
+        return self.config.get('csv') or {}
+
     @property
     def db1b_config(self) -> Dict[str, Any]:
         return self.config.get('db1b_coupon', self.config['db1b_market'])
@@ -1,19 +1,25 @@
-import requests
-import pandas as pd
 import zipfile
-import io
 from datetime import datetime
 import signal
 import sys
 import os  # Make sure os is imported
-from tqdm import tqdm
+from typing import BinaryIO
 from config_reader import ConfigReader
+from archive_cache import ArchiveCache
+from archive_io import download_archive, make_session, find_csv_member, MemberReader
+from output_io import check_compression, open_output, output_path
+from db1b_schema import COUPON_DTYPES, configured_engine, read_csv_chunks
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# Columns copied from the DB1BCoupon CSV
+COUPON_COLUMNS = ['ItinID', 'MktID', 'SeqNum', 'Coupons', 'Origin', 'Dest',
+                  'CouponType', 'TkCarrier', 'OpCarrier', 'RPCarrier', 'Passengers']
+
 class DB1BCouponDownloader:
     def __init__(self, config: ConfigReader):
         self.config = config
-        self.session = requests.Session()
+        self.session = make_session(self.config.download_config)
+        self.cache = ArchiveCache.from_config(self.config.download_config)
         self.should_exit = False
         
         # Ensure data directories exist
@@ -24,6 +30,12 @@ class DB1BCouponDownloader:
         if 'db1b_coupon' not in self.config.config:
             raise ValueError("Configuration missing db1b_coupon section")
         self.config.config['db1b_config'] = self.config.config['db1b_coupon']
+        coupon_config = self.config.config['db1b_coupon']
+        self.chunk_size = coupon_config.get('chunk_size', 500000)
+        self.compression = coupon_config.get('output_compression')
+        self.compression_level = coupon_config.get('compression_level')
+        check_compression(self.compression)
+        self.csv_engine = configured_engine(self.config.csv_config)
         
         signal.signal(signal.SIGINT, self.handle_interrupt)
         signal.signal(signal.SIGTERM, self.handle_interrupt)
@@ -33,89 +45,46 @@ class DB1BCouponDownloader:
         print("\nReceived interrupt signal. Cleaning up...")
         self.should_exit = True
 
-    def download_with_progress(self, url: str) -> bytes:
-        download_config = self.config.download_config
-        response = self.session.get(
-            url, 
-            stream=True,
-            verify=download_config['verify_ssl'],
-            timeout=30
-        )
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        block_size = 8192
-        buffer = io.BytesIO()
-        
-        with tqdm(total=total_size, unit='iB', unit_scale=True, desc="Downloading") as pbar:
-            for chunk in response.iter_content(block_size):
-                if self.should_exit:
-                    raise KeyboardInterrupt()
-                buffer.write(chunk)
-                pbar.update(len(chunk))
-        
-        return buffer.getvalue()
+    def download_with_progress(self, url: str) -> BinaryIO:
+        if self.cache is not None:
+            return self.cache.open_archive(self.session, url, self.config.download_config, lambda: self.should_exit)
+        return download_archive(self.session, url, self.config.download_config, lambda: self.should_exit)
 
     def process_data(self, year: int, quarter: int) -> None:
         url = f"{self.config.base_url}_{year}_{quarter}.zip"
         try:
             print(f"\nProcessing {year} Q{quarter} data...")
-            zip_data = self.download_with_progress(url)
+            archive = self.download_with_progress(url)
             
             print("\nExtracting data...")
-            with zipfile.ZipFile(io.BytesIO(zip_data)) as z:
-                csv_name = [name for name in z.namelist() if name.endswith('.csv')][0]
-                print(f"Found CSV: {csv_name}")
+            with archive, zipfile.ZipFile(archive) as z:
+                csv_info = find_csv_member(z)
+                print(f"Found CSV: {csv_info.filename} ({csv_info.file_size:,} bytes)")
                 
                 # Create timestamp for consistent file naming
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 
                 try:
-                    # Read CSV columns we want
-                    columns = ['ItinID', 
-                               'MktID', 
-                               'SeqNum', 
-                               'Coupons', 
-                               'Origin', 
-                               'Dest', 
-                               'CouponType', 
-                               'TkCarrier', 
-                               'OpCarrier', 
-                               'RPCarrier', 
-                               'Passengers']
-                    
-                    print("Reading CSV...")
-                    chunk_size = 500000  # Process 500k rows at a time
-                    chunks = []
-                    total_chunks = 0
-                    
-                    # First pass to count total chunks
-                    for _ in pd.read_csv(z.open(csv_name), usecols=columns, chunksize=chunk_size):
-                        if self.should_exit:
-                            raise KeyboardInterrupt()
-                        total_chunks += 1
-                    
-                    print(f"File will be processed in {total_chunks} chunks")
-                    
-                    # Second pass to actually read the data with progress
-                    for chunk_num, chunk in enumerate(pd.read_csv(z.open(csv_name), 
-                                                                usecols=columns, 
-                                                                chunksize=chunk_size), 1):
-                        if self.should_exit:
-                            raise KeyboardInterrupt()
-                        chunks.append(chunk)
-                        print(f"Read chunk {chunk_num}/{total_chunks} ({(chunk_num/total_chunks*100):.1f}%)")
+                    output_file = output_path(os.path.join(self.data_dir,
+                                                           f"DB1BCoupon_{year}_{quarter}.{timestamp}.csv"),
+                                              self.compression)
+                    print(f"Streaming CSV to file: {output_file}")
+                    rows = 0
                     
-                    # Combine all chunks
-                    print("Combining chunks...")
-                    df = pd.concat(chunks, ignore_index=True)
-                    print(f"Loaded {len(df):,} records")
+                    # Single pass; each chunk is written as soon as it is read, so only
+                    # one chunk is held in memory. Progress comes from the bytes
+                    # consumed out of the zip member.
+                    with MemberReader(z, csv_info) as reader, \
+                            open_output(output_file, self.compression, self.compression_level) as out:
+                        for chunk_num, chunk in enumerate(read_csv_chunks(reader, COUPON_COLUMNS, COUPON_DTYPES,
+                                                                          self.chunk_size, self.csv_engine), 1):
+                            if self.should_exit:
+                                raise KeyboardInterrupt()
+                            chunk.to_csv(out, header=chunk_num == 1, index=False)
+                            rows += len(chunk)
+                            print(f"Wrote chunk {chunk_num}: {rows:,} records ({reader.progress:.1f}%)")
                     
-                    # Save processed CSV
-                    output_file = os.path.join(self.data_dir, 
-                                             f"DB1BCoupon_{year}_{quarter}.{timestamp}.csv")
-                    print(f"\nSaving to file: {output_file}")
-                    df.to_csv(output_file, index=False)
+                    print(f"Saved {rows:,} records")
                     print("Processing complete!")
                 
                 except KeyboardInterrupt:
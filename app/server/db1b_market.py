@@ -1,82 +1,90 @@
-import requests
+import numpy as np
 import pandas as pd
 import zipfile
-import io
+import contextlib
+import gzip
 from datetime import datetime
-from tqdm import tqdm
 import urllib3
 import os
-from config_reader import ConfigReader
+from typing import BinaryIO, Optional, TextIO
+from config_reader import ConfigReader, parse_range
+from archive_cache import ArchiveCache
+from archive_io import download_archive, find_csv_member, make_session, MemberReader
+from db1b_schema import MARKET_DTYPES, configured_engine, read_csv_chunks
+from http_encoding import sidecar_path
+import market_store
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Columns the city pair summary needs out of the DB1BMarket CSV
+MARKET_COLUMNS = ['Origin', 'Dest', 'OpCarrier', 'TkCarrier', 'Passengers']
+SUMMARY_KEYS = ['CITYPAIR', 'OpCarrier', 'TkCarrier']
+
+CITY_PAIR_HEADER = "CITYPAIR|OPCR|TKCR|PASSENGERS\n"
+# Lines joined per write() when saving CITY_PAIR files
+WRITE_BLOCK_ROWS = 200000
+# Optional copies saved next to each CITY_PAIR file
+SIBLING_FORMATS = (None, 'gzip', 'parquet')
+
 class DB1BDownloader:
     def __init__(self, config: ConfigReader):
         self.config = config
-        self.session = requests.Session()
+        self.session = make_session(self.config.download_config)
+        self.cache = ArchiveCache.from_config(self.config.download_config)
+        self.market_config = market_config = self.config.config.get('db1b_market') or {}
+        self.chunk_size = market_config.get('chunk_size', 1000000)
+        self.keep_raw_csv = market_config.get('keep_raw_csv', False)
+        self.csv_engine = configured_engine(self.config.csv_config)
+        self.sibling_format = market_config.get('sibling_format')
+        if self.sibling_format not in SIBLING_FORMATS:
+            raise ValueError(f"Unknown db1b_market.sibling_format '{self.sibling_format}', "
+                             f"expected one of {SIBLING_FORMATS}")
+        self.load_db = market_config.get('load_db', True)
+        self.db_path = market_config.get('db_path') or market_store.DEFAULT_DB_PATH
 
-    def download_with_progress(self, url: str) -> bytes:
-        """Download file with progress bar"""
-        download_config = self.config.download_config
-        
-        response = self.session.get(
-            url, 
-            stream=True, 
-            verify=download_config['verify_ssl'],
-            timeout=30
-        )
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        block_size = 8192
-        
-        buffer = io.BytesIO()
-        with tqdm(total=total_size, unit='iB', unit_scale=True, desc="Downloading") as pbar:
-            for chunk in response.iter_content(block_size):
-                buffer.write(chunk)
-                pbar.update(len(chunk))
-        
-        return buffer.getvalue()
+    def download_with_progress(self, url: str) -> BinaryIO:
+        """Download file with progress bar, through the archive cache if enabled"""
+        if self.cache is not None:
+            return self.cache.open_archive(self.session, url, self.config.download_config)
+        return download_archive(self.session, url, self.config.download_config)
 
     def process_data(self, year: int, quarter: int) -> None:
         """Download and process a single year-quarter pair"""
-        url = f"{self.config.base_url}_{year}_{quarter}.zip"
+        url = f"{self.market_config.get('base_url', self.config.base_url)}_{year}_{quarter}.zip"
         
         try:
             print(f"\nProcessing {year} Q{quarter} data...")
-            zip_data = self.download_with_progress(url)
+            archive = self.download_with_progress(url)
             
             print("\nExtracting data...")
-            with zipfile.ZipFile(io.BytesIO(zip_data)) as z:
-                csv_name = [name for name in z.namelist() if name.endswith('.csv')][0]
-                print(f"Found CSV: {csv_name}")
+            with archive, zipfile.ZipFile(archive) as z:
+                csv_info = find_csv_member(z)
+                print(f"Found CSV: {csv_info.filename} ({csv_info.file_size:,} bytes)")
                 
                 # Create timestamp for consistent file naming
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 
-                # Save raw CSV with timestamp
-                raw_file = f"data/market/DB1B_MARKET_{year}_{quarter}.{timestamp}.csv"
-                with z.open(csv_name) as source, open(raw_file, 'wb') as target:
-                    target.write(source.read())
-                print(f"Raw CSV saved as: {raw_file}")
-                
-                # Process the data
-                print("Reading CSV...")
-                df = pd.read_csv(raw_file)
-                print(f"Loaded {len(df):,} records")
-                result_df = self.transform_data(df)
+                # Optionally save the raw CSV with timestamp, written while it is parsed
+                raw_file = f"data/market/DB1B_MARKET_{year}_{quarter}.{timestamp}.csv" if self.keep_raw_csv else None
+                with open(raw_file, 'wb') if raw_file else contextlib.nullcontext() as raw_target:
+                    result_df = self.summarize_member(z, csv_info, raw_target)
+                if raw_file:
+                    print(f"Raw CSV saved as: {raw_file}")
                 
                 # Save summarized data
                 output_file = f"data/market/CITY_PAIR_{year}_{quarter}.{timestamp}.txt"
 
                 print(f"Saving processed data to {output_file}")
-                
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write("CITYPAIR|OPCR|TKCR|PASSENGERS\n")  # Header row
-                    for _, row in result_df.iterrows():
-                        f.write(f"{row['CITYPAIR']}|{row['OPCR']}|{row['TKCR']}|{int(row['PASSENGERS'])}\n")
+                self.write_city_pairs(result_df, output_file)
+                if self.sibling_format:
+                    sibling_file = self.write_sibling(result_df, output_file, self.sibling_format)
+                    print(f"Saved {self.sibling_format} copy as {sibling_file}")
+                if self.load_db:
+                    with contextlib.closing(market_store.connect(self.db_path)) as conn:
+                        market_store.load_quarter(conn, year, quarter, result_df, url)
+                    print(f"Loaded city pairs into {self.db_path}")
                 
                 print(f"Processing complete!")
                 print(f"\nStatistics:")
@@ -88,47 +96,166 @@ class DB1BDownloader:
             print(f"Error processing {year} Q{quarter}: {str(e)}")
             raise
 
-    def transform_data(self, df: pd.DataFrame) -> pd.DataFrame:
+    def summarize_member(self, z: zipfile.ZipFile, csv_info: zipfile.ZipInfo,
+                         raw_target: Optional[BinaryIO] = None) -> pd.DataFrame:
+        """Summarize a market CSV in one streaming pass.
+
+        Reads chunk_size rows at a time with only MARKET_COLUMNS and folds each
+        chunk's partial sums into a running aggregate, so memory grows with the
+        number of (city pair, operator, ticketing carrier) groups rather than
+        with the number of rows.
+        """
+        print("Reading CSV...")
+        summary = None
+        rows = 0
+        with MemberReader(z, csv_info, raw_target) as reader:
+            # Codes are categoricals of text, so every chunk agrees on their type, even one holding only '99'
+            for chunk_num, chunk in enumerate(read_csv_chunks(reader, MARKET_COLUMNS, MARKET_DTYPES,
+                                                              self.chunk_size, self.csv_engine), 1):
+                partial = self.summarize_chunk(chunk)
+                summary = partial if summary is None else self.combine_summaries(summary, partial)
+                rows += len(chunk)
+                print(f"Summarized chunk {chunk_num}: {rows:,} records, {len(summary):,} groups "
+                      f"({reader.progress:.1f}%)")
+        
+        if summary is None:
+            summary = self.summarize_chunk(pd.DataFrame(columns=MARKET_COLUMNS))
+        print(f"Loaded {rows:,} records")
+        return self.format_summary(summary)
+
+    @staticmethod
+    def transform_data(df: pd.DataFrame) -> pd.DataFrame:
         """Transform the raw DB1B data into the required format"""
-        print("Summarizing market data...")
+        return DB1BDownloader.format_summary(DB1BDownloader.summarize_chunk(df))
+
+    @staticmethod
+    def summarize_chunk(df: pd.DataFrame) -> pd.DataFrame:
+        """Sum passengers per (CITYPAIR, OpCarrier, TkCarrier) for a frame of market rows.
+
+        Airports and carriers are integer coded, so building city pairs and
+        grouping runs on arrays instead of per-row Python calls.
+        """
+        # Code both airport columns against one sorted list, so the smaller
+        # code of a pair is also the alphabetically first airport
+        airport_codes, airports = pd.factorize(
+            np.concatenate([df['Origin'].astype(str).to_numpy(), df['Dest'].astype(str).to_numpy()]), sort=True)
+        origin_codes, dest_codes = airport_codes[:len(df)], airport_codes[len(df):]
+        first = np.minimum(origin_codes, dest_codes)
+        second = np.maximum(origin_codes, dest_codes)
         
-        # Create city pairs (ensuring proper order)
-        def make_city_pair(row):
-            cities = sorted([str(row['Origin']), str(row['Dest'])])
-            return ''.join(cities)
-            
-        df['CITYPAIR'] = df.apply(make_city_pair, axis=1)
+        # Clean up carrier codes (handle special cases) on the categories rather than every row
+        op_carriers = pd.Categorical(df['OpCarrier'])
+        op_names, op_categories = pd.factorize(op_carriers.categories.where(op_carriers.categories != '99', '--'),
+                                               sort=True)  # Mark unknown operators
+        op_codes = np.where(op_carriers.codes >= 0, op_names[op_carriers.codes], -1)
+        tk_carriers = df['TkCarrier']
+        if isinstance(tk_carriers.dtype, pd.CategoricalDtype):
+            # fillna only accepts existing categories
+            tk_carriers = tk_carriers.cat.set_categories(sorted(set(tk_carriers.cat.categories) | {'--'}))
+        tk_carriers = pd.Categorical(tk_carriers.fillna('--'))  # Handle any missing ticketing carriers
+        tk_codes, tk_categories = tk_carriers.codes, tk_carriers.categories
         
-        # Clean up carrier codes (handle special cases)
-        df['OpCarrier'] = df['OpCarrier'].replace('99', '--')  # Mark unknown operators
-        df['TkCarrier'] = df['TkCarrier'].fillna('--')  # Handle any missing ticketing carriers
+        # Rows with a missing operating carrier are dropped, as groupby would
+        valid = op_codes >= 0
+        n_airports, n_op, n_tk = len(airports), len(op_categories), len(tk_categories)
+        keys = ((first[valid].astype(np.int64) * n_airports + second[valid]) * n_op
+                + op_codes[valid]) * n_tk + tk_codes[valid]
         
-        # Group and sum passengers
-        result = df.groupby(
-            ['CITYPAIR', 'OpCarrier', 'TkCarrier'],
-            as_index=False
-        ).agg({
-            'Passengers': 'sum'
-        })
+        # Group and sum passengers; sorted keys come out in (city pair, operator, ticketing) order
+        groups, unique_keys = pd.factorize(keys, sort=True)
+        passengers = np.bincount(groups, weights=df['Passengers'].fillna(0).to_numpy()[valid],
+                                 minlength=len(unique_keys))
         
-        # Format carrier codes
-        result['OPCR'] = result['OpCarrier'].str.strip().str.upper().str.ljust(2)
-        result['TKCR'] = result['TkCarrier'].str.strip().str.upper().str.ljust(2)
+        rest, group_tk = np.divmod(unique_keys, n_tk)
+        rest, group_op = np.divmod(rest, n_op)
+        group_first, group_second = np.divmod(rest, n_airports)
         
-        # Round passengers to integers
-        result['PASSENGERS'] = result['Passengers'].round().astype(int)
+        airport_labels = np.asarray(airports, dtype=object)
+        return pd.DataFrame({
+            'CITYPAIR': airport_labels[group_first] + airport_labels[group_second],
+            'OpCarrier': np.asarray(op_categories, dtype=object)[group_op],
+            'TkCarrier': np.asarray(tk_categories, dtype=object)[group_tk],
+            'Passengers': passengers
+        })
+
+    @staticmethod
+    def combine_summaries(summary: pd.DataFrame, partial: pd.DataFrame) -> pd.DataFrame:
+        """Fold a chunk's partial sums into the running summary"""
+        return pd.concat([summary, partial], ignore_index=True).groupby(
+            SUMMARY_KEYS, as_index=False, sort=False)['Passengers'].sum()
+
+    @staticmethod
+    def format_carriers(carriers: pd.Series) -> np.ndarray:
+        """Strip, upper-case and pad carrier codes, formatting each distinct code once"""
+        codes, uniques = pd.factorize(carriers)
+        return pd.Index(uniques).astype(str).str.strip().str.upper().str.ljust(2).to_numpy()[codes]
+
+    @staticmethod
+    def format_summary(summary: pd.DataFrame) -> pd.DataFrame:
+        """Turn summed groups into the CITYPAIR|OPCR|TKCR|PASSENGERS output rows"""
+        print("Summarizing market data...")
         
-        # Sort by city pair and passengers
-        result = result.sort_values(['CITYPAIR', 'PASSENGERS'], ascending=[True, False])
+        # Ties on passengers keep the groups in key order
+        summary = summary.sort_values(SUMMARY_KEYS, kind='stable')
         
-        # Select and order final columns
-        result = result[['CITYPAIR', 'OPCR', 'TKCR', 'PASSENGERS']]
+        # Format carrier codes
+        result = pd.DataFrame({
+            'CITYPAIR': summary['CITYPAIR'].to_numpy(),
+            'OPCR': DB1BDownloader.format_carriers(summary['OpCarrier']),
+            'TKCR': DB1BDownloader.format_carriers(summary['TkCarrier']),
+            'PASSENGERS': summary['Passengers'].round().astype(int).to_numpy()  # Round passengers to integers
+        })
         
-        return result
+        # Sort by city pair and passengers
+        return result.sort_values(['CITYPAIR', 'PASSENGERS'], ascending=[True, False])
+
+    @staticmethod
+    def write_city_pairs(result_df: pd.DataFrame, output_file: str) -> None:
+        """Write the pipe-delimited CITY_PAIR file"""
+        with open(output_file, 'w', encoding='utf-8') as f:
+            DB1BDownloader.write_city_pair_text(result_df, f)
+
+    @staticmethod
+    def write_city_pair_text(result_df: pd.DataFrame, f: TextIO) -> None:
+        """Write CITY_PAIR lines to a text file, building and writing them a block at a time"""
+        f.write(CITY_PAIR_HEADER)
+        for start in range(0, len(result_df), WRITE_BLOCK_ROWS):
+            block = result_df.iloc[start:start + WRITE_BLOCK_ROWS]
+            lines = (block['CITYPAIR'].astype(str) + '|' + block['OPCR'].astype(str) + '|'
+                     + block['TKCR'].astype(str) + '|' + block['PASSENGERS'].astype(np.int64).astype(str))
+            f.write('\n'.join(lines.tolist()))
+            f.write('\n')
+
+    @staticmethod
+    def write_sibling(result_df: pd.DataFrame, output_file: str, sibling_format: str) -> str:
+        """Save a copy of a CITY_PAIR file for readers that want to skip the text file.
+
+        gzip writes the same text compressed, stamped with the text file's
+        modification time so the server also sends it as the file's gzip
+        sidecar (see http_encoding.py); parquet (needs pyarrow) writes typed
+        columns that load without any parsing. Returns the sibling's path.
+        """
+        if sibling_format == 'parquet':
+            sibling_file = f"{os.path.splitext(output_file)[0]}.parquet"
+            result_df.astype({'PASSENGERS': np.int64}).to_parquet(sibling_file, index=False, compression='zstd')
+        else:
+            sibling_file = sidecar_path(output_file, 'gzip')
+            with gzip.open(sibling_file, 'wt', encoding='utf-8') as f:
+                DB1BDownloader.write_city_pair_text(result_df, f)
+            source = os.stat(output_file)
+            os.utime(sibling_file, ns=(source.st_atime_ns, source.st_mtime_ns))
+        return sibling_file
+
+    def download_pairs(self) -> list:
+        """Year-quarter pairs from the db1b_market section, falling back to the shared ones"""
+        if 'years' not in self.market_config or 'quarters' not in self.market_config:
+            return self.config.get_download_pairs()
+        return [(year, quarter) for year in parse_range(self.market_config['years'])
+                for quarter in parse_range(self.market_config['quarters'])]
 
     def process_all(self):
         """Process all configured year-quarter pairs"""
-        pairs = self.config.get_download_pairs()
+        pairs = self.download_pairs()
         max_workers = self.config.download_config['max_concurrent']
         
         print(f"Starting download of {len(pairs)} quarter(s) with {max_workers} concurrent downloads")
@@ -0,0 +1,120 @@
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # The pyarrow engine is optional
+    pa = pa_csv = None
+
+# pandas dtypes of the DB1B CSV columns the scripts read. Airports and
+# carriers repeat heavily, so they are categoricals. ItinID and MktID are
+# read as text: a missing or malformed ID must only reject its own row
+# (see split_itin_ids) instead of failing the whole file.
+COUPON_DTYPES = {
+    'ItinID': 'str',
+    'MktID': 'str',
+    'SeqNum': 'int16',
+    'Coupons': 'int16',
+    'Origin': 'category',
+    'Dest': 'category',
+    'CouponType': 'category',
+    'TkCarrier': 'category',
+    'OpCarrier': 'category',
+    'RPCarrier': 'category',
+    'Passengers': 'float32',
+}
+
+MARKET_DTYPES = {
+    'ItinID': 'str',
+    'MktID': 'str',
+    'Origin': 'category',
+    'Dest': 'category',
+    'OpCarrier': 'category',
+    'TkCarrier': 'category',
+    'Passengers': 'float32',
+}
+
+# 'c' is the pandas parser; 'pyarrow' parses blocks of the file on several threads
+C_ENGINE = 'c'
+PYARROW_ENGINE = 'pyarrow'
+ENGINES = (C_ENGINE, PYARROW_ENGINE)
+
+# Bytes the pyarrow engine parses per block; several blocks make up a chunk
+ARROW_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Same missing-value markers as pandas' defaults
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+def check_engine(engine: str) -> None:
+    """Raise if engine is unknown or pyarrow is missing for it"""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown CSV engine '{engine}', expected one of {ENGINES}")
+    if engine == PYARROW_ENGINE and pa is None:
+        raise ImportError("The pyarrow CSV engine needs pyarrow: pip install pyarrow")
+
+def column_dtypes(schema: Dict[str, str], columns: List[str]) -> Dict[str, str]:
+    return {name: schema[name] for name in columns}
+
+def arrow_type(dtype: str) -> 'pa.DataType':
+    if dtype == 'category':
+        return pa.dictionary(pa.int32(), pa.string())
+    if dtype == 'str':
+        return pa.string()
+    return pa.from_numpy_dtype(pd.api.types.pandas_dtype(dtype.lower()))
+
+def read_csv_chunks(source: BinaryIO, columns: List[str], schema: Dict[str, str], chunk_size: int,
+                    engine: str = C_ENGINE, **kwargs: Any) -> Iterator[pd.DataFrame]:
+    """Read columns of a CSV in frames of chunk_size rows, typed by schema.
+
+    Both engines yield frames with the same columns and dtypes; the pyarrow
+    engine streams the file in ARROW_BLOCK_SIZE blocks, so memory stays
+    bounded by the chunk size either way. Extra keyword arguments go to
+    pandas.read_csv and are only supported by the c engine.
+    """
+    dtypes = column_dtypes(schema, columns)
+    if engine != PYARROW_ENGINE:
+        yield from pd.read_csv(source, usecols=columns, dtype=dtypes, chunksize=chunk_size, **kwargs)
+        return
+
+    check_engine(engine)
+    if kwargs:
+        raise ValueError(f"The pyarrow engine does not support {', '.join(kwargs)}")
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(use_threads=True, block_size=ARROW_BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={name: arrow_type(dtype) for name, dtype in dtypes.items()},
+            null_values=NA_VALUES, strings_can_be_null=True))
+
+    pending: List['pa.RecordBatch'] = []
+    rows = start = 0
+    for batch in reader:
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= chunk_size:
+            table = pa.Table.from_batches(pending)
+            yield to_frame(table.slice(0, chunk_size), dtypes, start)
+            start += chunk_size
+            rest = table.slice(chunk_size)
+            pending, rows = rest.to_batches(), rest.num_rows
+    if rows:
+        yield to_frame(pa.Table.from_batches(pending), dtypes, start)
+
+def to_frame(table: 'pa.Table', dtypes: Dict[str, str], start: int) -> pd.DataFrame:
+    """Convert a pyarrow chunk to pandas with the c engine's dtypes, index and category order"""
+    # Text columns are already strings; astype(str) would turn nulls into 'None'
+    frame = table.to_pandas().astype({name: dtype for name, dtype in dtypes.items() if dtype != 'str'})
+    frame.index = pd.RangeIndex(start, start + len(frame))
+    for name, dtype in dtypes.items():
+        if dtype == 'category':
+            frame[name] = frame[name].cat.set_categories(sorted(frame[name].cat.categories))
+    return frame
+
+def configured_engine(csv_config: Optional[Dict[str, Any]]) -> str:
+    """The engine set in the csv section of config.yml, defaulting to the c engine"""
+    engine = (csv_config or {}).get('engine') or C_ENGINE
+    check_engine(engine)
+    return engine
@@ -0,0 +1,101 @@
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_MMAP_SIZE_MB = 256
+DEFAULT_CACHE_SIZE_MB = 64
+DEFAULT_CACHED_STATEMENTS = 256
+
+class ReadOnlyPool:
+    """Pool of read-only SQLite connections shared by the API's request threads.
+
+    Connections are opened in read-only URI mode with query_only set, a
+    memory map and a page cache of their own, and a larger prepared
+    statement cache. A request borrows one with connection() and gives it
+    back afterwards, so later requests start with warm caches instead of a
+    new connection. Up to size idle connections are kept; more are opened
+    under heavier load and closed when returned. If the database file is
+    replaced (e.g. by a fresh load), idle connections to the old file are
+    dropped the next time they are borrowed.
+    """
+
+    def __init__(self, db_path: str, size: int = DEFAULT_POOL_SIZE, mmap_size_mb: int = DEFAULT_MMAP_SIZE_MB,
+                 cache_size_mb: int = DEFAULT_CACHE_SIZE_MB, cached_statements: int = DEFAULT_CACHED_STATEMENTS):
+        self.db_path = db_path
+        self.size = size
+        self.mmap_size = mmap_size_mb * 1024 * 1024
+        self.cache_size_kb = cache_size_mb * 1024
+        self.cached_statements = cached_statements
+        self.idle: 'queue.LifoQueue[Tuple[sqlite3.Connection, Tuple[int, int]]]' = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    @classmethod
+    def from_config(cls, db_path: str, server_config: Optional[Dict[str, Any]]) -> 'ReadOnlyPool':
+        server_config = server_config or {}
+        return cls(db_path,
+                   server_config.get('db_pool_size', DEFAULT_POOL_SIZE),
+                   server_config.get('db_mmap_size_mb', DEFAULT_MMAP_SIZE_MB),
+                   server_config.get('db_cache_size_mb', DEFAULT_CACHE_SIZE_MB),
+                   server_config.get('db_cached_statements', DEFAULT_CACHED_STATEMENTS))
+
+    def file_id(self) -> Tuple[int, int]:
+        stat = os.stat(self.db_path)
+        return stat.st_dev, stat.st_ino
+
+    def open(self) -> sqlite3.Connection:
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+        # Borrowed connections move between request threads, one at a time
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute(f'PRAGMA mmap_size = {self.mmap_size}')
+        conn.execute(f'PRAGMA cache_size = {-self.cache_size_kb}')
+        conn.execute('PRAGMA query_only = ON')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        with self.lock:
+            self.opened += 1
+        return conn
+
+    def borrow(self) -> Tuple[sqlite3.Connection, Tuple[int, int]]:
+        current = self.file_id()
+        while True:
+            try:
+                conn, file_id = self.idle.get_nowait()
+            except queue.Empty:
+                return self.open(), current
+            if file_id == current:
+                return conn, file_id
+            conn.close()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for the duration of a request.
+
+        Raises FileNotFoundError if the database does not exist.
+        """
+        conn, file_id = self.borrow()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self.idle.qsize() < self.size:
+                self.idle.put((conn, file_id))
+            else:
+                conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {'idle': self.idle.qsize(), 'opened': self.opened, 'size': self.size}
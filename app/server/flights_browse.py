@@ -0,0 +1,136 @@
+import sqlite3
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+# An itinerary is identified by (year, quarter, stored ItinID): ItinIDs are
+# only unique within a quarter
+ItineraryKey = Tuple[int, int, Any]
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Filters apply to an itinerary's first coupon (SeqNum 1): origin is where
+# the trip starts and carrier its ticketing carrier
+BROWSE_FILTERS = ('year', 'quarter', 'origin', 'carrier')
+
+# Itineraries are browsed newest quarter first and by descending ItinID
+# within a quarter, one row per itinerary from the SeqNum = 1 partial
+# indexes. A page continues below the cursor key, so it is a range scan of
+# page_size index entries however deep it is. The literal SeqNum = 1 lets
+# the planner match the partial indexes.
+BROWSE_QUERY = '''
+    SELECT year, quarter, ItinID
+    FROM flights
+    WHERE SeqNum = 1{conditions}
+    ORDER BY year DESC, quarter DESC, ItinID DESC
+    LIMIT ?
+'''
+
+# Segments of one itinerary, found through the flights primary key
+SEGMENTS_QUERY = '''
+    SELECT year, quarter, ItinID, SeqNum, Coupons,
+           Origin, Dest, CouponType, TkCarrier,
+           OpCarrier, RPCarrier, Passengers
+    FROM {source}
+    WHERE year = ? AND quarter = ? AND ItinKey = ?
+    ORDER BY SeqNum
+'''
+
+def parse_filters(args: Mapping[str, str]) -> Dict[str, Any]:
+    """Browse filters from request arguments; raises ValueError for invalid ones"""
+    filters: Dict[str, Any] = {}
+    for name in ('year', 'quarter'):
+        if args.get(name):
+            filters[name] = int(args[name])
+    if 'quarter' in filters:
+        if 'year' not in filters:
+            raise ValueError("quarter needs a year")
+        if not 1 <= filters['quarter'] <= 4:
+            raise ValueError(f"Invalid quarter: {filters['quarter']}")
+    for name, length in (('origin', 3), ('carrier', 2)):
+        value = args.get(name)
+        if value:
+            if len(value) != length or not value.isalnum():
+                raise ValueError(f"Invalid {name}: {value}")
+            filters[name] = value.upper()
+    return filters
+
+def stored_code(conn: sqlite3.Connection, table: str, code: str, compact: bool) -> Optional[Any]:
+    """The stored value of an airport or carrier code, or None if no row can have it"""
+    if not compact:
+        return code
+    row = conn.execute(f'SELECT id FROM {table} WHERE code = ?', (code,)).fetchone()
+    return row[0] if row else None
+
+def encode_cursor(key: ItineraryKey, compact: bool) -> str:
+    year, quarter, itin_id = key
+    return f"{year}-{quarter}-{format(itin_id, '06X') if compact else itin_id}"
+
+def decode_cursor(cursor: str, compact: bool) -> ItineraryKey:
+    """Parse a cursor from encode_cursor; raises ValueError if it is malformed"""
+    parts = cursor.split('-')
+    if len(parts) != 3 or not parts[2]:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    year, quarter, itin_id = parts
+    try:
+        return int(year), int(quarter), int(itin_id, 16) if compact else itin_id
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'") from None
+
+def iter_keys(conn: sqlite3.Connection, filters: Dict[str, Any], after: Optional[ItineraryKey],
+              limit: int, compact: bool) -> Iterator[ItineraryKey]:
+    """Yield up to limit itinerary keys in browse order, starting after the given key.
+
+    A quarter filter needs a year filter too. The cursor only bounds the
+    key columns the filters leave open, so the filters and the cursor make
+    a single index range; raises ValueError if the cursor is from another
+    year or quarter than the filters.
+    """
+    conditions = []
+    params: List[Any] = []
+    for name, column, table in (('origin', 'Origin', 'airports'), ('carrier', 'TkCarrier', 'carriers')):
+        if filters.get(name) is not None:
+            value = stored_code(conn, table, filters[name], compact)
+            if value is None:
+                return
+            conditions.append(f'{column} = ?')
+            params.append(value)
+
+    fixed = 0
+    for position, name in enumerate(('year', 'quarter')):
+        if filters.get(name) is None:
+            break
+        conditions.append(f'{name} = ?')
+        params.append(filters[name])
+        fixed = position + 1
+    if after is not None:
+        if list(after[:fixed]) != params[len(params) - fixed:]:
+            raise ValueError("The cursor is outside the year and quarter filters")
+        columns = ['year', 'quarter', 'ItinID'][fixed:]
+        conditions.append(f"({', '.join(columns)}) < ({', '.join('?' * len(columns))})")
+        params.extend(after[fixed:])
+
+    query = BROWSE_QUERY.format(conditions=''.join(f' AND {condition}' for condition in conditions))
+    yield from conn.execute(query, params + [limit])
+
+def itinerary_segments(conn: sqlite3.Connection, source: str, key: ItineraryKey) -> List[Dict[str, Any]]:
+    cursor = conn.execute(SEGMENTS_QUERY.format(source=source), key)
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+def iter_itineraries(conn: sqlite3.Connection, source: str, filters: Dict[str, Any],
+                     after: Optional[ItineraryKey], limit: int,
+                     compact: bool) -> Iterator[Tuple[ItineraryKey, Dict[str, Any]]]:
+    """Yield (key, itinerary) pairs in browse order; an itinerary is its year, quarter, ItinID and flights"""
+    for key in iter_keys(conn, filters, after, limit, compact):
+        flights = itinerary_segments(conn, source, key)
+        yield key, {'year': key[0], 'quarter': key[1], 'ItinID': flights[0]['ItinID'], 'flights': flights}
+
+def browse_page(conn: sqlite3.Connection, source: str, filters: Dict[str, Any], after: Optional[ItineraryKey],
+                page_size: int, compact: bool) -> Dict[str, Any]:
+    """One page of itineraries and the cursor of the next page, None after the last one"""
+    itineraries = []
+    key = None
+    for key, itinerary in iter_itineraries(conn, source, filters, after, page_size, compact):
+        itineraries.append(itinerary)
+    more = len(itineraries) == page_size
+    return {'itineraries': itineraries, 'next': encode_cursor(key, compact) if more else None}
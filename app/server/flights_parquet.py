@@ -0,0 +1,154 @@
+import os
+import shutil
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support is optional
+    pa = ds = pq = None
+
+DEFAULT_PARQUET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'parquet', 'flights')
+DEFAULT_ROW_GROUP_SIZE = 65536
+DEFAULT_COMPRESSION = 'zstd'
+
+# Readers skip paths starting with '_', so partially written quarters stay invisible
+STAGING_DIR = '_staging'
+PART_FILE = 'part-0.parquet'
+
+# Columns stored in each file; year and quarter come from the directory names
+PARQUET_COLUMNS = ['ItinID', 'SeqNum', 'Coupons', 'Origin', 'Dest', 'CouponType',
+                   'TkCarrier', 'OpCarrier', 'RPCarrier', 'Passengers']
+QUERY_COLUMNS = ['year', 'quarter'] + PARQUET_COLUMNS
+
+# Equality filters accepted by query_flights
+PARTITION_COLUMNS = ('year', 'quarter')
+FILTER_COLUMNS = PARTITION_COLUMNS + ('Origin', 'Dest', 'TkCarrier', 'OpCarrier', 'RPCarrier', 'CouponType')
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Parquet support needs pyarrow: pip install pyarrow")
+
+def file_schema() -> 'pa.Schema':
+    """Schema of a quarter's file: integer ItinID, narrow integers and string codes.
+
+    The code columns are dictionary encoded in the Parquet pages but typed as
+    plain strings, because pyarrow only prunes row groups by their statistics
+    for non-dictionary Arrow types.
+    """
+    require_pyarrow()
+    return pa.schema([
+        ('ItinID', pa.int64()),
+        ('SeqNum', pa.int16()),
+        ('Coupons', pa.int16()),
+        ('Origin', pa.string()),
+        ('Dest', pa.string()),
+        ('CouponType', pa.string()),
+        ('TkCarrier', pa.string()),
+        ('OpCarrier', pa.string()),
+        ('RPCarrier', pa.string()),
+        ('Passengers', pa.float64()),
+    ])
+
+def partition_schema() -> 'pa.Schema':
+    require_pyarrow()
+    return pa.schema([('year', pa.int16()), ('quarter', pa.int8())])
+
+def chunk_table(chunk: pd.DataFrame, itin_ids: np.ndarray) -> 'pa.Table':
+    """Build a file_schema table from valid coupon rows and their numeric ItinIDs.
+
+    Rows are sorted by route so each row group covers a narrow range of
+    airports and its min/max statistics let route filters skip the rest.
+    """
+    columns = {'ItinID': itin_ids}
+    for name in PARQUET_COLUMNS[1:]:
+        columns[name] = chunk[name].to_numpy()
+    frame = pd.DataFrame(columns).sort_values(['Origin', 'Dest', 'ItinID', 'SeqNum'], kind='stable')
+
+    return pa.Table.from_pandas(frame, schema=file_schema(), preserve_index=False)
+
+def partition_path(parquet_dir: str, key: Tuple[int, int]) -> str:
+    return os.path.join(parquet_dir, f"year={key[0]}", f"quarter={key[1]}")
+
+def staging_path(parquet_dir: str, key: Tuple[int, int]) -> str:
+    return os.path.join(parquet_dir, STAGING_DIR, f"{key[0]}_{key[1]}.parquet")
+
+def open_partition_writer(parquet_dir: str, key: Tuple[int, int],
+                          compression: str = DEFAULT_COMPRESSION) -> 'pq.ParquetWriter':
+    """Open a writer for a quarter's staging file"""
+    path = staging_path(parquet_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return pq.ParquetWriter(path, file_schema(), compression=compression,
+                            write_statistics=True, use_dictionary=True)
+
+def publish_partition(parquet_dir: str, key: Tuple[int, int]) -> None:
+    """Move a finished staging file into its year=/quarter= partition, replacing earlier loads"""
+    target = partition_path(parquet_dir, key)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.makedirs(target)
+    os.replace(staging_path(parquet_dir, key), os.path.join(target, PART_FILE))
+
+def discard_staging(parquet_dir: str, key: Tuple[int, int]) -> None:
+    path = staging_path(parquet_dir, key)
+    if os.path.exists(path):
+        os.remove(path)
+
+def open_dataset(parquet_dir: str) -> 'ds.Dataset':
+    require_pyarrow()
+    return ds.dataset(parquet_dir, format='parquet',
+                      partitioning=ds.partitioning(partition_schema(), flavor='hive'))
+
+def filter_expression(filters: Dict[str, Any],
+                      year_range: Optional[Tuple[int, int]] = None) -> Optional['ds.Expression']:
+    expression = None
+    terms = [ds.field(name) == value for name, value in filters.items()]
+    if year_range is not None:
+        terms += [ds.field('year') >= year_range[0], ds.field('year') <= year_range[1]]
+    for term in terms:
+        expression = term if expression is None else expression & term
+    return expression
+
+def query_flights(parquet_dir: str, filters: Dict[str, Any], year_range: Optional[Tuple[int, int]] = None,
+                  columns: Optional[Sequence[str]] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+    """Read matching coupons from the Parquet dataset with predicate and column pushdown.
+
+    filters maps FILTER_COLUMNS to required values. Filters on year and
+    quarter prune whole partitions; the others are checked against each row
+    group's statistics before any data is read. Only the requested columns
+    are decoded. ItinIDs are returned hex encoded, as from flights_decoded.
+    """
+    dataset = open_dataset(parquet_dir)
+    expression = filter_expression(filters, year_range)
+    table = dataset.head(limit, columns=list(columns or QUERY_COLUMNS), filter=expression)
+    if 'ItinID' in table.column_names:
+        itin_ids = [f"{value:06X}" for value in table.column('ItinID').to_pylist()]
+        table = table.set_column(table.column_names.index('ItinID'), 'ItinID', pa.array(itin_ids))
+    return table.to_pylist()
+
+def scan_stats(parquet_dir: str, filters: Dict[str, Any],
+               year_range: Optional[Tuple[int, int]] = None) -> Dict[str, int]:
+    """Count the files and row groups a query would read, out of the total"""
+    dataset = open_dataset(parquet_dir)
+    expression = filter_expression(filters, year_range)
+
+    # Row group statistics only cover the columns stored in the files
+    file_expression = filter_expression({name: value for name, value in filters.items()
+                                         if name not in PARTITION_COLUMNS})
+    
+    total_groups = sum(fragment.num_row_groups for fragment in dataset.get_fragments())
+    fragments = list(dataset.get_fragments(filter=expression))
+    groups = sum(len(fragment.split_by_row_group(file_expression)) for fragment in fragments)
+    return {'files': len(fragments), 'row_groups': groups, 'total_row_groups': total_groups}
+
+if __name__ == "__main__":
+    # Summarize the dataset: rows and row groups per partition
+    require_pyarrow()
+    dataset = open_dataset(DEFAULT_PARQUET_DIR)
+    for fragment in dataset.get_fragments():
+        metadata = fragment.metadata
+        print(f"{os.path.relpath(fragment.path, DEFAULT_PARQUET_DIR)}: {metadata.num_rows:,} rows "
+              f"in {metadata.num_row_groups} row groups")
@@ -0,0 +1,133 @@
+import sqlite3
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    from .flights_browse import stored_code
+    from .flights_schema import table_quarters
+except ImportError:
+    from flights_browse import stored_code
+    from flights_schema import table_quarters
+
+# Which carrier of a coupon a carrier filter or share refers to
+CARRIER_ROLES = {
+    'ticketing': 'TkCarrier',
+    'operating': 'OpCarrier',
+    'reporting': 'RPCarrier',
+}
+
+DEFAULT_ROUTE_LIMIT = 50
+MAX_ROUTE_LIMIT = 1000
+
+# Whole range of loaded quarters, as (year, quarter)
+FIRST_QUARTER = (0, 1)
+LAST_QUARTER = (9999, 4)
+
+AIRPORT_COLUMNS = ('Origin', 'Dest')
+CARRIER_COLUMNS = tuple(CARRIER_ROLES.values())
+
+def parse_route_filters(args: Mapping[str, str]) -> Dict[str, Any]:
+    """Route filters from request arguments; raises ValueError for invalid ones.
+
+    The quarter range runs from (year_from, quarter_from) to (year_to,
+    quarter_to); the quarters default to the first and last of their years.
+    """
+    filters: Dict[str, Any] = {'role': args.get('role', 'ticketing')}
+    if filters['role'] not in CARRIER_ROLES:
+        raise ValueError(f"role must be one of {', '.join(CARRIER_ROLES)}")
+    for name, length in (('origin', 3), ('dest', 3), ('carrier', 2)):
+        value = args.get(name)
+        if value:
+            if len(value) != length or not value.isalnum():
+                raise ValueError(f"Invalid {name}: {value}")
+            filters[name] = value.upper()
+    first = (int(args.get('year_from', FIRST_QUARTER[0])), int(args.get('quarter_from', FIRST_QUARTER[1])))
+    last = (int(args.get('year_to', LAST_QUARTER[0])), int(args.get('quarter_to', LAST_QUARTER[1])))
+    if not (1 <= first[1] <= 4 and 1 <= last[1] <= 4):
+        raise ValueError("Quarters must be between 1 and 4")
+    filters['period'] = (first, last)
+    return filters
+
+def uses_summary(conn: sqlite3.Connection, role: str, period: Tuple[Tuple[int, int], Tuple[int, int]]) -> bool:
+    """Whether a role's aggregates over period can be read from summary_route_carrier_quarter instead of flights.
+
+    The summary has to have the role's column and rows for every quarter of
+    flights in the period; databases from before the summaries, or before
+    they had reporting carriers, are aggregated from flights until the
+    loader or flights_summary.py fills them in.
+    """
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(summary_route_carrier_quarter)')}
+    if CARRIER_ROLES[role] not in columns:
+        return False
+    first, last = period
+    summarized = set(table_quarters(conn, 'summary_route_carrier_quarter'))
+    return all(key in summarized for key in table_quarters(conn) if first <= key <= last)
+
+def traffic(conn: sqlite3.Connection, filters: Dict[str, Any], group: Sequence[str], compact: bool,
+            limit: Optional[int] = None) -> List[Tuple]:
+    """Passengers and coupons grouped by the given columns, most passengers first.
+
+    Rows are (*group values, passengers, coupons) with text codes. Queries
+    are answered from the route x carrier summary where it exists, otherwise
+    from flights; compact layouts are then grouped on the stored ids, and
+    only the result is decoded.
+    """
+    role_column = CARRIER_ROLES[filters['role']]
+    summary = uses_summary(conn, filters['role'], filters['period'])
+    conditions = ['(year, quarter) BETWEEN (?, ?) AND (?, ?)']
+    params: List[Any] = [*filters['period'][0], *filters['period'][1]]
+    for name, column, table in (('origin', 'Origin', 'airports'), ('dest', 'Dest', 'airports'),
+                                ('carrier', role_column, 'carriers')):
+        if filters.get(name) is None:
+            continue
+        value = filters[name] if summary else stored_code(conn, table, filters[name], compact)
+        if value is None:
+            return []
+        conditions.append(f'{column} = ?')
+        params.append(value)
+
+    columns = ', '.join(group)
+    where = ' AND '.join(conditions)
+    if summary:
+        query = f'''
+            SELECT {columns}, SUM(Passengers) AS passengers, SUM(Coupons) AS coupons
+            FROM summary_route_carrier_quarter WHERE {where}
+            GROUP BY {columns}
+        '''
+    else:
+        query = f'''
+            SELECT {columns}, SUM(Passengers) AS passengers, COUNT(*) AS coupons
+            FROM flights WHERE {where}
+            GROUP BY {columns}
+        '''
+        if compact:
+            decoded = ', '.join(
+                f'(SELECT code FROM airports WHERE id = g.{column})' if column in AIRPORT_COLUMNS else
+                f'(SELECT code FROM carriers WHERE id = g.{column})' if column in CARRIER_COLUMNS else
+                f'g.{column}'
+                for column in group)
+            query = f'SELECT {decoded}, g.passengers, g.coupons FROM ({query}) g'
+    query += ' ORDER BY passengers DESC' + (' LIMIT ?' if limit else '')
+    return conn.execute(query, params + ([limit] if limit else [])).fetchall()
+
+def top_routes(conn: sqlite3.Connection, filters: Dict[str, Any], limit: int, compact: bool) -> List[Dict[str, Any]]:
+    return [{'origin': origin, 'dest': dest, 'passengers': passengers, 'coupons': coupons}
+            for origin, dest, passengers, coupons in traffic(conn, filters, ('Origin', 'Dest'), compact, limit)]
+
+def route_detail(conn: sqlite3.Connection, filters: Dict[str, Any], compact: bool) -> Dict[str, Any]:
+    """Totals of the route from filters' origin to dest, carrier shares in the filter role and passengers per quarter"""
+    carriers = traffic(conn, filters, (CARRIER_ROLES[filters['role']],), compact)
+    passengers = sum(row[1] for row in carriers)
+    quarters = traffic(conn, filters, ('year', 'quarter'), compact)
+    return {
+        'origin': filters['origin'],
+        'dest': filters['dest'],
+        'role': filters['role'],
+        'passengers': passengers,
+        'coupons': sum(row[2] for row in carriers),
+        'carriers': [{'carrier': carrier, 'passengers': total, 'coupons': coupons,
+                      'share': total / passengers if passengers else None}
+                     for carrier, total, coupons in carriers],
+        'quarters': sorted(({'year': year, 'quarter': quarter, 'passengers': total, 'coupons': coupons}
+                            for year, quarter, total, coupons in quarters),
+                           key=lambda row: (row['year'], row['quarter'])),
+    }
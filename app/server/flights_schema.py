@@ -0,0 +1,214 @@
+import sqlite3
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+STANDARD = 'standard'
+COMPACT = 'compact'
+LAYOUTS = (STANDARD, COMPACT)
+
+FLIGHTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL CHECK (quarter BETWEEN 1 AND 4),
+        ItinID CHAR(6) NOT NULL,  -- Hex encoded, without year prefix
+        SeqNum INTEGER NOT NULL,
+        Coupons INTEGER NOT NULL,
+        Origin CHAR(3) NOT NULL,   -- Airport codes are always 3 chars
+        Dest CHAR(3) NOT NULL,     -- Airport codes are always 3 chars
+        CouponType CHAR(1) NOT NULL,
+        TkCarrier CHAR(2) NOT NULL,
+        OpCarrier CHAR(2) NOT NULL,
+        RPCarrier CHAR(2) NOT NULL,
+        Passengers REAL NOT NULL
+        {constraints}
+    ){options}
+'''
+
+# Compact layout: integer ItinID, surrogate keys into the dimension tables
+# and an integer passenger count, clustered on the primary key
+COMPACT_FLIGHTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL CHECK (quarter BETWEEN 1 AND 4),
+        ItinID INTEGER NOT NULL,   -- Numeric ItinID without year prefix
+        SeqNum INTEGER NOT NULL,
+        Coupons INTEGER NOT NULL,
+        Origin INTEGER NOT NULL,   -- airports.id
+        Dest INTEGER NOT NULL,     -- airports.id
+        CouponType CHAR(1) NOT NULL,
+        TkCarrier INTEGER NOT NULL,  -- carriers.id
+        OpCarrier INTEGER NOT NULL,  -- carriers.id
+        RPCarrier INTEGER NOT NULL,  -- carriers.id
+        Passengers INTEGER NOT NULL
+        {constraints}
+    ){options}
+'''
+
+DIMENSION_TABLES = ('airports', 'carriers')
+
+DIMENSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        code TEXT NOT NULL UNIQUE
+    )
+'''
+
+# Both layouts are read through flights_decoded, which always has text codes
+# and a hex ItinID; ItinKey is the stored ItinID for indexed lookups. The
+# compact view uses LEFT JOINs so the planner keeps flights as the outer loop
+# instead of scanning the small dimension tables first.
+STANDARD_DECODED_VIEW = '''
+    CREATE VIEW IF NOT EXISTS flights_decoded AS
+    SELECT year, quarter, ItinID, SeqNum, Coupons, Origin, Dest, CouponType,
+           TkCarrier, OpCarrier, RPCarrier, Passengers, ItinID AS ItinKey
+    FROM flights
+'''
+
+COMPACT_DECODED_VIEW = '''
+    CREATE VIEW IF NOT EXISTS flights_decoded AS
+    SELECT f.year, f.quarter, printf('%06X', f.ItinID) AS ItinID, f.SeqNum, f.Coupons,
+           o.code AS Origin, d.code AS Dest, f.CouponType,
+           tk.code AS TkCarrier, op.code AS OpCarrier, rp.code AS RPCarrier,
+           f.Passengers, f.ItinID AS ItinKey
+    FROM flights f
+    LEFT JOIN airports o ON o.id = f.Origin
+    LEFT JOIN airports d ON d.id = f.Dest
+    LEFT JOIN carriers tk ON tk.id = f.TkCarrier
+    LEFT JOIN carriers op ON op.id = f.OpCarrier
+    LEFT JOIN carriers rp ON rp.id = f.RPCarrier
+'''
+
+# One row per loaded (dataset, year, quarter); status is loading, complete or failed
+INGEST_MANIFEST_TABLE = '''
+    CREATE TABLE IF NOT EXISTS ingest_manifest (
+        dataset TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL CHECK (quarter BETWEEN 1 AND 4),
+        source_url TEXT,
+        archive_size INTEGER,
+        archive_sha256 TEXT,
+        row_count INTEGER,
+        rejected_count INTEGER,
+        load_seconds REAL,
+        status TEXT NOT NULL CHECK (status IN ('loading', 'complete', 'failed')),
+        message TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        PRIMARY KEY (dataset, year, quarter)
+    )
+'''
+
+# Bumped whenever a loader records a quarter's outcome, in the same
+# transaction, so readers can tell their cached results are out of date.
+# database_id is a random id given to each new database, so a rebuilt one
+# is never mistaken for the old one at the same generation.
+DATA_GENERATION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS data_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL,
+        database_id TEXT
+    )
+'''
+
+FLIGHTS_COLUMNS = ['year', 'quarter', 'ItinID', 'SeqNum', 'Coupons', 'Origin', 'Dest',
+                   'CouponType', 'TkCarrier', 'OpCarrier', 'RPCarrier', 'Passengers']
+
+# Positions of the coded columns in a flights record tuple
+AIRPORT_FIELDS = (5, 6)
+CARRIER_FIELDS = (8, 9, 10)
+
+# Secondary indexes for common query patterns, by name; idx_itinid serves
+# the API's itinerary lookups in both layouts. The idx_itin_* indexes hold
+# one entry per itinerary (its first coupon) in browse order, by origin and
+# by ticketing carrier; every column a browse query reads is in the index.
+# idx_route_period serves route filters, and /api/routes on databases
+# without summaries.
+SECONDARY_INDEXES = {
+    'idx_itinid': 'flights(ItinID, year, quarter, SeqNum)',
+    'idx_itin_browse': 'flights(year, quarter, ItinID, SeqNum) WHERE SeqNum = 1',
+    'idx_itin_origin': 'flights(Origin, year, quarter, ItinID, SeqNum, TkCarrier) WHERE SeqNum = 1',
+    'idx_itin_carrier': 'flights(TkCarrier, year, quarter, ItinID, SeqNum, Origin) WHERE SeqNum = 1',
+    'idx_temporal': 'flights(year, quarter)',
+    'idx_route_period': 'flights(Origin, Dest, year, quarter)',
+    'idx_carriers': 'flights(TkCarrier, OpCarrier)',
+}
+
+# Indexes earlier versions created that a SECONDARY_INDEXES entry now supersedes
+OBSOLETE_INDEXES = ('idx_route',)
+
+def detect_layout(conn: sqlite3.Connection) -> Optional[str]:
+    """Return the layout of an existing flights table, or None if there is none"""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'flights' not in tables:
+        return None
+    return COMPACT if 'airports' in tables else STANDARD
+
+def create_flights_table(conn: sqlite3.Connection, layout: str = STANDARD) -> None:
+    constraints = ', PRIMARY KEY (year, quarter, ItinID, SeqNum)'
+    if layout == COMPACT:
+        for name in DIMENSION_TABLES:
+            conn.execute(DIMENSION_TABLE.format(name=name))
+        conn.execute(COMPACT_FLIGHTS_TABLE.format(name='flights', constraints=constraints,
+                                                  options=' WITHOUT ROWID'))
+        conn.execute(COMPACT_DECODED_VIEW)
+    else:
+        conn.execute(FLIGHTS_TABLE.format(name='flights', constraints=constraints, options=''))
+        conn.execute(STANDARD_DECODED_VIEW)
+
+def create_manifest_table(conn: sqlite3.Connection) -> None:
+    conn.execute(INGEST_MANIFEST_TABLE)
+    conn.execute(DATA_GENERATION_TABLE)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(data_generation)')}
+    if 'database_id' not in columns:  # Created before databases had an id
+        conn.execute('ALTER TABLE data_generation ADD COLUMN database_id TEXT')
+    conn.execute('''
+        INSERT INTO data_generation (id, generation, database_id) VALUES (1, 0, ?)
+        ON CONFLICT (id) DO UPDATE SET database_id = coalesce(database_id, excluded.database_id)
+    ''', (uuid.uuid4().hex,))
+
+def bump_data_generation(conn: sqlite3.Connection) -> None:
+    """Mark the loaded data as changed; the caller commits"""
+    conn.execute('''
+        INSERT INTO data_generation (id, generation) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE SET generation = generation + 1
+    ''')
+
+def database_version(conn: sqlite3.Connection) -> Tuple[Optional[str], int]:
+    """The database id and current data generation; (None, 0) for a database no loader has opened yet"""
+    for query in ('SELECT database_id, generation FROM data_generation WHERE id = 1',
+                  'SELECT NULL, generation FROM data_generation WHERE id = 1'):  # Before databases had an id
+        try:
+            row = conn.execute(query).fetchone()
+        except sqlite3.OperationalError:  # Created before the table existed
+            continue
+        return (row[0], row[1]) if row else (None, 0)
+    return None, 0
+
+def table_quarters(conn: sqlite3.Connection, table: str = 'flights') -> List[Tuple[int, int]]:
+    """Distinct (year, quarter) of a table whose primary key starts with them.
+
+    SQLite skips ahead through the index from one quarter to the next, so
+    this reads about one entry per quarter, not the whole table.
+    """
+    return [tuple(row) for row in conn.execute(f'SELECT DISTINCT year, quarter FROM {table} ORDER BY year, quarter')]
+
+def manifest_status(conn: sqlite3.Connection, dataset: str) -> Dict[Tuple[int, int], str]:
+    """Return the manifest status of every (year, quarter) of a dataset"""
+    rows = conn.execute('SELECT year, quarter, status FROM ingest_manifest WHERE dataset = ?', (dataset,))
+    return {(year, quarter): status for year, quarter, status in rows}
+
+def create_staging_table(conn: sqlite3.Connection, name: str, layout: str = STANDARD) -> None:
+    """Create an unindexed table with the flights columns for bulk loading"""
+    table = COMPACT_FLIGHTS_TABLE if layout == COMPACT else FLIGHTS_TABLE
+    conn.execute(table.format(name=name, constraints='', options=''))
+
+def create_secondary_indexes(conn: sqlite3.Connection) -> None:
+    """Create the missing flights indexes and drop obsolete ones, so a load does not maintain them"""
+    for name in OBSOLETE_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+    for name, target in SECONDARY_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+
+def drop_secondary_indexes(conn: sqlite3.Connection) -> None:
+    for name in (*SECONDARY_INDEXES, *OBSOLETE_INDEXES):
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
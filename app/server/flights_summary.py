@@ -0,0 +1,229 @@
+import argparse
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Tuple
+
+try:
+    from .flights_schema import COMPACT, bump_data_generation, create_manifest_table, detect_layout, table_quarters
+except ImportError:
+    from flights_schema import COMPACT, bump_data_generation, create_manifest_table, detect_layout, table_quarters
+
+# Passenger and coupon totals at three grains. Codes are stored as text in
+# both layouts; Origin/Dest are the coupon's directional segment.
+SUMMARY_TABLES = {
+    'summary_route_carrier_quarter': '''
+        CREATE TABLE IF NOT EXISTS summary_route_carrier_quarter (
+            year INTEGER NOT NULL,
+            quarter INTEGER NOT NULL,
+            Origin CHAR(3) NOT NULL,
+            Dest CHAR(3) NOT NULL,
+            TkCarrier CHAR(2) NOT NULL,
+            OpCarrier CHAR(2) NOT NULL,
+            RPCarrier CHAR(2) NOT NULL,
+            Passengers REAL NOT NULL,
+            Coupons INTEGER NOT NULL,
+            PRIMARY KEY (year, quarter, Origin, Dest, TkCarrier, OpCarrier, RPCarrier)
+        ) WITHOUT ROWID
+    ''',
+    'summary_route_quarter': '''
+        CREATE TABLE IF NOT EXISTS summary_route_quarter (
+            year INTEGER NOT NULL,
+            quarter INTEGER NOT NULL,
+            Origin CHAR(3) NOT NULL,
+            Dest CHAR(3) NOT NULL,
+            Passengers REAL NOT NULL,
+            Coupons INTEGER NOT NULL,
+            PRIMARY KEY (year, quarter, Origin, Dest)
+        ) WITHOUT ROWID
+    ''',
+    'summary_carrier_quarter': '''
+        CREATE TABLE IF NOT EXISTS summary_carrier_quarter (
+            year INTEGER NOT NULL,
+            quarter INTEGER NOT NULL,
+            TkCarrier CHAR(2) NOT NULL,
+            OpCarrier CHAR(2) NOT NULL,
+            Passengers REAL NOT NULL,
+            Coupons INTEGER NOT NULL,
+            PRIMARY KEY (year, quarter, TkCarrier, OpCarrier)
+        ) WITHOUT ROWID
+    ''',
+}
+
+# Key columns of each summary, after year and quarter
+SUMMARY_KEYS = {
+    'summary_route_carrier_quarter': ['Origin', 'Dest', 'TkCarrier', 'OpCarrier', 'RPCarrier'],
+    'summary_route_quarter': ['Origin', 'Dest'],
+    'summary_carrier_quarter': ['TkCarrier', 'OpCarrier'],
+}
+
+# Lookups across quarters by route or carrier
+SUMMARY_INDEXES = {
+    'idx_summary_route': 'summary_route_quarter(Origin, Dest, year, quarter)',
+    'idx_summary_route_carrier': 'summary_route_carrier_quarter(Origin, Dest, year, quarter)',
+}
+
+# Sums of REAL passenger counts may differ in the last bits depending on the order they were added in
+PASSENGER_TOLERANCE = 1e-6
+
+# The finest summary is grouped straight from a quarter's flights rows; the
+# compact layout groups on the stored keys and decodes the much smaller result
+STANDARD_GROUPING = '''
+    SELECT year, quarter, Origin, Dest, TkCarrier, OpCarrier, RPCarrier, SUM(Passengers), COUNT(*)
+    FROM flights WHERE year = ? AND quarter = ?
+    GROUP BY Origin, Dest, TkCarrier, OpCarrier, RPCarrier
+'''
+
+COMPACT_GROUPING = '''
+    SELECT s.year, s.quarter, o.code, d.code, tk.code, op.code, rp.code, s.passengers, s.coupons
+    FROM (
+        SELECT year, quarter, Origin, Dest, TkCarrier, OpCarrier, RPCarrier,
+               SUM(Passengers) AS passengers, COUNT(*) AS coupons
+        FROM flights WHERE year = ? AND quarter = ?
+        GROUP BY Origin, Dest, TkCarrier, OpCarrier, RPCarrier
+    ) s
+    JOIN airports o ON o.id = s.Origin
+    JOIN airports d ON d.id = s.Dest
+    JOIN carriers tk ON tk.id = s.TkCarrier
+    JOIN carriers op ON op.id = s.OpCarrier
+    JOIN carriers rp ON rp.id = s.RPCarrier
+'''
+
+def create_summary_tables(conn: sqlite3.Connection, layout: str) -> List[Tuple[int, int]]:
+    """Create the summary tables, fill in the quarters of flights they are missing and return those.
+
+    This covers quarters loaded before the summaries existed, and a route x
+    carrier summary from before RPCarrier was added, which is recreated.
+    Runs in the caller's transaction; the caller commits.
+    """
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(summary_route_carrier_quarter)')}
+    if columns and 'RPCarrier' not in columns:
+        conn.execute('DROP TABLE summary_route_carrier_quarter')
+    for ddl in SUMMARY_TABLES.values():
+        conn.execute(ddl)
+    for name, target in SUMMARY_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+    keys = sorted(set(table_quarters(conn)) - set(table_quarters(conn, 'summary_route_carrier_quarter')))
+    for key in keys:
+        refresh_summaries(conn, key, layout)
+    return keys
+
+def delete_summaries(conn: sqlite3.Connection, key: Tuple[int, int], prefix: str = '') -> None:
+    for name in SUMMARY_TABLES:
+        conn.execute(f'DELETE FROM {prefix}{name} WHERE year = ? AND quarter = ?', key)
+
+def build_summaries(conn: sqlite3.Connection, key: Tuple[int, int], layout: str, prefix: str = '') -> None:
+    """Insert a quarter's rows into the summary tables named prefix + table name.
+
+    Only the route x carrier summary reads flights, with one pass over the
+    quarter's primary key range; the route and carrier summaries are rolled
+    up from it.
+    """
+    grouping = COMPACT_GROUPING if layout == COMPACT else STANDARD_GROUPING
+    conn.execute(f'''
+        INSERT INTO {prefix}summary_route_carrier_quarter
+        (year, quarter, Origin, Dest, TkCarrier, OpCarrier, RPCarrier, Passengers, Coupons)
+        {grouping}
+    ''', key)
+    for name in ('summary_route_quarter', 'summary_carrier_quarter'):
+        columns = ', '.join(SUMMARY_KEYS[name])
+        conn.execute(f'''
+            INSERT INTO {prefix}{name} (year, quarter, {columns}, Passengers, Coupons)
+            SELECT year, quarter, {columns}, SUM(Passengers), SUM(Coupons)
+            FROM {prefix}summary_route_carrier_quarter WHERE year = ? AND quarter = ?
+            GROUP BY {columns}
+        ''', key)
+
+def refresh_summaries(conn: sqlite3.Connection, key: Tuple[int, int], layout: str) -> None:
+    """Replace a quarter's summary rows from flights; the caller commits"""
+    delete_summaries(conn, key)
+    build_summaries(conn, key, layout)
+
+def summary_quarters(conn: sqlite3.Connection) -> List[Tuple[int, int]]:
+    """Quarters present in flights or in the summaries, including ones loaded before the summaries existed"""
+    return sorted(set(table_quarters(conn)) | set(table_quarters(conn, 'summary_carrier_quarter')))
+
+def check_summaries(conn: sqlite3.Connection, key: Tuple[int, int], layout: str) -> Dict[str, int]:
+    """Rebuild a quarter's summaries from flights into temp tables and count differing rows per table.
+
+    A row differs when it is missing from either side or its passengers or
+    coupons disagree.
+    """
+    for name, ddl in SUMMARY_TABLES.items():
+        conn.execute(f'DROP TABLE IF EXISTS temp.check_{name}')
+        conn.execute(ddl.replace(f'CREATE TABLE IF NOT EXISTS {name}', f'CREATE TEMP TABLE check_{name}'))
+    build_summaries(conn, key, layout, prefix='check_')
+
+    mismatches = {}
+    for name, keys in SUMMARY_KEYS.items():
+        join = ' AND '.join(f'a.{column} = b.{column}' for column in ['year', 'quarter'] + keys)
+        # Rebuilt rows missing from the stored summary or different in it
+        wrong = conn.execute(f'''
+            SELECT COUNT(*) FROM check_{name} a LEFT JOIN {name} b ON {join}
+            WHERE a.year = ? AND a.quarter = ?
+              AND (b.year IS NULL OR abs(a.Passengers - b.Passengers) > {PASSENGER_TOLERANCE}
+                   OR a.Coupons != b.Coupons)
+        ''', key).fetchone()[0]
+        # Stored rows the rebuild no longer produces
+        extra = conn.execute(f'''
+            SELECT COUNT(*) FROM {name} a LEFT JOIN check_{name} b ON {join}
+            WHERE a.year = ? AND a.quarter = ? AND b.year IS NULL
+        ''', key).fetchone()[0]
+        mismatches[name] = wrong + extra
+        conn.execute(f'DROP TABLE temp.check_{name}')
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check or rebuild the flights summary tables")
+    parser.add_argument('command', choices=['check', 'rebuild'],
+                        help="check compares the summaries against flights; rebuild recomputes them")
+    parser.add_argument('--db', default='flights.db', help="Database path (default: flights.db)")
+    parser.add_argument('--year', type=int, help="Only this year")
+    parser.add_argument('--quarter', type=int, help="Only this quarter")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    with sqlite3.connect(args.db) as conn:
+        layout = detect_layout(conn)
+        if layout is None:
+            raise SystemExit(f"{args.db} has no flights table")
+        filled = []
+        if args.command == 'rebuild':
+            create_manifest_table(conn)
+            filled = create_summary_tables(conn, layout)
+            if filled:
+                bump_data_generation(conn)
+                conn.commit()
+                logger.info(f"Summarized {len(filled)} quarter(s) of flights missing from the summaries")
+        else:
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(summary_route_carrier_quarter)')}
+            if 'RPCarrier' not in columns:
+                raise SystemExit(f"{args.db} has no current summary tables; run with rebuild to create them")
+        keys = [
+            key for key in summary_quarters(conn)
+            if key not in filled
+            and (args.year is None or key[0] == args.year) and (args.quarter is None or key[1] == args.quarter)]
+
+        failed = 0
+        for key in keys:
+            start = time.time()
+            if args.command == 'rebuild':
+                refresh_summaries(conn, key, layout)
+                bump_data_generation(conn)
+                conn.commit()
+                logger.info(f"Rebuilt summaries for {key[0]} Q{key[1]} in {time.time() - start:.1f}s")
+                continue
+
+            mismatches = check_summaries(conn, key, layout)
+            if any(mismatches.values()):
+                failed += 1
+                logger.error(f"{key[0]} Q{key[1]} differs from flights: " +
+                             ', '.join(f"{name} {count:,} rows" for name, count in mismatches.items() if count))
+            else:
+                logger.info(f"{key[0]} Q{key[1]} matches flights ({time.time() - start:.1f}s)")
+
+        if not keys and not filled:
+            logger.info("No loaded quarters to process")
+        if failed:
+            raise SystemExit(f"{failed} quarter(s) have inconsistent summaries; run with rebuild to fix them")
@@ -0,0 +1,343 @@
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Set, Tuple
+from flights_schema import (AIRPORT_FIELDS, CARRIER_FIELDS, COMPACT, FLIGHTS_COLUMNS, STANDARD, bump_data_generation,
+                            create_secondary_indexes, create_staging_table, drop_secondary_indexes)
+from flights_summary import refresh_summaries
+from flights_parquet import (DEFAULT_COMPRESSION, DEFAULT_ROW_GROUP_SIZE, discard_staging,
+                             open_partition_writer, publish_partition, require_pyarrow)
+
+INSERT_COLUMNS = ', '.join(FLIGHTS_COLUMNS)
+INSERT_PLACEHOLDERS = ', '.join('?' * len(FLIGHTS_COLUMNS))
+
+# The writer waits this long for another loader's transaction instead of failing
+BUSY_TIMEOUT_SECONDS = 60
+
+class FlightsWriter(threading.Thread):
+    """Single owner of the flights.db connection during an ingest.
+
+    Parse workers put messages on a bounded queue and this thread applies
+    them, so SQLite only ever sees one writer:
+
+        ('start', (year, quarter), source)    a quarter's archive is being parsed
+        ('batch', (year, quarter), records)   insert a list of flights tuples
+        ('commit', (year, quarter), stats)    the quarter was parsed completely
+        ('abort', (year, quarter), reason)    the quarter failed, drop its rows
+        None                                  stop after committing
+
+    Batches go into an unindexed staging table per quarter, so quarters can
+    interleave freely: a committed quarter is merged into flights in
+    primary-key order and its staging table dropped, and an aborted one only
+    loses its staging table. Rows already in flights, e.g. an earlier load of
+    a quarter being reloaded with --force, are untouched until the merge.
+    Once the stop event is set, the open transaction is rolled back and every
+    quarter still in flight is discarded.
+
+    If the writer fails, including while opening the database, it records
+    the error, sets the stop event and keeps draining the queue until None,
+    so parse workers never block on a full queue.
+
+    The database is switched to WAL, so API readers, e.g. a slow client of
+    a streamed response, never keep a quarter from committing.
+
+    With the compact layout, airport and carrier codes are replaced by their
+    surrogate keys before insert, adding new codes to the dimension tables.
+
+    Every quarter's start is committed to ingest_manifest under dataset as
+    soon as it arrives, and its outcome in the same transaction as its
+    rows; a committed quarter's rows in the summary tables are rebuilt in
+    that transaction too.
+    """
+
+    def __init__(self, db_path: str, batches, stop_event, logger: logging.Logger, layout: str = STANDARD,
+                 dataset: str = 'db1b_coupon'):
+        super().__init__(name='FlightsWriter', daemon=True)
+        self.db_path = db_path
+        self.layout = layout
+        self.dataset = dataset
+        self.batches = batches
+        self.stop_event = stop_event
+        self.logger = logger
+        self.error = None
+        self.row_counts: Dict[Tuple[int, int], int] = {}
+        self.committed: List[Tuple[int, int]] = []
+        self.aborted: Set[Tuple[int, int]] = set()
+        self.staged: Set[Tuple[int, int]] = set()
+        self.airport_ids: Dict[str, int] = {}
+        self.carrier_ids: Dict[str, int] = {}
+        self.started: Dict[Tuple[int, int], float] = {}
+
+    def run(self):
+        conn = None
+        ready = False
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS)
+            self.load_dimensions(conn)
+            self.begin(conn)
+            ready = True
+        except Exception as e:
+            self.fail(conn, "setup", e)
+
+        while True:
+            message = self.batches.get()
+            if message is None:
+                break
+            if self.error is not None:
+                continue  # Keep draining so parse workers never block on a full queue
+
+            kind, key, payload = message
+            if self.stop_event.is_set():
+                if conn.in_transaction:
+                    self.rollback(conn)
+                if kind == 'batch':
+                    continue
+                kind, payload = 'abort', 'ingest stopped'
+            try:
+                if kind == 'batch':
+                    if key not in self.aborted:
+                        self.insert_batch(conn, key, payload)
+                elif kind == 'start':
+                    self.start_quarter(conn, key, payload)
+                elif kind == 'commit':
+                    self.commit_quarter(conn, key, payload)
+                elif kind == 'abort':
+                    self.abort_quarter(conn, key, payload)
+            except Exception as e:
+                self.fail(conn, f"{kind} for {key[0]} Q{key[1]}", e)
+
+        try:
+            if ready:
+                if self.error is None and not self.stop_event.is_set():
+                    conn.commit()
+                else:
+                    self.rollback(conn)
+                self.finish(conn)
+        except Exception as e:
+            self.logger.error(f"Writer failed while finishing: {str(e)}")
+            self.error = self.error or e
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def fail(self, conn: sqlite3.Connection, step: str, error: Exception) -> None:
+        """Record the writer's first error, stop the ingest and drop the open transaction"""
+        self.logger.error(f"Writer failed on {step}: {str(error)}")
+        self.error = error
+        self.stop_event.set()
+        if conn is not None:
+            try:
+                self.rollback(conn)
+            except sqlite3.Error:
+                pass
+
+    def begin(self, conn: sqlite3.Connection) -> None:
+        """Called on the writer thread before the first message"""
+        conn.execute('PRAGMA journal_mode = WAL')
+
+    def rollback(self, conn: sqlite3.Connection) -> None:
+        conn.rollback()
+        # Codes added in the rolled back transaction are gone again
+        self.load_dimensions(conn)
+
+    def load_dimensions(self, conn: sqlite3.Connection) -> None:
+        if self.layout != COMPACT:
+            return
+        self.airport_ids = dict(conn.execute('SELECT code, id FROM airports'))
+        self.carrier_ids = dict(conn.execute('SELECT code, id FROM carriers'))
+
+    @staticmethod
+    def staging_table(key: Tuple[int, int]) -> str:
+        return f"flights_staging_{key[0]}_{key[1]}"
+
+    def start_quarter(self, conn: sqlite3.Connection, key: Tuple[int, int], source: Dict[str, Any]) -> None:
+        self.started[key] = time.time()
+        conn.execute('''
+            INSERT OR REPLACE INTO ingest_manifest
+            (dataset, year, quarter, source_url, archive_size, archive_sha256, status, started_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'loading', ?)
+        ''', (self.dataset, key[0], key[1], source.get('url'), source.get('size'), source.get('sha256'),
+              datetime.now().isoformat(timespec='seconds')))
+        # Committed now, so a later rollback cannot lose the archive's provenance
+        conn.commit()
+
+    def record_outcome(self, conn: sqlite3.Connection, key: Tuple[int, int], status: str,
+                       stats: Dict[str, int] = None, message: str = None) -> None:
+        """Record a quarter as complete or failed in ingest_manifest and bump the data generation; the caller commits"""
+        stats = stats or {}
+        started = self.started.get(key)
+        conn.execute('''
+            INSERT INTO ingest_manifest
+            (dataset, year, quarter, row_count, rejected_count, load_seconds, status, message, finished_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (dataset, year, quarter) DO UPDATE SET
+                row_count = excluded.row_count,
+                rejected_count = excluded.rejected_count,
+                load_seconds = excluded.load_seconds,
+                status = excluded.status,
+                message = excluded.message,
+                finished_at = excluded.finished_at
+        ''', (self.dataset, key[0], key[1], stats.get('records'), stats.get('rejected'),
+              time.time() - started if started else None, status, message,
+              datetime.now().isoformat(timespec='seconds')))
+        bump_data_generation(conn)
+
+    def refresh_summaries(self, conn: sqlite3.Connection, key: Tuple[int, int]) -> None:
+        start = time.time()
+        refresh_summaries(conn, key, self.layout)
+        self.logger.info(f"Summarized {key[0]} Q{key[1]} in {time.time() - start:.1f}s")
+
+    def encode_batch(self, conn: sqlite3.Connection, records: List[tuple]) -> List[tuple]:
+        """Replace airport and carrier codes with surrogate keys for the compact layout"""
+        if self.layout != COMPACT:
+            return records
+        
+        for table, ids, fields in (('airports', self.airport_ids, AIRPORT_FIELDS),
+                                   ('carriers', self.carrier_ids, CARRIER_FIELDS)):
+            codes = {record[i] for record in records for i in fields}
+            new_codes = sorted(codes.difference(ids))
+            if new_codes:
+                conn.executemany(f'INSERT INTO {table} (code) VALUES (?)', [(code,) for code in new_codes])
+                ids.update(conn.execute(
+                    f'SELECT code, id FROM {table} WHERE code IN ({", ".join("?" * len(new_codes))})',
+                    new_codes))
+        
+        airports, carriers = self.airport_ids, self.carrier_ids
+        return [(r[0], r[1], r[2], r[3], r[4], airports[r[5]], airports[r[6]], r[7],
+                 carriers[r[8]], carriers[r[9]], carriers[r[10]], r[11]) for r in records]
+
+    def finish(self, conn: sqlite3.Connection) -> None:
+        """Called on the writer thread after the last message; drops staging tables of unfinished quarters"""
+        for key in self.staged:
+            conn.execute(f'DROP TABLE IF EXISTS {self.staging_table(key)}')
+        conn.commit()
+
+    def insert_batch(self, conn: sqlite3.Connection, key: Tuple[int, int], records: List[tuple]) -> None:
+        table = self.staging_table(key)
+        if key not in self.staged:
+            conn.execute(f'DROP TABLE IF EXISTS {table}')
+            create_staging_table(conn, table, self.layout)
+            self.staged.add(key)
+        records = self.encode_batch(conn, records)
+        conn.executemany(f'INSERT INTO {table} VALUES ({INSERT_PLACEHOLDERS})', records)
+        self.row_counts[key] = self.row_counts.get(key, 0) + len(records)
+
+    def commit_quarter(self, conn: sqlite3.Connection, key: Tuple[int, int], stats: Dict[str, int]) -> None:
+        table = self.staging_table(key)
+        if key in self.staged:
+            start = time.time()
+            conn.execute(f'''
+                INSERT OR REPLACE INTO flights ({INSERT_COLUMNS})
+                SELECT {INSERT_COLUMNS} FROM {table}
+                ORDER BY ItinID, SeqNum
+            ''')
+            conn.execute(f'DROP TABLE {table}')
+            self.staged.discard(key)
+            self.logger.info(f"Merged {key[0]} Q{key[1]} into flights in {time.time() - start:.1f}s")
+        self.refresh_summaries(conn, key)
+        self.record_outcome(conn, key, 'complete', stats)
+        conn.commit()
+        self.committed.append(key)
+        self.logger.info(f"Committed {key[0]} Q{key[1]}: {self.row_counts.get(key, 0):,} records")
+
+    def abort_quarter(self, conn: sqlite3.Connection, key: Tuple[int, int], reason: str) -> None:
+        # Nothing reaches flights before the merge, so dropping the staging table is enough
+        if key in self.aborted:
+            return
+        self.aborted.add(key)
+        if key in self.staged:
+            conn.execute(f'DROP TABLE IF EXISTS {self.staging_table(key)}')
+            self.staged.discard(key)
+        self.record_outcome(conn, key, 'failed', message=reason)
+        conn.commit()
+        self.logger.warning(f"Discarded {key[0]} Q{key[1]}: {reason}")
+
+class BulkFlightsWriter(FlightsWriter):
+    """FlightsWriter for large loads.
+
+    The connection runs with synchronous=NORMAL, a large page cache and
+    in-memory temp storage. The secondary indexes are dropped up front, so
+    merging a quarter only maintains the primary key; they are rebuilt once
+    when the ingest finishes. The loader then refreshes the planner
+    statistics through schema_manager.prepare_database.
+    """
+
+    def __init__(self, db_path: str, batches, stop_event, logger: logging.Logger, layout: str = STANDARD,
+                 dataset: str = 'db1b_coupon', cache_size_mb: int = 512):
+        super().__init__(db_path, batches, stop_event, logger, layout, dataset)
+        self.cache_size_mb = cache_size_mb
+
+    def begin(self, conn: sqlite3.Connection) -> None:
+        super().begin(conn)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = {-1024 * self.cache_size_mb}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        drop_secondary_indexes(conn)
+        conn.commit()
+
+    def finish(self, conn: sqlite3.Connection) -> None:
+        super().finish(conn)
+        
+        self.logger.info("Rebuilding secondary indexes...")
+        start = time.time()
+        create_secondary_indexes(conn)
+        conn.commit()
+        self.logger.info(f"Indexes rebuilt in {time.time() - start:.1f}s")
+
+class ParquetFlightsWriter(FlightsWriter):
+    """FlightsWriter that writes quarters to a partitioned Parquet dataset instead of flights.
+
+    Parse workers send pyarrow tables instead of tuples. Each quarter is
+    written to a staging file under parquet_dir/_staging in row groups of
+    row_group_size rows with min/max statistics, and moved to
+    year=Y/quarter=Q/part-0.parquet on commit, replacing an earlier load. An
+    aborted quarter's staging file is deleted. Outcomes are still recorded in
+    flights.db's ingest_manifest, under the writer's own dataset name.
+    """
+
+    def __init__(self, db_path: str, batches, stop_event, logger: logging.Logger, parquet_dir: str,
+                 dataset: str = 'db1b_coupon_parquet', row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 compression: str = DEFAULT_COMPRESSION):
+        require_pyarrow()
+        super().__init__(db_path, batches, stop_event, logger, STANDARD, dataset)
+        self.parquet_dir = parquet_dir
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.writers: Dict[Tuple[int, int], Any] = {}
+
+    def close_writer(self, key: Tuple[int, int]) -> None:
+        writer = self.writers.pop(key, None)
+        if writer is not None:
+            writer.close()
+
+    def finish(self, conn: sqlite3.Connection) -> None:
+        for key in list(self.writers):
+            self.close_writer(key)
+            discard_staging(self.parquet_dir, key)
+
+    def insert_batch(self, conn: sqlite3.Connection, key: Tuple[int, int], table) -> None:
+        if key not in self.writers:
+            self.writers[key] = open_partition_writer(self.parquet_dir, key, self.compression)
+        self.writers[key].write_table(table, row_group_size=self.row_group_size)
+        self.row_counts[key] = self.row_counts.get(key, 0) + table.num_rows
+
+    def commit_quarter(self, conn: sqlite3.Connection, key: Tuple[int, int], stats: Dict[str, int]) -> None:
+        if key in self.writers:
+            self.close_writer(key)
+            publish_partition(self.parquet_dir, key)
+        self.record_outcome(conn, key, 'complete', stats)
+        conn.commit()
+        self.committed.append(key)
+        self.logger.info(f"Committed {key[0]} Q{key[1]}: {self.row_counts.get(key, 0):,} records to Parquet")
+
+    def abort_quarter(self, conn: sqlite3.Connection, key: Tuple[int, int], reason: str) -> None:
+        if key in self.aborted:
+            return
+        self.aborted.add(key)
+        self.close_writer(key)
+        discard_staging(self.parquet_dir, key)
+        self.record_outcome(conn, key, 'failed', message=reason)
+        conn.commit()
+        self.logger.warning(f"Discarded {key[0]} Q{key[1]}: {reason}")
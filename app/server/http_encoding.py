@@ -0,0 +1,152 @@
+import argparse
+import hashlib
+import os
+import tempfile
+import zlib
+from typing import Hashable, Iterable, Iterator, List, Optional, Sequence
+
+try:
+    import brotli
+except ImportError:  # br is optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional
+    zstandard = None
+
+# Content codings in order of preference when a client accepts several
+# equally; br and zstd are only offered when their library is installed
+ENCODINGS = ('br', 'zstd', 'gzip')
+AVAILABLE_ENCODINGS = tuple(encoding for encoding, library in (('br', brotli), ('zstd', zstandard), ('gzip', zlib))
+                            if library is not None)
+
+# Responses are compressed as they are sent, so at cheap levels; sidecars
+# are compressed once and can afford to spend more
+RESPONSE_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+SIDECAR_LEVELS = {'gzip': 9, 'br': 9, 'zstd': 12}
+
+# Sidecars are written next to the data file, e.g. CITY_PAIR_2024_1.txt.gz
+SIDECAR_EXTENSIONS = {'gzip': '.gz', 'br': '.br', 'zstd': '.zst'}
+
+# Smaller bodies are sent as they are
+MIN_COMPRESS_BYTES = 1024
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+READ_BLOCK_BYTES = 16 * 1024 * 1024
+
+def compressible(mimetype: Optional[str]) -> bool:
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES)
+
+def negotiate(accept_encodings, encodings: Sequence[str] = AVAILABLE_ENCODINGS) -> Optional[str]:
+    """The encoding to send from a request's parsed Accept-Encoding, or None for identity"""
+    return accept_encodings.best_match(encodings)
+
+def content_etag(parts: Hashable, encoding: Optional[str]) -> str:
+    """Strong ETag of a representation: whatever it was built from, plus the negotiated encoding.
+
+    The same parts and encoding must always produce the same bytes, e.g. a
+    query and the data version it read, or a file's size and mtime.
+    """
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+    return f"{digest}-{encoding}" if encoding else digest
+
+class Encoder:
+    """Incremental compressor for one response body or sidecar file"""
+
+    def __init__(self, encoding: str, level: Optional[int] = None):
+        self.encoding = encoding
+        level = level or RESPONSE_LEVELS[encoding]
+        if encoding == 'gzip':
+            # A gzip header without a timestamp, so equal input gives equal output
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self.compressor = brotli.Compressor(quality=level)
+        elif encoding == 'zstd':
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f"Unknown encoding '{encoding}', expected one of {ENCODINGS}")
+
+    def encode(self, data: bytes, flush: bool = False) -> bytes:
+        """Compress data; with flush, the output decodes to everything passed so far"""
+        if self.encoding == 'br':
+            out = self.compressor.process(data)
+            return out + self.compressor.flush() if flush else out
+        out = self.compressor.compress(data)
+        if not flush:
+            return out
+        if self.encoding == 'gzip':
+            return out + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return out + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    encoder = Encoder(encoding, level)
+    return encoder.encode(body) + encoder.finish()
+
+def encode_stream(chunks: Iterable, encoding: str) -> Iterator[bytes]:
+    """Compress a streamed body, flushing after each chunk so the client can decode what it has"""
+    encoder = Encoder(encoding)
+    for chunk in chunks:
+        yield encoder.encode(chunk.encode() if isinstance(chunk, str) else chunk, flush=True)
+    yield encoder.finish()
+
+def sidecar_path(path: str, encoding: str) -> str:
+    return path + SIDECAR_EXTENSIONS[encoding]
+
+def current_sidecar(path: str, encoding: str) -> Optional[str]:
+    """The precompressed copy of path in encoding, or None if there is none built from its current content.
+
+    A sidecar carries the modification time of the file it was built from,
+    so one left behind by an older version of the file is ignored.
+    """
+    sidecar = sidecar_path(path, encoding)
+    try:
+        return sidecar if os.stat(sidecar).st_mtime_ns == os.stat(path).st_mtime_ns else None
+    except FileNotFoundError:
+        return None
+
+def build_sidecar(path: str, encoding: str, level: Optional[int] = None) -> str:
+    """Write the precompressed copy of path in encoding"""
+    sidecar = sidecar_path(path, encoding)
+    source = os.stat(path)
+    encoder = Encoder(encoding, level or SIDECAR_LEVELS[encoding])
+    # A unique temporary name, as several processes may build the same sidecar
+    fd, part = tempfile.mkstemp(suffix='.part', prefix=os.path.basename(sidecar) + '.',
+                                dir=os.path.dirname(sidecar) or '.')
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            for block in iter(lambda: src.read(READ_BLOCK_BYTES), b''):
+                dst.write(encoder.encode(block))
+            dst.write(encoder.finish())
+        os.utime(part, ns=(source.st_atime_ns, source.st_mtime_ns))
+        os.replace(part, sidecar)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return sidecar
+
+def build_sidecars(path: str, encodings: Sequence[str] = AVAILABLE_ENCODINGS, force: bool = False) -> List[str]:
+    """Build the sidecars of path that are missing or out of date; returns the ones written"""
+    return [build_sidecar(path, encoding) for encoding in encodings
+            if force or current_sidecar(path, encoding) is None]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build precompressed sidecars for data files")
+    parser.add_argument('files', nargs='+', help="CSV or text files to compress")
+    parser.add_argument('--encodings', nargs='+', choices=ENCODINGS, default=list(AVAILABLE_ENCODINGS),
+                        help="Encodings to build (default: all available)")
+    parser.add_argument('--force', action='store_true', help="Rebuild sidecars that are up to date")
+    args = parser.parse_args()
+    missing = [encoding for encoding in args.encodings if encoding not in AVAILABLE_ENCODINGS]
+    if missing:
+        parser.error(f"{', '.join(missing)} needs a library that is not installed: pip install brotli zstandard")
+    for path in args.files:
+        size = os.path.getsize(path)
+        for sidecar in build_sidecars(path, args.encodings, args.force):
+            print(f"{sidecar}: {os.path.getsize(sidecar):,} bytes ({os.path.getsize(sidecar) / max(size, 1):.1%})")
@@ -0,0 +1,158 @@
+import argparse
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Dict, List, Tuple
+import numpy as np
+
+try:
+    from .output_io import open_input
+except ImportError:
+    from output_io import open_input
+
+# The start of every LINE_STRIDE-th line is kept, so finding a line reads
+# at most LINE_STRIDE - 1 lines past a known offset while the sidecar of a
+# multi-GB file stays a few hundred KB
+LINE_STRIDE = 1024
+READ_BLOCK_BYTES = 16 * 1024 * 1024
+
+# Sidecars are written next to the data file, e.g. CITY_PAIR_2024_1.txt.lines.npy
+SIDECAR_SUFFIX = '.lines.npy'
+
+# Leading values of a sidecar array, before the offsets
+HEADER_FIELDS = ('source_size', 'source_mtime_ns', 'stride', 'line_count')
+
+class LineIndex:
+    """Sparse line-offset index of a text file, kept in a sidecar .npy file.
+
+    The sidecar records the size and modification time of the file it was
+    built from; a sidecar that no longer matches is rebuilt. Lines are
+    numbered from 0, so for a CSV line 0 is the header. Offsets of .gz and
+    .zst files are positions in the decompressed data.
+    """
+
+    def __init__(self, path: str, stamp: Tuple[int, int], offsets: np.ndarray, line_count: int,
+                 stride: int = LINE_STRIDE):
+        self.path = path
+        self.stamp = stamp
+        self.offsets = offsets
+        self.line_count = line_count
+        self.stride = stride
+
+    @staticmethod
+    def sidecar_path(path: str) -> str:
+        return path + SIDECAR_SUFFIX
+
+    @staticmethod
+    def source_stamp(path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    @classmethod
+    def build(cls, path: str, stride: int = LINE_STRIDE) -> 'LineIndex':
+        """Scan the file once for newlines and write its sidecar"""
+        size, mtime_ns = cls.source_stamp(path)
+        kept: List[np.ndarray] = [np.zeros(1, dtype=np.int64)]
+        lines_before = 0  # Newlines in the blocks already read
+        position = 0
+        last = b''
+        with open_input(path) as f:
+            while True:
+                block = f.read(READ_BLOCK_BYTES)
+                if not block:
+                    break
+                newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+                # The line after the newline at newlines[i] is line lines_before + i + 1
+                numbers = lines_before + 1 + np.arange(len(newlines), dtype=np.int64)
+                starts = position + newlines.astype(np.int64) + 1
+                kept.append(starts[numbers % stride == 0])
+                lines_before += len(newlines)
+                position += len(block)
+                last = block[-1:]
+        # A last line without a newline still counts
+        line_count = lines_before + (1 if last not in (b'', b'\n') else 0)
+
+        # A newline at the very end starts no line
+        offsets = np.concatenate(kept)
+        offsets = offsets[(offsets == 0) | (offsets < position)]
+        header = np.array([size, mtime_ns, stride, line_count], dtype=np.int64)
+        sidecar = cls.sidecar_path(path)
+        # A unique temporary name, as several processes may build the same sidecar
+        fd, part = tempfile.mkstemp(suffix='.part.npy', prefix=os.path.basename(sidecar) + '.',
+                                    dir=os.path.dirname(sidecar) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.concatenate([header, offsets]))
+            os.replace(part, sidecar)
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        return cls(path, (size, mtime_ns), offsets, line_count, stride)
+
+    @classmethod
+    def load(cls, path: str) -> 'LineIndex':
+        """Read the sidecar of path, building it first if it is missing or out of date"""
+        sidecar = cls.sidecar_path(path)
+        if os.path.exists(sidecar):
+            values = np.load(sidecar)
+            header = dict(zip(HEADER_FIELDS, values[:len(HEADER_FIELDS)].tolist()))
+            stamp = (header['source_size'], header['source_mtime_ns'])
+            if stamp == cls.source_stamp(path):
+                return cls(path, stamp, values[len(HEADER_FIELDS):], header['line_count'], header['stride'])
+        return cls.build(path)
+
+    def is_current(self) -> bool:
+        return self.source_stamp(self.path) == self.stamp
+
+    def read_lines(self, f: BinaryIO, start: int, count: int) -> List[bytes]:
+        """Read lines start to start + count - 1 (fewer at the end of the file) from f, without line endings.
+
+        f is opened with open_input; one that cannot seek (zstd) must be at
+        the start of the file and is read forward to the line.
+        """
+        if start >= self.line_count or count <= 0:
+            return []
+        offset = int(self.offsets[start // self.stride])
+        if f.seekable():
+            f.seek(offset)
+        else:
+            while offset > 0:
+                skipped = len(f.read(min(offset, READ_BLOCK_BYTES)))
+                if not skipped:
+                    break
+                offset -= skipped
+        for _ in range(start % self.stride):
+            f.readline()
+        lines = []
+        for _ in range(min(count, self.line_count - start)):
+            lines.append(f.readline().rstrip(b'\r\n'))
+        return lines
+
+# Indexes already loaded by this process, by path, and a lock per path so
+# building one file's index never holds up requests for other files
+loaded: Dict[str, LineIndex] = {}
+path_locks: Dict[str, threading.Lock] = {}
+loaded_lock = threading.Lock()
+
+def line_index(path: str) -> LineIndex:
+    """The line index of path, loaded once per process and rebuilt when the file changes"""
+    index = loaded.get(path)
+    if index is not None and index.is_current():
+        return index
+    with loaded_lock:
+        path_lock = path_locks.setdefault(path, threading.Lock())
+    with path_lock:
+        # Another request may have loaded it while this one waited
+        index = loaded.get(path)
+        if index is None or not index.is_current():
+            index = loaded[path] = LineIndex.load(path)
+        return index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build line-offset sidecars for data files")
+    parser.add_argument('files', nargs='+', help="CSV or text files to index, optionally .gz or .zst")
+    args = parser.parse_args()
+    for path in args.files:
+        index = LineIndex.build(path)
+        print(f"{path}: {index.line_count:,} lines, {len(index.offsets):,} offsets in {LineIndex.sidecar_path(path)}")
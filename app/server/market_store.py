@@ -0,0 +1,229 @@
+import argparse
+import glob
+import logging
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import pandas as pd
+
+try:
+    from .flights_schema import bump_data_generation, create_manifest_table, manifest_status
+except ImportError:
+    from flights_schema import bump_data_generation, create_manifest_table, manifest_status
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flights.db')
+MARKET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'market')
+MARKET_DATASET = 'db1b_market'
+
+# Writers wait this long for another loader's transaction instead of failing
+BUSY_TIMEOUT_SECONDS = 60
+
+# One row per line of a CITY_PAIR file
+MARKET_CITYPAIR_TABLE = '''
+    CREATE TABLE IF NOT EXISTS market_citypair (
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL CHECK (quarter BETWEEN 1 AND 4),
+        CITYPAIR CHAR(6) NOT NULL,  -- Both airports, alphabetical
+        OPCR CHAR(2) NOT NULL,
+        TKCR CHAR(2) NOT NULL,
+        PASSENGERS INTEGER NOT NULL,
+        PRIMARY KEY (year, quarter, CITYPAIR, OPCR, TKCR)
+    ) WITHOUT ROWID
+'''
+
+# Rollups, rebuilt or adjusted in the same transaction as each quarter's rows
+MARKET_YEARLY_TABLE = '''
+    CREATE TABLE IF NOT EXISTS market_citypair_yearly (
+        year INTEGER NOT NULL,
+        CITYPAIR CHAR(6) NOT NULL,
+        OPCR CHAR(2) NOT NULL,
+        TKCR CHAR(2) NOT NULL,
+        PASSENGERS INTEGER NOT NULL,
+        quarters INTEGER NOT NULL,  -- Loaded quarters the group appears in
+        PRIMARY KEY (year, CITYPAIR, OPCR, TKCR)
+    ) WITHOUT ROWID
+'''
+
+MARKET_TOTAL_TABLE = '''
+    CREATE TABLE IF NOT EXISTS market_citypair_total (
+        CITYPAIR CHAR(6) NOT NULL,
+        OPCR CHAR(2) NOT NULL,
+        TKCR CHAR(2) NOT NULL,
+        PASSENGERS INTEGER NOT NULL,
+        PRIMARY KEY (CITYPAIR, OPCR, TKCR)
+    ) WITHOUT ROWID
+'''
+
+# City pair lookups; PASSENGERS is included so the yearly query never touches the table
+MARKET_INDEXES = {
+    'idx_market_citypair': 'market_citypair(CITYPAIR, year, quarter)',
+    'idx_market_yearly_citypair': 'market_citypair_yearly(CITYPAIR, year, PASSENGERS)',
+}
+
+# Carrier groupings accepted by top_carriers
+CARRIER_GROUPS = {
+    'both': ['OPCR', 'TKCR'],
+    'operating': ['OPCR'],
+    'ticketing': ['TKCR'],
+}
+
+CITY_PAIR_FILE = re.compile(r'CITY_PAIR_(\d{4})_([1-4])\.(\d{8}_\d{6})\.txt$')
+
+def create_market_tables(conn: sqlite3.Connection) -> None:
+    for table in (MARKET_CITYPAIR_TABLE, MARKET_YEARLY_TABLE, MARKET_TOTAL_TABLE):
+        conn.execute(table)
+    for name, target in MARKET_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+    create_manifest_table(conn)
+
+def connect(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS)
+    # Like the flights writer, so API readers never block a commit
+    conn.execute('PRAGMA journal_mode = WAL')
+    create_market_tables(conn)
+    return conn
+
+def citypair_key(citypair: str) -> str:
+    """Normalize a six letter city pair (either airport first) to the stored alphabetical form"""
+    citypair = citypair.strip().upper()
+    if not re.fullmatch(r'[A-Z0-9]{6}', citypair):
+        raise ValueError(f"City pair must be two 3 letter airport codes, got '{citypair}'")
+    return ''.join(sorted([citypair[:3], citypair[3:]]))
+
+def adjust_totals(conn: sqlite3.Connection, key: Tuple[int, int], sign: int) -> None:
+    """Add (sign=1) or subtract (sign=-1) a quarter's rows to the all-time totals"""
+    conn.execute('''
+        INSERT INTO market_citypair_total (CITYPAIR, OPCR, TKCR, PASSENGERS)
+        SELECT CITYPAIR, OPCR, TKCR, ? * PASSENGERS
+        FROM market_citypair WHERE year = ? AND quarter = ?
+        ON CONFLICT (CITYPAIR, OPCR, TKCR) DO UPDATE SET
+            PASSENGERS = PASSENGERS + excluded.PASSENGERS
+    ''', (sign, key[0], key[1]))
+
+def rebuild_year(conn: sqlite3.Connection, year: int) -> None:
+    """Recompute the yearly rollup of one year from its loaded quarters"""
+    conn.execute('DELETE FROM market_citypair_yearly WHERE year = ?', (year,))
+    conn.execute('''
+        INSERT INTO market_citypair_yearly (year, CITYPAIR, OPCR, TKCR, PASSENGERS, quarters)
+        SELECT year, CITYPAIR, OPCR, TKCR, SUM(PASSENGERS), COUNT(*)
+        FROM market_citypair WHERE year = ?
+        GROUP BY CITYPAIR, OPCR, TKCR
+    ''', (year,))
+
+def record_outcome(conn: sqlite3.Connection, key: Tuple[int, int], source: str, status: str,
+                   row_count: Optional[int] = None, started: Optional[float] = None,
+                   message: Optional[str] = None) -> None:
+    """Record a market quarter in ingest_manifest and bump the data generation; the caller commits"""
+    now = datetime.now().isoformat(timespec='seconds')
+    conn.execute('''
+        INSERT OR REPLACE INTO ingest_manifest
+        (dataset, year, quarter, source_url, row_count, load_seconds, status, message, started_at, finished_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (MARKET_DATASET, key[0], key[1], source, row_count, time.time() - started if started else None,
+          status, message, datetime.fromtimestamp(started).isoformat(timespec='seconds') if started else now, now))
+    bump_data_generation(conn)
+
+def load_quarter(conn: sqlite3.Connection, year: int, quarter: int, result_df: pd.DataFrame,
+                 source: Optional[str] = None) -> int:
+    """Replace a quarter's city pair aggregates and update the rollups in one transaction.
+
+    result_df has the CITYPAIR, OPCR, TKCR and PASSENGERS columns written to
+    CITY_PAIR files. The rows a reload replaces are subtracted from the
+    all-time totals before the new ones are added, so only the quarter's
+    groups are touched; the year's rollup is recomputed from its quarters.
+    Returns the number of rows loaded.
+    """
+    key = (year, quarter)
+    started = time.time()
+    rows = zip(result_df['CITYPAIR'].astype(str).tolist(), result_df['OPCR'].astype(str).tolist(),
+               result_df['TKCR'].astype(str).tolist(), result_df['PASSENGERS'].astype('int64').tolist())
+    try:
+        replaced = conn.execute('SELECT COUNT(*) FROM market_citypair WHERE year = ? AND quarter = ?',
+                                key).fetchone()[0]
+        if replaced:
+            adjust_totals(conn, key, -1)
+            conn.execute('DELETE FROM market_citypair WHERE year = ? AND quarter = ?', key)
+
+        conn.executemany('''
+            INSERT INTO market_citypair (year, quarter, CITYPAIR, OPCR, TKCR, PASSENGERS)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', ((year, quarter) + row for row in rows))
+
+        adjust_totals(conn, key, 1)
+        if replaced:
+            # Groups that only existed in the replaced rows are now zero
+            conn.execute('DELETE FROM market_citypair_total WHERE PASSENGERS = 0')
+        rebuild_year(conn, year)
+        record_outcome(conn, key, source, 'complete', len(result_df), started)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(result_df)
+
+def loaded_quarters(conn: sqlite3.Connection) -> List[Tuple[int, int]]:
+    status = manifest_status(conn, MARKET_DATASET)
+    return sorted(key for key, value in status.items() if value == 'complete')
+
+def top_carriers(conn: sqlite3.Connection, citypair: str, year_range: Optional[Tuple[int, int]] = None,
+                 group: str = 'both', limit: int = 20) -> List[Dict[str, Any]]:
+    """Rank carriers on a city pair by passengers, over a range of years or all loaded data.
+
+    group chooses the CARRIER_GROUPS columns to rank by. A year range is
+    answered from the yearly rollup, no range from the all-time totals, both
+    through a city pair index rather than the quarterly rows.
+    """
+    columns = ', '.join(CARRIER_GROUPS[group])
+    if year_range is None:
+        query = f'''
+            SELECT {columns}, SUM(PASSENGERS) AS PASSENGERS
+            FROM market_citypair_total WHERE CITYPAIR = ?
+            GROUP BY {columns} ORDER BY PASSENGERS DESC, {columns} LIMIT ?
+        '''
+        params = (citypair_key(citypair), limit)
+    else:
+        query = f'''
+            SELECT {columns}, SUM(PASSENGERS) AS PASSENGERS
+            FROM market_citypair_yearly WHERE CITYPAIR = ? AND year BETWEEN ? AND ?
+            GROUP BY {columns} ORDER BY PASSENGERS DESC, {columns} LIMIT ?
+        '''
+        params = (citypair_key(citypair), year_range[0], year_range[1], limit)
+
+    cursor = conn.execute(query, params)
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+def read_city_pair_file(path: str) -> pd.DataFrame:
+    return pd.read_csv(path, sep='|', dtype={'CITYPAIR': str, 'OPCR': str, 'TKCR': str},
+                       keep_default_na=False)
+
+def latest_city_pair_files(market_dir: str = MARKET_DIR) -> Dict[Tuple[int, int], str]:
+    """Return the newest CITY_PAIR file in market_dir for each (year, quarter)"""
+    latest = {}
+    for path in sorted(glob.glob(os.path.join(market_dir, 'CITY_PAIR_*.txt'))):
+        match = CITY_PAIR_FILE.search(os.path.basename(path))
+        if match:
+            # Timestamps sort as text, so the last file seen is the newest
+            latest[(int(match.group(1)), int(match.group(2)))] = path
+    return latest
+
+if __name__ == "__main__":
+    # Load CITY_PAIR files already in data/market, newest per quarter
+    parser = argparse.ArgumentParser(description="Load CITY_PAIR files into the market tables of flights.db")
+    parser.add_argument('--force', action='store_true',
+                        help="Reload quarters even if the ingest manifest marks them complete")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    with connect() as conn:
+        done = set(loaded_quarters(conn))
+        for key, path in sorted(latest_city_pair_files().items()):
+            if key in done and not args.force:
+                logger.info(f"Skipping {key[0]} Q{key[1]}, already loaded")
+                continue
+            count = load_quarter(conn, key[0], key[1], read_city_pair_file(path), path)
+            logger.info(f"Loaded {count:,} city pair rows for {key[0]} Q{key[1]} from {os.path.basename(path)}")
@@ -0,0 +1,74 @@
+import contextlib
+import gzip
+import io
+import os
+from typing import BinaryIO, Iterator, Optional, TextIO, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstd output is optional
+    zstandard = None
+
+COMPRESSIONS = (None, 'gzip', 'zstd')
+EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+def check_compression(compression: Optional[str]) -> None:
+    """Raise if compression is unknown or its library is missing"""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}', expected one of {COMPRESSIONS}")
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError("zstd output needs zstandard: pip install zstandard")
+
+def output_path(path: str, compression: Optional[str]) -> str:
+    return path + EXTENSIONS[compression]
+
+def split_compression(path: str) -> Tuple[str, Optional[str]]:
+    """Split a compressed file's extension off, e.g. 'a.csv.gz' into ('a.csv', 'gzip')"""
+    for compression, extension in EXTENSIONS.items():
+        if compression and path.endswith(extension):
+            return path[:-len(extension)], compression
+    return path, None
+
+def open_input(path: str) -> BinaryIO:
+    """Open a file for binary reading, decompressing it if it ends in .gz or .zst.
+
+    A gzip file seeks by decompressing up to the offset, from the start when
+    seeking backwards; a zstd file cannot seek at all.
+    """
+    compression = split_compression(path)[1]
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("Reading .zst files needs zstandard: pip install zstandard")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
+
+@contextlib.contextmanager
+def open_output(path: str, compression: Optional[str] = None, level: Optional[int] = None) -> Iterator[TextIO]:
+    """Open a text file for writing, optionally gzip or zstd compressed.
+
+    Data goes to path + '.part', which replaces path only once the block
+    exits without an error; otherwise the partial file is removed. Newlines
+    are written untranslated.
+    """
+    check_compression(compression)
+    level = level or DEFAULT_LEVELS.get(compression)
+    part = f"{path}.part"
+    if compression == 'gzip':
+        f = gzip.open(part, 'wt', compresslevel=level, encoding='utf-8', newline='')
+    elif compression == 'zstd':
+        writer = zstandard.ZstdCompressor(level=level).stream_writer(open(part, 'wb'))
+        f = io.TextIOWrapper(writer, encoding='utf-8', newline='')
+    else:
+        f = open(part, 'w', encoding='utf-8', newline='')
+
+    try:
+        with f:
+            yield f
+        os.replace(part, path)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
@@ -0,0 +1,97 @@
+import collections
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_MB = 64
+DEFAULT_MAX_ENTRY_MB = 4
+DEFAULT_TTL_SECONDS = 300
+
+class ResponseCache:
+    """LRU cache of API response bodies, bounded by entries and bytes, with a TTL.
+
+    Each entry remembers the data generation it was built from. A lookup
+    with a newer generation (a quarter was loaded since) or after the TTL
+    is a miss and drops the entry, so a hit never predates the last ingest.
+    Bodies larger than max_entry_bytes are not cached. A body is stored as
+    sent, with its content encoding (None when it is not compressed).
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_mb: float = DEFAULT_MAX_MB,
+                 max_entry_mb: float = DEFAULT_MAX_ENTRY_MB, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_entry_bytes = int(max_entry_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        # key -> (generation, expires, mimetype, body, encoding), least recently used first
+        self.entries: 'collections.OrderedDict[Hashable, Tuple[Hashable, float, str, bytes, Optional[str]]]' = \
+            collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    @classmethod
+    def from_config(cls, server_config: Optional[Dict[str, Any]]) -> 'ResponseCache':
+        server_config = server_config or {}
+        return cls(server_config.get('cache_max_entries', DEFAULT_MAX_ENTRIES),
+                   server_config.get('cache_max_mb', DEFAULT_MAX_MB),
+                   server_config.get('cache_max_entry_mb', DEFAULT_MAX_ENTRY_MB),
+                   server_config.get('cache_ttl_seconds', DEFAULT_TTL_SECONDS))
+
+    def get(self, key: Hashable, generation: Hashable) -> Optional[Tuple[str, bytes, Optional[str]]]:
+        """Return (mimetype, body, encoding) cached for key at this generation, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counts['misses'] += 1
+                return None
+            entry_generation, expires, mimetype, body, encoding = entry
+            if entry_generation != generation or expires <= time.monotonic():
+                self.counts['invalidations' if entry_generation != generation else 'expirations'] += 1
+                self.counts['misses'] += 1
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            self.counts['hits'] += 1
+            return mimetype, body, encoding
+
+    def put(self, key: Hashable, generation: Hashable, mimetype: str, body: bytes,
+            encoding: Optional[str] = None) -> None:
+        if self.max_entries <= 0 or len(body) > self.max_entry_bytes:
+            return
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (generation, time.monotonic() + self.ttl_seconds, mimetype, body, encoding)
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.counts['evictions'] += 1
+
+    def remove(self, key: Hashable) -> None:
+        """Drop an entry; the caller holds the lock"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[3])
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.counts['hits'] + self.counts['misses']
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.counts['hits'],
+                'misses': self.counts['misses'],
+                'hit_rate': self.counts['hits'] / lookups if lookups else None,
+                'invalidations': self.counts['invalidations'],
+                'expirations': self.counts['expirations'],
+                'evictions': self.counts['evictions'],
+            }
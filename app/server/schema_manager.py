@@ -0,0 +1,131 @@
+import argparse
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+try:
+    from .flights_schema import OBSOLETE_INDEXES, SECONDARY_INDEXES
+    from .flights_summary import SUMMARY_INDEXES
+    from .market_store import DEFAULT_DB_PATH, MARKET_INDEXES
+except ImportError:
+    from flights_schema import OBSOLETE_INDEXES, SECONDARY_INDEXES
+    from flights_summary import SUMMARY_INDEXES
+    from market_store import DEFAULT_DB_PATH, MARKET_INDEXES
+
+# Every index the API's queries rely on, by name; each is only created once its table exists
+REQUIRED_INDEXES = {**SECONDARY_INDEXES, **SUMMARY_INDEXES, **MARKET_INDEXES}
+
+# Rows ANALYZE samples per index. Approximate statistics are enough for the
+# planner and keep a refresh to seconds on a database of many quarters.
+ANALYSIS_LIMIT = 1000
+
+# Startup maintenance gives up rather than wait long for a running ingest
+STARTUP_TIMEOUT_SECONDS = 5
+
+# What the statistics were computed from: the ingest manifest when ANALYZE last ran
+ANALYZE_STATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS analyze_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        manifest TEXT NOT NULL,
+        analyzed_at TEXT NOT NULL
+    )
+'''
+
+def table_names(conn: sqlite3.Connection) -> List[str]:
+    return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+def ensure_indexes(conn: sqlite3.Connection) -> List[str]:
+    """Create the required indexes that are missing on existing tables and return their names.
+
+    Obsolete indexes are dropped. A bulk load drops the flights indexes
+    until it finishes; while its staging tables exist they are left for
+    the loader to rebuild.
+    """
+    tables = set(table_names(conn))
+    if any(name.startswith('flights_staging_') for name in tables):
+        tables.discard('flights')
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    for name in OBSOLETE_INDEXES:
+        if name in indexes:
+            conn.execute(f'DROP INDEX {name}')
+    created = []
+    for name, target in REQUIRED_INDEXES.items():
+        if name not in indexes and target.split('(')[0] in tables:
+            conn.execute(f'CREATE INDEX {name} ON {target}')
+            created.append(name)
+    conn.commit()
+    return created
+
+def manifest_fingerprint(conn: sqlite3.Connection) -> str:
+    """Summary of the ingest manifest that changes whenever a quarter is loaded or reloaded"""
+    if 'ingest_manifest' not in table_names(conn):
+        return ''
+    count, finished = conn.execute("""
+        SELECT COUNT(*), MAX(finished_at) FROM ingest_manifest WHERE status = 'complete'
+    """).fetchone()
+    return f"{count}:{finished}"
+
+def statistics_stale(conn: sqlite3.Connection) -> bool:
+    """True if ANALYZE never ran, or quarters were loaded since it last did"""
+    tables = table_names(conn)
+    if 'sqlite_stat1' not in tables or 'analyze_state' not in tables:
+        return True
+    row = conn.execute('SELECT manifest FROM analyze_state WHERE id = 1').fetchone()
+    return row is None or row[0] != manifest_fingerprint(conn)
+
+def analyze(conn: sqlite3.Connection, limit: Optional[int] = ANALYSIS_LIMIT) -> None:
+    """Refresh the planner statistics, sampling limit rows per index (all rows if None)"""
+    conn.execute(f'PRAGMA analysis_limit = {limit or 0}')
+    conn.execute('ANALYZE')
+    conn.execute(ANALYZE_STATE_TABLE)
+    conn.execute("""
+        INSERT OR REPLACE INTO analyze_state (id, manifest, analyzed_at)
+        VALUES (1, ?, datetime('now'))
+    """, (manifest_fingerprint(conn),))
+    conn.commit()
+
+def prepare_database(db_path: str = DEFAULT_DB_PATH, force_analyze: bool = False,
+                     limit: Optional[int] = ANALYSIS_LIMIT,
+                     timeout: float = STARTUP_TIMEOUT_SECONDS) -> Dict[str, object]:
+    """Make sure the database is in WAL mode, the required indexes exist and the planner statistics are fresh.
+
+    Runs at server start and after an ingest, so API requests only read.
+    WAL keeps long API reads, e.g. a slow client of a streamed response,
+    from blocking a loader's commits; the mode persists in the file.
+    Does nothing if the database does not exist yet. Raises sqlite3.Error
+    if the database stays locked by a writer for longer than timeout.
+    """
+    if not os.path.exists(db_path):
+        return {'created': [], 'analyzed': False}
+    with contextlib.closing(sqlite3.connect(db_path, timeout=timeout)) as conn:
+        conn.execute('PRAGMA journal_mode = WAL')
+        created = ensure_indexes(conn)
+        analyzed = force_analyze or bool(created) or statistics_stale(conn)
+        if analyzed:
+            analyze(conn, limit)
+    return {'created': created, 'analyzed': analyzed}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create missing indexes and refresh planner statistics")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="Database path (default: app/server/flights.db)")
+    parser.add_argument('--analyze', action='store_true', help="Refresh statistics even if they look current")
+    parser.add_argument('--full', action='store_true', help="Analyze every row instead of a sample per index")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    if not os.path.exists(args.db):
+        raise SystemExit(f"{args.db} does not exist")
+
+    start = time.time()
+    result = prepare_database(args.db, args.analyze, None if args.full else ANALYSIS_LIMIT, timeout=60)
+    for name in result['created']:
+        logger.info(f"Created {name} on {REQUIRED_INDEXES[name]}")
+    if result['analyzed']:
+        logger.info("Refreshed planner statistics")
+    else:
+        logger.info("Indexes and statistics are up to date")
+    logger.info(f"Done in {time.time() - start:.1f}s")
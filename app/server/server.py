@@ -1,9 +1,57 @@
 # app/server/server.py
-from flask import Flask, send_from_directory, jsonify, request
+from flask import Flask, Response, abort, send_file, send_from_directory, jsonify, request, stream_with_context
+from werkzeug.security import safe_join
+import csv
+import functools
+import json
+import mimetypes
 import sqlite3
 import os
 import logging
 
+try:
+    from .flights_parquet import DEFAULT_PARQUET_DIR, FILTER_COLUMNS, QUERY_COLUMNS, pa, query_flights, scan_stats
+except ImportError:
+    from flights_parquet import DEFAULT_PARQUET_DIR, FILTER_COLUMNS, QUERY_COLUMNS, pa, query_flights, scan_stats
+
+try:
+    from .config_reader import ConfigReader
+    from .db_pool import ReadOnlyPool
+    from .flights_schema import database_version
+    from .http_encoding import (AVAILABLE_ENCODINGS, MIN_COMPRESS_BYTES, Encoder, compress, compressible,
+                                content_etag, current_sidecar, encode_stream, negotiate)
+    from .line_index import line_index
+    from .output_io import open_input, split_compression
+    from .response_cache import ResponseCache
+except ImportError:
+    from config_reader import ConfigReader
+    from db_pool import ReadOnlyPool
+    from flights_schema import database_version
+    from http_encoding import (AVAILABLE_ENCODINGS, MIN_COMPRESS_BYTES, Encoder, compress, compressible,
+                               content_etag, current_sidecar, encode_stream, negotiate)
+    from line_index import line_index
+    from output_io import open_input, split_compression
+    from response_cache import ResponseCache
+
+try:
+    from .flights_browse import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, browse_page, decode_cursor, iter_itineraries,
+                                 parse_filters)
+except ImportError:
+    from flights_browse import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, browse_page, decode_cursor, iter_itineraries,
+                                parse_filters)
+
+try:
+    from .flights_routes import DEFAULT_ROUTE_LIMIT, MAX_ROUTE_LIMIT, parse_route_filters, route_detail, top_routes
+except ImportError:
+    from flights_routes import DEFAULT_ROUTE_LIMIT, MAX_ROUTE_LIMIT, parse_route_filters, route_detail, top_routes
+
+try:
+    from .market_store import CARRIER_GROUPS, citypair_key, loaded_quarters, top_carriers
+    from .schema_manager import prepare_database
+except ImportError:
+    from market_store import CARRIER_GROUPS, citypair_key, loaded_quarters, top_carriers
+    from schema_manager import prepare_database
+
 app = Flask(__name__)
 
 # Setup logging
@@ -14,15 +62,181 @@ logger = app.logger
 SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
 CLIENT_DIR = os.path.join(os.path.dirname(SERVER_DIR), 'client')
 DATA_DIR = os.path.join(SERVER_DIR, 'data')
+DB_PATH = os.path.join(SERVER_DIR, 'flights.db')
+
+# Indexes and planner statistics are maintained once here; requests only read
+try:
+    schema_status = prepare_database(DB_PATH)
+    if schema_status['created']:
+        logger.info(f"Created indexes: {', '.join(schema_status['created'])}")
+    if schema_status['analyzed']:
+        logger.info("Refreshed planner statistics")
+except sqlite3.Error as e:
+    logger.warning(f"Could not prepare {DB_PATH}, run schema_manager.py once it is free: {str(e)}")
+
+# Requests borrow warm read-only connections instead of opening flights.db each time
+config = ConfigReader()
+server_config = config.config.get('server')
+db_pool = ReadOnlyPool.from_config(DB_PATH, server_config)
+
+# Repeated flights API requests are answered from memory until a quarter is loaded
+response_cache = ResponseCache.from_config(server_config)
+
+# The Parquet dataset the loader writes when ingest.sink is parquet
+PARQUET_DIR = config.ingest_config.get('parquet_dir') or DEFAULT_PARQUET_DIR
 
 # Create necessary directories
 os.makedirs(os.path.join(DATA_DIR, 'coupon'), exist_ok=True)
 os.makedirs(os.path.join(DATA_DIR, 'market'), exist_ok=True)
 
-def explain_sql(cursor, query, params=()):
-    """Helper function to explain query plans"""
-    cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
-    return cursor.fetchall()
+# Segments of one itinerary in every loaded quarter, found through idx_itinid
+ITINERARY_QUERY = """
+    SELECT year, quarter, ItinID, SeqNum, Coupons,
+           Origin, Dest, CouponType, TkCarrier,
+           OpCarrier, RPCarrier, Passengers
+    FROM {source}
+    WHERE ItinKey = ?
+    ORDER BY year, quarter, SeqNum
+"""
+
+# Itineraries sent by /api/flights/stream by default and at most
+STREAM_LIMIT = 100
+MAX_STREAM_LIMIT = 100000
+
+# Data file folders and the rows /api/data/rows returns by default and at most
+DATA_FOLDERS = ('coupon', 'market')
+DATA_PAGE_ROWS = 1000
+MAX_DATA_PAGE_ROWS = 10000
+
+# Streamed lines are sent in blocks of about this size
+STREAM_FLUSH_BYTES = 64 * 1024
+
+def flights_source(cursor):
+    """Return the relation to read decoded flights from and whether ItinIDs are stored as integers.
+
+    flights_decoded presents both storage layouts with text codes and a hex
+    ItinID; its ItinKey column is the stored ItinID, for indexed lookups.
+    Databases created before the view existed get an equivalent subquery.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE name IN ('flights_decoded', 'airports')")
+    names = {row[0] for row in cursor.fetchall()}
+    if 'flights_decoded' in names:
+        return 'flights_decoded', 'airports' in names
+    return '(SELECT *, ItinID AS ItinKey FROM flights)', False
+
+def data_version():
+    """Identify the data requests currently read: the database file, its id and its data generation"""
+    with db_pool.connection() as conn:
+        return (db_pool.file_id(), *database_version(conn))
+
+def cached(view):
+    """Serve a view's successful responses from response_cache, with ETags.
+
+    Entries are keyed on the endpoint, its URL arguments, the sorted query
+    parameters and the negotiated content encoding, and belong to the data
+    version read before the view ran, so a response built while a quarter
+    committed is never served after it. Cached bodies are stored encoded,
+    so a hit is not compressed again. The ETag is derived from the same key
+    and data version, so If-None-Match is answered with a 304 before the
+    view runs. Streamed responses are cached once they have been sent in
+    full.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            version = data_version()
+        except (OSError, sqlite3.Error):
+            # No database yet; the view reports it
+            return view(*args, **kwargs)
+        key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+        encoding = negotiate(request.accept_encodings)
+        etag = content_etag((key, version), encoding)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
+        hit = response_cache.get((key, encoding), version)
+        if hit is not None:
+            mimetype, body, stored_encoding = hit
+            response = Response(body, mimetype=mimetype)
+            if stored_encoding:
+                response.headers['Content-Encoding'] = stored_encoding
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if response.is_streamed:
+                response.response = cache_stream(response.response, (key, encoding), version, response.mimetype,
+                                                 encoding)
+                response.headers.pop('Content-Length', None)
+                if encoding:
+                    response.headers['Content-Encoding'] = encoding
+            else:
+                if encoding and len(response.get_data()) >= MIN_COMPRESS_BYTES:
+                    encode_response(response, encoding)
+                response_cache.put((key, encoding), version, response.mimetype, response.get_data(),
+                                   response.headers.get('Content-Encoding'))
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        return response
+    return wrapper
+
+def cache_stream(chunks, key, version, mimetype, encoding=None):
+    """Pass a streamed body through, optionally encoded, caching what was sent if it completes without an error line and fits an entry"""
+    encoder = Encoder(encoding) if encoding else None
+    body, size, last = [], 0, b''
+    for chunk in chunks:
+        last = chunk.encode() if isinstance(chunk, str) else chunk
+        out = encoder.encode(last, flush=True) if encoder else last
+        yield out
+        if body is not None:
+            body.append(out)
+            size += len(out)
+            if size > response_cache.max_entry_bytes:
+                body = None
+    if encoder:
+        out = encoder.finish()
+        yield out
+        if body is not None:
+            body.append(out)
+    # Streams report a failure as a final {"error": ...} chunk
+    if body is not None and not last.startswith(b'{"error"'):
+        response_cache.put(key, version, mimetype, b''.join(body), encoding)
+
+def encode_response(response, encoding):
+    """Compress a response's body in encoding, a streamed body chunk by chunk as it is sent"""
+    if response.is_streamed:
+        response.response = encode_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compress JSON and text responses in the best encoding the client accepts.
+
+    Files are sent as they are stored (see send_data_file for their
+    precompressed sidecars), and responses already encoded by cached are
+    left alone.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or not compressible(response.mimetype)
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding and (response.is_streamed or len(response.get_data()) >= MIN_COMPRESS_BYTES):
+        encode_response(response, encoding)
+    return response
+
+def itin_key(itin_id, compact):
+    """Convert a hex ItinID from a URL into the stored ItinID"""
+    return int(itin_id, 16) if compact else itin_id
 
 @app.route('/')
 def root():
@@ -32,13 +246,25 @@ def root():
 def serve_static(path):
     return send_from_directory('../client', path)
 
+def is_data_file(folder_dir, name, extensions):
+    """Whether name is a data file with one of extensions, as written or gzip/zstd compressed.
+
+    A compressed copy next to its uncompressed file, such as a gzip
+    CITY_PAIR sibling or a precompressed sidecar (see http_encoding.py),
+    is not a file of its own.
+    """
+    base, compression = split_compression(name)
+    if not base.endswith(extensions):
+        return False
+    return compression is None or not os.path.exists(os.path.join(folder_dir, base))
+
 @app.route('/api/data/coupon')
 def list_coupon_files():
     files = []
     coupon_dir = os.path.join(DATA_DIR, 'coupon')
     try:
         for f in os.listdir(coupon_dir):
-            if f.endswith('.csv'):
+            if is_data_file(coupon_dir, f, ('.csv',)):
                 file_path = os.path.join(coupon_dir, f)
                 files.append({
                     'name': f,
@@ -54,7 +280,7 @@ def list_market_files():
     market_dir = os.path.join(DATA_DIR, 'market')
     try:
         for f in os.listdir(market_dir):
-            if f.endswith('.csv') or f.endswith('.txt'):
+            if is_data_file(market_dir, f, ('.csv', '.txt')):
                 file_path = os.path.join(market_dir, f)
                 files.append({
                     'name': f,
@@ -64,24 +290,122 @@ def list_market_files():
         logger.error(f"Error listing market files: {str(e)}")
     return jsonify(files)
 
+def send_data_file(folder, filename):
+    """Send a data file, or its precompressed sidecar when one is current and the client accepts its encoding.
+
+    Files answer Range requests (206 Partial Content) and If-None-Match
+    (304). A Range request always gets the file as stored, so byte ranges
+    refer to the uncompressed data. The ETag is derived from the file's
+    size and mtime and the encoding sent.
+    """
+    path = safe_join(os.path.join(DATA_DIR, folder), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    sidecars = {}
+    if not request.range:
+        for encoding in AVAILABLE_ENCODINGS:
+            sidecar = current_sidecar(path, encoding)
+            if sidecar:
+                sidecars[encoding] = sidecar
+    encoding = negotiate(request.accept_encodings, list(sidecars)) if sidecars else None
+    etag = content_etag(('file', stat.st_size, stat.st_mtime_ns), encoding)
+    if encoding:
+        response = send_file(sidecars[encoding], mimetype=mimetypes.guess_type(filename)[0] or 'text/plain',
+                             etag=etag, conditional=True)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_file(path, etag=etag, conditional=True)
+    if sidecars:
+        response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/api/data/coupon/<path:filename>')
 def serve_coupon_data(filename):
-    return send_from_directory(os.path.join(DATA_DIR, 'coupon'), filename)
+    return send_data_file('coupon', filename)
 
 @app.route('/api/data/market/<path:filename>')
 def serve_market_data(filename):
-    return send_from_directory(os.path.join(DATA_DIR, 'market'), filename)
+    return send_data_file('market', filename)
+
+@app.route('/api/data/rows/<folder>/<path:filename>')
+def read_data_rows(folder, filename):
+    """Rows start to start + count - 1 of a coupon or market file, optionally only some columns.
+
+    Rows are numbered from 0 after the header line. The file's line-offset
+    sidecar (built on first use, see line_index.py) locates the first row,
+    so any page costs the same however far into the file it is. Compressed
+    files (.csv.gz, .csv.zst) are decompressed up to the page instead.
+    """
+    path = safe_join(os.path.join(DATA_DIR, folder), filename) if folder in DATA_FOLDERS else None
+    if path is None or not split_compression(path)[0].endswith(('.csv', '.txt')) or not os.path.isfile(path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    try:
+        start = int(request.args.get('start', 0))
+        count = min(int(request.args.get('count', DATA_PAGE_ROWS)), MAX_DATA_PAGE_ROWS)
+        if start < 0 or count < 1:
+            raise ValueError("start must be at least 0 and count at least 1")
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+    
+    # Pages of an unchanged file are the same bytes, so their ETag is the file's size and mtime plus the request
+    stat = os.stat(path)
+    encoding = negotiate(request.accept_encodings)
+    etag = content_etag(('rows', folder, filename, stat.st_size, stat.st_mtime_ns,
+                         tuple(sorted(request.args.items(multi=True)))), encoding)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    
+    try:
+        index = line_index(path)
+        # Opened once per read, as a zstd file can only be read forward from its start
+        with open_input(path) as f:
+            header = index.read_lines(f, 0, 1)
+        with open_input(path) as f:
+            lines = index.read_lines(f, start + 1, count)
+        header = header[0].decode('utf-8') if header else ''
+        # CITY_PAIR files are pipe delimited, the CSVs comma delimited
+        delimiter = '|' if '|' in header else ','
+        columns = next(csv.reader([header], delimiter=delimiter), [])
+        rows = list(csv.reader((line.decode('utf-8') for line in lines), delimiter=delimiter))
+        
+        selected = request.args.get('columns')
+        if selected:
+            selected = selected.split(',')
+            unknown = [name for name in selected if name not in columns]
+            if unknown:
+                return jsonify({'error': f"Unknown columns: {', '.join(unknown)}"}), 400
+            positions = [columns.index(name) for name in selected]
+            columns = selected
+            rows = [[row[i] if i < len(row) else '' for i in positions] for row in rows]
+        
+        response = jsonify({
+            'file': filename,
+            'delimiter': delimiter,
+            'columns': columns,
+            'start': start,
+            'total_rows': max(index.line_count - 1, 0),
+            'rows': rows
+        })
+        response.set_etag(etag)
+        return response
+    
+    except Exception as e:
+        logger.error(f"Error reading rows of {folder}/{filename}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/flights/test')
+@cached
 def test_flights_db():
     try:
-        db_path = os.path.join(SERVER_DIR, 'flights.db')
+        db_path = DB_PATH
         logger.info(f"Checking database at: {db_path}")
         
         if not os.path.exists(db_path):
             return jsonify({'error': 'Database file not found'}), 404
             
-        with sqlite3.connect(db_path) as conn:
+        with db_pool.connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='flights'")
@@ -104,84 +428,99 @@ def test_flights_db():
 
 
 @app.route('/api/flights/stream')
+@cached
 def stream_flights():
-    try:
-        logger.info("Starting to stream flights...")
-        db_path = os.path.join(SERVER_DIR, 'flights.db')
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            
-            query = """
-                WITH sample_itineraries AS (
-                    SELECT DISTINCT ItinID 
-                    FROM flights 
-                    ORDER BY year DESC, quarter DESC
-                    LIMIT 100
-                )
-                SELECT f.year, f.quarter, f.ItinID, f.SeqNum, f.Coupons,
-                       f.Origin, f.Dest, f.CouponType, f.TkCarrier, 
-                       f.OpCarrier, f.RPCarrier, f.Passengers
-                FROM flights f
-                JOIN sample_itineraries si ON f.ItinID = si.ItinID
-                ORDER BY f.ItinID, f.SeqNum
-            """
-            
-            # Show query plan
-            plan = explain_sql(cursor, query)
-            logger.info(f"Query plan: {plan}")
-            
-            cursor.execute(query)
-            columns = [description[0] for description in cursor.description]
-            
-            # Group results by ItinID
-            results = {}
-            for row in cursor.fetchall():
-                row_dict = dict(zip(columns, row))
-                itin_id = row_dict['ItinID']
-                if itin_id not in results:
-                    results[itin_id] = []
-                results[itin_id].append(row_dict)
-            
-            logger.info(f"Sending {len(results)} itineraries...")
-            return jsonify(results)
-            
-    except Exception as e:
-        logger.error(f"Error streaming flights: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+    """Stream the most recent itineraries as NDJSON, one itinerary per line.
 
+    Each line is {"year": ..., "quarter": ..., "ItinID": ..., "flights": [...]}
+    with the itinerary's segments in SeqNum order. Lines come in browse order
+    (newest quarter first) as the rows are read, so memory stays flat for any
+    limit; the browse filters (year, quarter, origin, carrier) apply too. An
+    error after the response has started is sent as a final {"error": ...} line.
+    """
+    try:
+        limit = min(int(request.args.get('limit', STREAM_LIMIT)), MAX_STREAM_LIMIT)
+        if limit < 1:
+            raise ValueError(f"limit must be positive, got {limit}")
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+    if not os.path.exists(DB_PATH):
+        return jsonify({'error': 'Database file not found'}), 404
+    
+    logger.info(f"Starting to stream up to {limit} itineraries...")
+    return Response(stream_with_context(itinerary_lines(filters, limit)), mimetype='application/x-ndjson')
 
+def itinerary_lines(filters, limit):
+    """Yield NDJSON itineraries in blocks of about STREAM_FLUSH_BYTES, the first one on its own"""
+    sent = 0
+    try:
+        with db_pool.connection() as conn:
+            source, compact = flights_source(conn.cursor())
+            block, block_bytes = [], 0
+            # Keys come off a covering index in order and each itinerary is one
+            # primary key lookup, so no step sorts or holds the whole result
+            for _, itinerary in iter_itineraries(conn, source, filters, None, limit, compact):
+                line = json.dumps(itinerary) + '\n'
+                block.append(line)
+                block_bytes += len(line)
+                sent += 1
+                if sent == 1 or block_bytes >= STREAM_FLUSH_BYTES:
+                    yield ''.join(block)
+                    block, block_bytes = [], 0
+            if block:
+                yield ''.join(block)
+        logger.info(f"Sent {sent} itineraries")
+    
+    except Exception as e:
+        logger.error(f"Error streaming flights after {sent} itineraries: {str(e)}")
+        yield json.dumps({'error': str(e)}) + '\n'
 
+@app.route('/api/flights/itineraries')
+@cached
+def browse_itineraries():
+    """Page through itineraries newest quarter first, with keyset cursors.
 
+    page_size sets the itineraries per page and year, quarter, origin and
+    carrier filter on the itinerary's first coupon. The response's next
+    cursor is passed back as after= for the following page; it is null
+    after the last page. Every page costs the same however deep it is.
+    """
+    if not os.path.exists(DB_PATH):
+        return jsonify({'error': 'Database file not found'}), 404
+    
+    try:
+        page_size = min(int(request.args.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise ValueError(f"page_size must be positive, got {page_size}")
+        filters = parse_filters(request.args)
+        with db_pool.connection() as conn:
+            source, compact = flights_source(conn.cursor())
+            after = request.args.get('after')
+            after = decode_cursor(after, compact) if after else None
+            page = browse_page(conn, source, filters, after, page_size, compact)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+    except Exception as e:
+        logger.error(f"Error browsing itineraries: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify(page)
 
 @app.route('/api/flights/stream/<itin_id>')
+@cached
 def stream_flights_by_itin(itin_id):
     try:
         logger.info(f"Looking up ItinID: {itin_id}")
-        db_path = os.path.join(SERVER_DIR, 'flights.db')
-        with sqlite3.connect(db_path) as conn:
+        with db_pool.connection() as conn:
             cursor = conn.cursor()
+            source, compact = flights_source(cursor)
+            try:
+                key = itin_key(itin_id, compact)
+            except ValueError:
+                return jsonify({'error': f'Invalid ItinID: {itin_id}'}), 400
             
-            # Create index for ItinID if it doesn't exist
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_itinid 
-                ON flights(ItinID, year, quarter, SeqNum)
-            """)
-            
-            query = """
-                SELECT year, quarter, ItinID, SeqNum, Coupons,
-                       Origin, Dest, CouponType, TkCarrier, 
-                       OpCarrier, RPCarrier, Passengers
-                FROM flights 
-                INDEXED BY idx_itinid
-                WHERE ItinID = ?
-                ORDER BY year, quarter, SeqNum
-            """
-            
-            # Show query plan
-            plan = explain_sql(cursor, query, (itin_id,))
-            logger.info(f"Query plan: {plan}")
-            
-            cursor.execute(query, (itin_id,))
+            cursor.execute(ITINERARY_QUERY.format(source=source), (key,))
             columns = [description[0] for description in cursor.description]
             results = [dict(zip(columns, row)) for row in cursor.fetchall()]
             logger.info(f"Found {len(results)} segments for ItinID {itin_id}")
@@ -191,11 +530,172 @@ def stream_flights_by_itin(itin_id):
         logger.error(f"Error looking up ItinID {itin_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/routes')
+@cached
+def list_routes():
+    """Routes with the most passengers, from flights.db.
+
+    origin, dest and carrier filter the coupons counted; role says whether
+    carrier is the ticketing (default), operating or reporting carrier.
+    year_from/quarter_from and year_to/quarter_to limit the quarters, and
+    limit caps the routes returned.
+    """
+    if not os.path.exists(DB_PATH):
+        return jsonify({'error': 'Database file not found'}), 404
+    
+    try:
+        filters = parse_route_filters(request.args)
+        limit = min(int(request.args.get('limit', DEFAULT_ROUTE_LIMIT)), MAX_ROUTE_LIMIT)
+        if limit < 1:
+            raise ValueError(f"limit must be positive, got {limit}")
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+    
+    try:
+        with db_pool.connection() as conn:
+            _, compact = flights_source(conn.cursor())
+            routes = top_routes(conn, filters, limit, compact)
+        return jsonify({'role': filters['role'], 'routes': routes})
+    
+    except Exception as e:
+        logger.error(f"Error querying routes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/routes/<origin>/<dest>')
+@cached
+def get_route(origin, dest):
+    """Passenger totals of one directional route, carrier shares and passengers per quarter.
+
+    Takes the same carrier, role and quarter range parameters as /api/routes.
+    """
+    if not os.path.exists(DB_PATH):
+        return jsonify({'error': 'Database file not found'}), 404
+    
+    try:
+        filters = parse_route_filters(dict(request.args.items(), origin=origin, dest=dest))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+    
+    try:
+        with db_pool.connection() as conn:
+            _, compact = flights_source(conn.cursor())
+            return jsonify(route_detail(conn, filters, compact))
+    
+    except Exception as e:
+        logger.error(f"Error querying route {origin}-{dest}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/parquet/flights')
+def query_parquet_flights():
+    """Query the Parquet flights dataset with predicate and column pushdown.
+
+    Equality filters are passed by column name (?Origin=ATL&Dest=LAX), years
+    as year_from/year_to, the columns to return as a comma separated list
+    and the row cap as limit. With explain=1 the response also reports how
+    many files and row groups the filters leave to read.
+    """
+    if pa is None:
+        return jsonify({'error': 'Parquet queries need pyarrow'}), 501
+    if not os.path.isdir(PARQUET_DIR):
+        return jsonify({'error': 'Parquet dataset not found'}), 404
+    
+    try:
+        filters = {}
+        for name in FILTER_COLUMNS:
+            value = request.args.get(name)
+            if value is not None:
+                filters[name] = int(value) if name in ('year', 'quarter') else value.upper()
+        
+        year_range = None
+        if 'year_from' in request.args or 'year_to' in request.args:
+            year_range = (int(request.args.get('year_from', 0)), int(request.args.get('year_to', 9999)))
+        
+        columns = request.args.get('columns')
+        columns = columns.split(',') if columns else QUERY_COLUMNS
+        unknown = [name for name in columns if name not in QUERY_COLUMNS]
+        if unknown:
+            return jsonify({'error': f"Unknown columns: {', '.join(unknown)}"}), 400
+        
+        limit = min(int(request.args.get('limit', 1000)), 100000)
+        if limit < 1:
+            raise ValueError(f"limit must be positive, got {limit}")
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+    
+    try:
+        rows = query_flights(PARQUET_DIR, filters, year_range, columns, limit)
+        result = {'count': len(rows), 'rows': rows}
+        if request.args.get('explain') == '1':
+            result['scan'] = scan_stats(PARQUET_DIR, filters, year_range)
+        logger.info(f"Parquet query {filters} {year_range} returned {len(rows)} rows")
+        return jsonify(result)
+    
+    except Exception as e:
+        logger.error(f"Error querying Parquet flights: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/market/citypairs/<citypair>/carriers')
+def market_top_carriers(citypair):
+    """Top carriers on a city pair by passengers, from the market rollup tables.
+
+    The city pair is two airport codes in either order (ATLLAX or LAXATL).
+    year_from/year_to limit the years, otherwise all loaded quarters count;
+    by=operating or by=ticketing ranks single carriers instead of
+    operating/ticketing combinations.
+    """
+    if not os.path.exists(DB_PATH):
+        return jsonify({'error': 'Database file not found'}), 404
+    
+    try:
+        citypair = citypair_key(citypair)
+        year_range = None
+        if 'year_from' in request.args or 'year_to' in request.args:
+            year_range = (int(request.args.get('year_from', 0)), int(request.args.get('year_to', 9999)))
+        group = request.args.get('by', 'both')
+        if group not in CARRIER_GROUPS:
+            return jsonify({'error': f"by must be one of {', '.join(CARRIER_GROUPS)}"}), 400
+        limit = min(int(request.args.get('limit', 20)), 1000)
+        if limit < 1:
+            raise ValueError(f"limit must be positive, got {limit}")
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameter: {str(e)}'}), 400
+    
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='market_citypair_total'")
+            if not cursor.fetchone():
+                return jsonify({'error': 'Market tables not found'}), 404
+            
+            carriers = top_carriers(conn, citypair, year_range, group, limit)
+            quarters = [key for key in loaded_quarters(conn)
+                        if year_range is None or year_range[0] <= key[0] <= year_range[1]]
+        
+        return jsonify({
+            'citypair': citypair,
+            'quarters': [f"{year} Q{quarter}" for year, quarter in quarters],
+            'carriers': carriers
+        })
+    
+    except Exception as e:
+        logger.error(f"Error querying carriers for {citypair}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """Response cache counters and the data version entries are currently built from"""
+    stats = response_cache.stats()
+    try:
+        stats['data_generation'] = data_version()[2]
+    except (OSError, sqlite3.Error):
+        stats['data_generation'] = None
+    stats['db_pool'] = db_pool.stats()
+    return jsonify(stats)
+
 @app.route('/api/flights/explain')
 def explain_query_plans():
     try:
-        db_path = os.path.join(SERVER_DIR, 'flights.db')
-        with sqlite3.connect(db_path) as conn:
+        with db_pool.connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute("EXPLAIN QUERY PLAN SELECT COUNT(*) FROM flights")
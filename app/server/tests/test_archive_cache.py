@@ -0,0 +1,192 @@
+import hashlib
+import http.server
+import os
+import re
+import threading
+import time
+
+import pytest
+
+from archive_cache import ArchiveCache
+from archive_io import make_session
+
+DOWNLOAD_CONFIG = {
+    'verify_ssl': False,
+    'timeout': 10,
+    'retry_attempts': 2,
+    'retry_delay': 0.01,
+    'block_size_kb': 64,
+    'max_segments': 4,
+    'min_segment_mb': 1,
+}
+
+ARCHIVE_BYTES = 4 * 1024 * 1024
+
+class UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the files of server.root with strong ETags, 304s and Range/If-Range support"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def respond(self, body: bool):
+        path = os.path.join(self.server.root, self.path.lstrip('/'))
+        if not os.path.exists(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.server.requests.append((self.command, 304, 0))
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start, end, status = 0, len(data) - 1, 200
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            start, status = int(match[1]), 206
+            end = int(match[2]) if match[2] else end
+        self.server.requests.append((self.command, status, end - start + 1 if body else 0))
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.end_headers()
+        if not body:
+            return
+        for offset in range(start, end + 1, 64 * 1024):
+            self.wfile.write(data[offset:min(offset + 64 * 1024, end + 1)])
+            if self.server.delay:
+                time.sleep(self.server.delay)
+
+@pytest.fixture
+def upstream(tmp_path):
+    root = tmp_path / 'upstream'
+    root.mkdir()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+    server.root = str(root)
+    server.requests = []
+    server.delay = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = lambda name: f'http://127.0.0.1:{server.server_address[1]}/{name}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def publish(upstream, name: str, size: int = ARCHIVE_BYTES) -> bytes:
+    data = os.urandom(size)
+    with open(os.path.join(upstream.root, name), 'wb') as f:
+        f.write(data)
+    return data
+
+def downloaded_bytes(upstream) -> int:
+    return sum(size for method, _, size in upstream.requests if method == 'GET')
+
+def fetch(cache: ArchiveCache, url: str, should_exit=None):
+    result = cache.fetch(make_session(DOWNLOAD_CONFIG), url, DOWNLOAD_CONFIG, should_exit)
+    cache.release(result['path'])
+    return result
+
+def test_unchanged_archive_is_revalidated_not_downloaded(upstream, tmp_path):
+    data = publish(upstream, 'a.zip')
+    cache = ArchiveCache(str(tmp_path / 'cache'))
+
+    first = fetch(cache, upstream.url('a.zip'))
+    assert first['sha256'] == hashlib.sha256(data).hexdigest()
+    assert downloaded_bytes(upstream) == len(data)
+
+    upstream.requests.clear()
+    second = fetch(cache, upstream.url('a.zip'))
+    assert second == first
+    assert upstream.requests == [('HEAD', 304, 0)]
+
+def test_changed_archive_is_downloaded_again(upstream, tmp_path):
+    publish(upstream, 'a.zip')
+    cache = ArchiveCache(str(tmp_path / 'cache'))
+    fetch(cache, upstream.url('a.zip'))
+
+    data = publish(upstream, 'a.zip')
+    upstream.requests.clear()
+    result = fetch(cache, upstream.url('a.zip'))
+    assert result['sha256'] == hashlib.sha256(data).hexdigest()
+    assert downloaded_bytes(upstream) == len(data)
+    with open(result['path'], 'rb') as f:
+        assert f.read() == data
+
+def test_interrupted_download_resumes(upstream, tmp_path):
+    data = publish(upstream, 'a.zip')
+    cache = ArchiveCache(str(tmp_path / 'cache'))
+
+    upstream.delay = 0.02
+    start = time.time()
+    with pytest.raises(KeyboardInterrupt):
+        fetch(cache, upstream.url('a.zip'), should_exit=lambda: time.time() - start > 0.3)
+    assert not os.path.exists(cache.entry_path(upstream.url('a.zip')))
+
+    upstream.delay = 0
+    upstream.requests.clear()
+    result = fetch(cache, upstream.url('a.zip'))
+    assert result['sha256'] == hashlib.sha256(data).hexdigest()
+    assert 0 < downloaded_bytes(upstream) < len(data)
+
+def test_concurrent_fetches_download_once(upstream, tmp_path):
+    # Separate caches on one directory stand in for separate processes: the
+    # entry locks are taken per open file, so they exclude each other the same way
+    data = publish(upstream, 'a.zip')
+    upstream.delay = 0.005
+    results = []
+
+    def worker():
+        results.append(fetch(ArchiveCache(str(tmp_path / 'cache')), upstream.url('a.zip')))
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [result['sha256'] for result in results] == [hashlib.sha256(data).hexdigest()] * 3
+    assert downloaded_bytes(upstream) == len(data)
+    assert upstream.requests.count(('HEAD', 304, 0)) == 2
+
+def test_eviction_keeps_archives_pinned_by_another_cache(upstream, tmp_path):
+    publish(upstream, 'a.zip')
+    publish(upstream, 'b.zip')
+    cache_dir = str(tmp_path / 'cache')
+    loader = ArchiveCache(cache_dir)
+    # Room for one archive only
+    other = ArchiveCache(cache_dir, max_size_mb=ARCHIVE_BYTES * 1.5 / 1024 / 1024)
+
+    pinned = loader.fetch(make_session(DOWNLOAD_CONFIG), upstream.url('a.zip'), DOWNLOAD_CONFIG)
+    fetch(other, upstream.url('b.zip'))
+    assert os.path.exists(pinned['path'])
+
+    loader.release(pinned['path'])
+    other.evict()
+    assert not os.path.exists(pinned['path'])
+    assert os.path.exists(other.entry_path(upstream.url('b.zip')))
+
+def test_eviction_skips_archive_being_fetched(upstream, tmp_path):
+    publish(upstream, 'a.zip')
+    publish(upstream, 'b.zip')
+    cache_dir = str(tmp_path / 'cache')
+    cache = ArchiveCache(cache_dir)
+    fetch(cache, upstream.url('a.zip'))
+    fetch(cache, upstream.url('b.zip'))
+    path = cache.entry_path(upstream.url('a.zip'))
+
+    small = ArchiveCache(cache_dir, max_size_mb=0)
+    with ArchiveCache(cache_dir).entry_lock(path):
+        small.evict()
+        assert os.path.exists(path)
+    small.evict()
+    assert not any(name.endswith('.zip') for name in os.listdir(cache_dir))